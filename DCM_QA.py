@@ -14,6 +14,9 @@
 #       A - 2013-07-04 - WL - Original Creation, loose class and function definitions
 #       B - 2013-10-21 - WL - Default tolerance for numbers is 1% unless otherwise specified
 #       C - 2015-03-19 - WL - Added to GitHub
+#       D - 2026-10-18 - Job journal, resumable batch runs (--journal, --resume)
+#       E - 2026-10-18 - Failed dcmdump reads are not stored in the header index
+#       F - 2026-10-18 - Sinks fsync'd before the journal entry of a block
 
 
 # NOTES
@@ -22,20 +25,60 @@
 #        - Rows / Cols specifies reconnstructed image matrix
 #        - In the case of MOSAIC Rows/Cols will also be multiplied by the 'montage' view
 #     2) BATCH CALL
-#   for dir in /data8/mrdata/MR160/MR160-*-*; do echo ${dir}; echo ${dir} >> QA_log.txt; ./POND_QA.py ${dir} >> QA_log.txt ; done
+#   ./DCM_QA.py -j 8 --batch '/data8/mrdata/MR160/MR160-*-*' >> QA_log.txt
+#        - Subject name / ID are taken from the directory name (ie. MR160-088-0002-01 -> MR160-088-0002, 01)
+#        - Scans are spread over -j worker processes, output stays in subject / scan order
 #     3) Should this program check all dicoms?
-#        - Right now just checks first and last to make sure stuff makes sense
+#        - By default just checks first and last to make sure stuff makes sense
+#        - --full reads every file and checks for dropped slices, TR/TE/orientation changes
+#          mid-series and irregular slice spacing (see dcm_series.py)
+#        - --pixel adds image quality metrics per series (tSNR / drift / spikes, SNR / ghosting),
+#          reported alongside PASS / FAIL but not checked against scan_params.cfg
+#        - On high latency storage (NFS) --prefetch 64 reads headers of upcoming scans / files on
+#          threads ahead of the checks (see dcm_prefetch.py), results are still used in order
+#          With -j each worker process has one prefetcher, reading ahead within the scan it is on
+#        - --fp_store qa_fingerprints.db remembers protocol fingerprints of series that pass, per scan
+#          type and site, later clones pass the parameter rules on one lookup (see dcm_fingerprint.py)
+#          Seed it with a run over golden reference sessions, then use --fp_no_learn if preferred
+#     4) WATCH CALL
+#   nohup ./DCM_QA.py --watch /data8/mrdata/MR160 >> QA_log.txt &
+#        - Each new series is QA'd once it has stopped growing for --settle seconds (see dcm_watch.py)
+#     5) Slow runs - --profile prints per-stage counts, totals and p50/p95/p99 to stderr at exit
+#        (list, read_hdr, get_FOV_RES, full, rules, sink), --profile_out also writes them to file
+#     6) Long batches - --journal qa_journal.jsonl records each scan once its results are out,
+#        after a crash the same command with --resume only QAs the scans not in the journal
+#        (see dcm_journal.py). Not used in watch mode
 
 
 from optparse import OptionParser, Option, OptionValueError
 import datetime
 import string
 import glob
-import os, shlex, subprocess
+import os, sys, shlex, subprocess
 import numpy
+import itertools
+import multiprocessing
+import Queue
+import dcm_read
+import dcm_index
+import dcm_series
+import dcm_rules
+import dcm_scan_type
+import dcm_watch
+import dcm_sink
+import dcm_profile
+import dcm_pixel
+import dcm_prefetch
+import dcm_fingerprint
+import dcm_journal
 
 program_name = 'POND_QA.py'
 
+hdr_index_worker = None
+hdr_prefetch = None
+queue_prefetch = None       # tasks of a worker process, for its prefetch producer
+RULE_BLOCK = 256        # scans per vectorized rule check
+
 #*************************************************************************************
 # FUNCTIONS
 
@@ -127,6 +170,7 @@ def load_MR_params(fname_scan_params, subj_name, subj_id):
     lut_dcm_hdr['SliceThick'] = '0018,0050'
     lut_dcm_hdr['SliceSpace'] = '0018,0088'
     lut_dcm_hdr['SliceLocation'] = '0020,1041'
+    lut_dcm_hdr['ImagePosition'] = '0020,0032'
     lut_dcm_hdr['MOSAIC_slices'] = '0019,100a'
 
     lut_scans = {}
@@ -139,45 +183,81 @@ def load_MR_params(fname_scan_params, subj_name, subj_id):
             if not line_values[1]=='scan_type':
                 lut_scans[line_values[1]]  = {};
                 for count_hdr in range(1,(len(line_values)-2) ):
-                    if line_values[count_hdr+1].find('-')>-1:
-                        lut_scans[line_values[1]] [line_headers[count_hdr+1]] = {}
-                        lut_scans[line_values[1]] [line_headers[count_hdr+1]]['min'] = line_values[count_hdr+1].split('-')[0]
-                        lut_scans[line_values[1]] [line_headers[count_hdr+1]]['max'] = line_values[count_hdr+1].split('-')[1]
-                    elif line_values[count_hdr+1].find(',')>-1:
-                        lut_scans[line_values[1]] [line_headers[count_hdr+1]] = line_values[count_hdr+1].split(',')
-                    else:
-                        lut_scans[line_values[1]] [line_headers[count_hdr+1]] = line_values[count_hdr+1]
+                    # compiled once into a typed rule (see dcm_rules.py)
+                    lut_scans[line_values[1]] [line_headers[count_hdr+1]] = \
+                        dcm_rules.compile_rule(line_headers[count_hdr+1], line_values[count_hdr+1])
                     
     return lut_scans, lut_dcm_hdr, lut_ID_fields
 
-def get_dcm_value(full_name_dcm, lut_tags):
-    valid_chars = '-_%s%s' % (string.ascii_letters, string.digits)
+def get_dcm_value(full_name_dcm, lut_tags, backend='native', hdr_index=None):
+# Pull typed dicom header values, through the header index when given one
+    list_tags = lut_tags.values()
+    if backend == 'native':
+        read_func = read_dcm_hdr
+    else:
+        read_func = get_dcm_value_dcmdump
+    if hdr_prefetch is not None:
+        read_direct = read_func
+        read_func = lambda full_name_dcm, list_tags: hdr_prefetch.get(get_prefetch_key(full_name_dcm, list_tags), \
+            read_direct, full_name_dcm, list_tags)
+    with dcm_profile.timer('read_hdr'):
+        if hdr_index is not None:
+            dcm_values = hdr_index.get_values(full_name_dcm, list_tags, read_func)
+        else:
+            dcm_values = read_func(full_name_dcm, list_tags)
+
+    tag_values = {}
+    for curr_tag in lut_tags:
+        tag_values[curr_tag] = dcm_values[lut_tags[curr_tag]]
+    return tag_values
+
+
+def read_dcm_hdr(full_name_dcm, list_tags, cache=1):
+# Native reader with dcmdump as fallback backend
+    try:
+        return dcm_read.read_dcm_tags(full_name_dcm, list_tags, cache)
+    except (dcm_read.DcmReadError, EnvironmentError):
+        # anything the native reader can't handle goes through dcmdump
+        return get_dcm_value_dcmdump(full_name_dcm, list_tags)
 
+
+def get_dcm_value_dcmdump(full_name_dcm, list_tags):
     # Create string of tags to find 
     cmd_tags = '+P 0008,0070'       # Manufacturer tag)
-    for curr_tag in lut_tags:
-        cmd_tags = "%s +P %s" % (cmd_tags, lut_tags[curr_tag])
+    for curr_tag in list_tags:
+        cmd_tags = "%s +P %s" % (cmd_tags, curr_tag)
     
     # Probe dicom header  for values
     cmd_dcmdump = 'dcmdump +L %s %s' % (cmd_tags, full_name_dcm)
     output, errors = run_cmd(cmd_dcmdump,0, 0)
     # print cmd_dcmdump, output, errors
     
-    # extract dcm tag values from OUTPUT
-    tag_values = {}
-    for curr_tag in lut_tags:
-        curr_tag_start = output.find(lut_tags[curr_tag])
-        if curr_tag_start > -1:   # Value is in header, find location of closest [ and ]
-            if curr_tag.find('AcquisitionMatrix')>-1 or curr_tag.find('Rows')>-1 or curr_tag.find('Cols')>-1 or \
-                (curr_tag.find('MOSAIC_slices')>-1 ):    
-            # No [ ] around values
-                tag_values[curr_tag] = output[curr_tag_start:curr_tag_start+40].split(' ')[2]
-            else:
-                tag_start = output.find('[',curr_tag_start) +1
-                tag_stop = output.find(']',curr_tag_start)
-                tag_values[curr_tag] = output[tag_start:tag_stop]
-        else:     # value is not in header
-            tag_values[curr_tag] = "NULL"
+    # extract dcm tag values from OUTPUT, one element per line
+    #   (0018,0080) DS [2300]                    #   4, 1 RepetitionTime
+    #   (0028,0010) US 64                        #   2, 1 Rows
+    dump_values = {}
+    for line in output.split('\n'):
+        line = line.strip()
+        if not line.startswith('(') or len(line) < 15:
+            continue
+        dcm_tag = line[1:10].lower()
+        if dcm_tag in dump_values:      # first occurrence only (ie. not nested in a sequence)
+            continue
+        vr = line[12:14]
+        line_value = line[15:line.rfind('#')].strip()
+        if line_value.startswith('['):
+            line_value = line_value[1:line_value.rfind(']')]
+        elif line_value.startswith('(no value'):
+            line_value = ''
+        dump_values[dcm_tag] = dcm_read.convert_text(vr, line_value)
+
+    if len(dump_values) == 0:
+        # dcmdump missing or failed, all NULL - not kept in the header index
+        tag_values = dcm_index.UncachedValues()
+    else:
+        tag_values = {}
+    for curr_tag in list_tags:
+        tag_values[curr_tag] = dump_values.get(curr_tag, "NULL")   # NULL if value is not in header
 
     return tag_values
 
@@ -186,18 +266,18 @@ def get_FOV_RES(tag_values, num_dcm, params_out):
 # Function to determine orientation (rough), fov, and resolution based on dcm header info
 
     # If no SliceSpace field, make slicespace equal slice thicknes
-    if tag_values['first']['SliceSpace'].find('NULL')>-1:
+    if tag_values['first']['SliceSpace'] == 'NULL':
         tag_values['first']['SliceSpace'] = tag_values['first']['SliceThick']
 
         
         
-    if tag_values['first']['ImageType'].find('MOSAIC')>-1:
-        params_out['NUM_VOL'] = len(list_files_curr_scan)
+    if 'MOSAIC' in tag_values['first']['ImageType']:
+        params_out['NUM_VOL'] = num_dcm
         num_slices = int(tag_values['first']['MOSAIC_slices'])
-        rows = max(int(tag_values['first']['AcquisitionMatrix'].split('\\')[0]), \
-            int(tag_values['first']['AcquisitionMatrix'].split('\\')[1]))
-        cols = max(int(tag_values['first']['AcquisitionMatrix'].split('\\')[2]), \
-            int(tag_values['first']['AcquisitionMatrix'].split('\\')[3]))
+        rows = max(int(tag_values['first']['AcquisitionMatrix'][0]), \
+            int(tag_values['first']['AcquisitionMatrix'][1]))
+        cols = max(int(tag_values['first']['AcquisitionMatrix'][2]), \
+            int(tag_values['first']['AcquisitionMatrix'][3]))
     else:
         params_out['NUM_VOL'] = int(tag_values['last']['AcquisitionNumber'])
         num_slices = num_dcm / int(tag_values['last']['AcquisitionNumber'])
@@ -205,17 +285,13 @@ def get_FOV_RES(tag_values, num_dcm, params_out):
         cols = tag_values['first']['Cols']
 
 # First need to figure out slice direction 
-    dircos_row = numpy.array([float(tag_values['first']['ImageOrient'].split('\\')[0]),\
-        float(tag_values['first']['ImageOrient'].split('\\')[1]),\
-        float(tag_values['first']['ImageOrient'].split('\\')[2])])
-    dircos_col = numpy.array([float(tag_values['first']['ImageOrient'].split('\\')[3]),\
-        float(tag_values['first']['ImageOrient'].split('\\')[4]),\
-        float(tag_values['first']['ImageOrient'].split('\\')[5])])
+    dircos_row = numpy.array(tag_values['first']['ImageOrient'][0:3], dtype=float)
+    dircos_col = numpy.array(tag_values['first']['ImageOrient'][3:6], dtype=float)
     # Slices are in the direction with no in-plane vector (ie. lowest absolute direction cosine)
     slice_dir_index = numpy.argmin(abs(dircos_row) + abs(dircos_col))
 
-    pixel_size_row = float(tag_values['first']['PixelSpacing'].split('\\')[0])
-    pixel_size_col = float(tag_values['first']['PixelSpacing'].split('\\')[1])
+    pixel_size_row = float(tag_values['first']['PixelSpacing'][0])
+    pixel_size_col = float(tag_values['first']['PixelSpacing'][1])
         
     if slice_dir_index==0:
         params_out['ORIENT'] = "SAG"
@@ -255,7 +331,7 @@ def get_FOV_RES(tag_values, num_dcm, params_out):
     params_out['TR'] = float(tag_values['first']['TR'])
     params_out['TE'] = float(tag_values['first']['TE'])
     params_out['FA'] = float(tag_values['first']['FA'])    
-    if tag_values['first']['TI'].find('NULL')>-1:
+    if tag_values['first']['TI'] == 'NULL':
         params_out['TI'] = tag_values['first']['TI']
     else:
         params_out['TI'] = float(tag_values['first']['TI'])    
@@ -263,37 +339,324 @@ def get_FOV_RES(tag_values, num_dcm, params_out):
     return params_out
 
 
+def match_ID_value(tag_value, ID_value):
+# Header values are typed (ie. PatientSize is DS), target values are strings from the config
+    if type(tag_value) in [float,int]:
+        try:
+            return tag_value == float(ID_value)
+        except ValueError:
+            return 0
+    return tag_value == ID_value
+
+
 def check_patient_info(tag_values, lut_ID_fields, SCAN_PASS, SCAN_LOG):
     for ID_field in lut_ID_fields:
-        if tag_values[ID_field] != lut_ID_fields[ID_field]:
+        if not match_ID_value(tag_values[ID_field], lut_ID_fields[ID_field]):
             SCAN_PASS = 0
             SCAN_LOG = SCAN_LOG + ['        [%s] : %s != %s : FAIL' % \
                     (ID_field, lut_ID_fields[ID_field], tag_values[ID_field]) ]
     return SCAN_PASS, SCAN_LOG
 
 
-def check_scan_type(dir_curr_scan_clean, scan_type):
-# Function to check if current scan needs to be QA's
-    list_ignore = ['_ADC','_TRACEW','_FA','_ColFA']   # processed DTI scans to ignore
-
-    QA_THIS_SCAN = 1
-    list_scan_type = scan_type.split(',')
-    # make sure all keywords present in directory name
-    for scan_keywords in list_scan_type:
-        if dir_curr_scan_clean.find(scan_keywords)<0:
-            QA_THIS_SCAN = 0
+def qa_scan(dir_subj_in, dir_curr_scan, scan_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, options, hdr_index):
+# QA one scan directory of a subject, returns one record per matching scan type
+#   parameter rules are checked afterwards on many records at once (check_scan_records)
+    list_records = []
+    # Scan types matching the directory name, ADC, TRACEW, FA, ColFA scans are ignored
+    for scan_type in dcm_scan_type.classify_scan(scan_classifier, dir_curr_scan):
+        SCAN_PASS = 1 # RESET SCAN PASS BOOLEAN
+        SCAN_LOG = []
+        tag_values = {}
+        params_out = {}
+        pixel_metrics = {}
+        fingerprint = None
+        
+        fdir_curr_scan = "%s/%s" % (dir_subj_in , dir_curr_scan)
+        
+    # Check number of dicoms / mosaic format / number of slices
+        with dcm_profile.timer('list'):
+            list_files_curr_scan = dcm_series.list_series_files(fdir_curr_scan, options.ext_type.split(','), options.sniff)
+        num_dcm = len(list_files_curr_scan)
+        if num_dcm == 0:
+            SCAN_PASS = 0
+            SCAN_LOG = SCAN_LOG + ['        [NUM_DCM] : no dicoms found : FAIL']
+        else:
+            # Pull dicom header values of potential interest
+            tag_values['first'] = get_dcm_value(list_files_curr_scan[0], lut_dcm_hdr, options.backend, hdr_index)
+            tag_values['last']  = get_dcm_value(list_files_curr_scan[-1], lut_dcm_hdr, options.backend, hdr_index)
             
-    # make sure all ignore words are absent in directory name
-    for ignore_keywords in list_ignore:
-        if dir_curr_scan_clean.find(ignore_keywords)>-1:
-            QA_THIS_SCAN = 0
-
-    # ignore any scan with the following keywords
+            # Extract parameters of interest from dicom header                
+            with dcm_profile.timer('get_FOV_RES'):
+                params_out = get_FOV_RES(tag_values, num_dcm, params_out)
+            fingerprint = dcm_fingerprint.get_fingerprint(params_out, tag_values['first'])
             
-    return QA_THIS_SCAN
-    
+            # Check patient info
+            SCAN_PASS, SCAN_LOG = check_patient_info(tag_values['first'], lut_ID_fields, SCAN_PASS, SCAN_LOG)
+
+            # Check consistency across every file of the series
+            if options.full:
+                with dcm_profile.timer('full'):
+                    lut_full_hdr = {}
+                    for field in dcm_series.lut_full_fields:
+                        lut_full_hdr[field] = lut_dcm_hdr[field]
+                    hdr_series = dcm_series.load_series_hdr(list_files_curr_scan, \
+                        lambda fname_dcm: get_dcm_value(fname_dcm, lut_full_hdr, options.backend, hdr_index))
+                    SCAN_PASS, SCAN_LOG = dcm_series.check_series_full(hdr_series, \
+                        'MOSAIC' in tag_values['first']['ImageType'], options.TOL, SCAN_PASS, SCAN_LOG)
+
+            # Image quality metrics, informational only
+            if options.pixel:
+                with dcm_profile.timer('pixel'):
+                    pixel_metrics = get_pixel_metrics(list_files_curr_scan, tag_values['first'], params_out)
+
+        list_records.append({'dir_subj': dir_subj_in, 'dir_scan': dir_curr_scan, 'scan_type': scan_type, \
+            'num_dcm': num_dcm, 'params_out': params_out, 'SCAN_PASS': SCAN_PASS, 'SCAN_LOG': SCAN_LOG, \
+            'pixel_metrics': pixel_metrics, 'fingerprint': fingerprint})
+
+    return list_records
+
+
+def get_pixel_metrics(list_files_curr_scan, tag_values_first, params_out):
+# Pixel QA of a series (see dcm_pixel.py), {'error': ...} if its pixel data can't be read
+    is_mosaic = 'MOSAIC' in tag_values_first['ImageType']
+    num_vol = params_out['NUM_VOL']
+    if is_mosaic:
+        num_slices = int(tag_values_first['MOSAIC_slices'])
+    else:
+        num_slices = len(list_files_curr_scan) // max(num_vol, 1)
+    try:
+        return dcm_pixel.series_metrics(list_files_curr_scan, num_vol, num_slices, is_mosaic, \
+            tag_values_first['PhaseDir'])
+    except (dcm_read.DcmReadError, EnvironmentError, ValueError), e:
+        return {'error': str(e)}
+
+
+def check_scan_records(list_records, lut_scans, TOL, verbose, fp_store=None):
+# Check parameters of many scans against the compiled rules, one vectorized pass per scan type
+#   scans with a known good protocol fingerprint (fp_store) skip the rules
+    lut_rows = {}
+    lut_rules_hash = {}
+    for count_record in range(len(list_records)):
+        record = list_records[count_record]
+        scan_type = record['scan_type']
+        if fp_store is not None and record.get('fingerprint') is not None:
+            if scan_type not in lut_rules_hash:
+                lut_rules_hash[scan_type] = dcm_fingerprint.get_rules_hash(lut_scans[scan_type], TOL)
+            if fp_store.is_known(scan_type, dcm_fingerprint.get_site(record['dir_subj']), \
+                    lut_rules_hash[scan_type], record['fingerprint']):
+                record['param_known'] = 1
+                record['param_PASS'] = dict((param_field, True) for param_field in lut_scans[scan_type] \
+                    if param_field in record['params_out'])
+                record['param_rule'] = dict((param_field, lut_scans[scan_type][param_field]['text']) \
+                    for param_field in record['param_PASS'])
+                if verbose:
+                    record['SCAN_LOG'] = record['SCAN_LOG'] + ['        [FINGERPRINT] : %s known : PASS' % \
+                        (record['fingerprint'],)]
+                continue
+        lut_rows.setdefault(scan_type, []).append(count_record)
+
+    for scan_type in lut_rows:
+        list_rows = lut_rows[scan_type]
+        list_fields, pass_matrix = dcm_rules.evaluate_rules(lut_scans[scan_type], \
+            [list_records[count_record]['params_out'] for count_record in list_rows], TOL)
+        for count_row in range(len(list_rows)):
+            record = list_records[list_rows[count_row]]
+            record['param_PASS'] = {}
+            record['param_rule'] = {}
+            for count_field in range(len(list_fields)):
+                param_field = list_fields[count_field]
+                param_PASS = pass_matrix[count_row, count_field]
+                record['param_PASS'][param_field] = bool(param_PASS)
+                record['param_rule'][param_field] = lut_scans[scan_type][param_field]['text']
+                if not param_PASS:
+                    record['SCAN_PASS'] = 0
+                    record['SCAN_LOG'] = record['SCAN_LOG'] + ['        [%s] : %s != %s : FAIL' % \
+                        (param_field, lut_scans[scan_type][param_field]['text'], record['params_out'][param_field] ) ]
+                elif verbose:
+                    record['SCAN_LOG'] = record['SCAN_LOG'] + ['        [%s] : %s == %s : PASS' % \
+                        (param_field, lut_scans[scan_type][param_field]['text'], record['params_out'][param_field] ) ]
+            if fp_store is not None and record.get('fingerprint') is not None and pass_matrix[count_row].all():
+                fp_store.add(scan_type, dcm_fingerprint.get_site(record['dir_subj']), \
+                    dcm_fingerprint.get_rules_hash(lut_scans[scan_type], TOL), record['fingerprint'], \
+                    '%s/%s' % (record['dir_subj'], record['dir_scan']))
+    return list_records
+
+
+def write_scan_records(list_sinks, list_records, run_time):
+# Structured output of checked scans, sinks buffer and write in batches
+    with dcm_profile.timer('sink'):
+        for sink in list_sinks:
+            for record in list_records:
+                sink.write(dcm_sink.flatten_record(record, run_time))
+
+
+def format_scan_record(record):
+# Output lines for a checked scan
+    if record['SCAN_PASS']:
+        list_lines = ['    %s - PASS' % (record['dir_scan'],)]
+    else:
+        list_lines = ['    %s - FAIL' % (record['dir_scan'],)] + record['SCAN_LOG']
+    pixel_metrics = record.get('pixel_metrics')
+    if pixel_metrics and 'error' in pixel_metrics:
+        list_lines.append('        [PIXEL] : %s : SKIPPED' % (pixel_metrics['error'],))
+    elif pixel_metrics:
+        list_lines.append('        [PIXEL] : %s' % (', '.join(['%s = %s' % (metric, pixel_metrics[metric]) \
+            for metric in sorted(pixel_metrics)]),))
+    return list_lines
+
+
+def get_scan_outcome(list_records, scan_key):
+# Journal outcome of a scan directory from its checked records
+    list_PASS = [record['SCAN_PASS'] for record in list_records if (record['dir_subj'], record['dir_scan']) == tuple(scan_key)]
+    if len(list_PASS) == 0:
+        return 'NOT CHECKED'
+    if min(list_PASS):
+        return 'PASS'
+    return 'FAIL'
+
+
+def parse_subject_dir(dir_subj_in):
+# Subject name and ID from the session directory name, same layout fix_dcm_brainCODE.py uses
+#   ie. /data8/mrdata/MR160/MR160-088-0002-01 -> MR160-088-0002, 01
+    list_ID = dir_subj_in.rstrip('/').split('/')[-1].split('-')
+    if len(list_ID) < 2:
+        raise SystemExit, 'ERROR - Cannot parse subject name / ID from directory: %s' % (dir_subj_in,)
+    return '-'.join(list_ID[:-1]), list_ID[-1]
+
+
+def get_prefetch_key(full_name_dcm, list_tags):
+    return (full_name_dcm, tuple(sorted(list_tags)))
+
+
+def read_prefetch_native(key):
+# Runs on prefetch threads, so bypasses the (single threaded) mapped file cache
+    return read_dcm_hdr(key[0], list(key[1]), 0)
+
+
+def read_prefetch_dcmdump(key):
+    return get_dcm_value_dcmdump(key[0], list(key[1]))
+
+
+def iter_prefetch_keys(list_tasks, fname_index):
+# Header reads qa_scan is going to make, in the same order
+#   runs on the prefetch producer thread, files already in the header index are skipped
+    hdr_index = None
+    if fname_index:
+        hdr_index = dcm_index.DcmIndex(fname_index)     # own connection, SQLite objects stay on their thread
+    for dir_subj_in, dir_curr_scan, scan_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, options in list_tasks:
+        if len(dcm_scan_type.classify_scan(scan_classifier, dir_curr_scan)) == 0:
+            continue
+        list_files_curr_scan = dcm_series.list_series_files("%s/%s" % (dir_subj_in , dir_curr_scan), \
+            options.ext_type.split(','), options.sniff)
+        if len(list_files_curr_scan) == 0:
+            continue
+        list_keys = [get_prefetch_key(list_files_curr_scan[0], lut_dcm_hdr.values()), \
+            get_prefetch_key(list_files_curr_scan[-1], lut_dcm_hdr.values())]
+        if options.full:
+            list_full_tags = [lut_dcm_hdr[field] for field in dcm_series.lut_full_fields]
+            list_keys = list_keys + [get_prefetch_key(full_name_dcm, list_full_tags) for full_name_dcm in list_files_curr_scan]
+        for key in list_keys:
+            if hdr_index is not None:
+                stored_values = hdr_index.lookup_all(dcm_index.get_file_key(key[0]))
+                if stored_values is not None and len([dcm_tag for dcm_tag in key[1] if dcm_tag not in stored_values]) == 0:
+                    continue
+            yield key
+
+
+def start_prefetch(list_tasks, options):
+# Read headers of upcoming tasks ahead on --prefetch_threads threads
+    global hdr_prefetch
+    if options.prefetch > 0:
+        if options.backend == 'native':
+            read_func = read_prefetch_native
+        else:
+            read_func = read_prefetch_dcmdump
+        hdr_prefetch = dcm_prefetch.Prefetcher(read_func, iter_prefetch_keys(list_tasks, options.fname_index), \
+            options.prefetch_threads, options.prefetch)
+
+
+def stop_prefetch():
+    global hdr_prefetch
+    if hdr_prefetch is not None:
+        hdr_prefetch.close()
+        hdr_prefetch = None
+
+
+def iter_queue(queue_tasks):
+# Tasks as the worker process starts them, until None
+    while True:
+        task = queue_tasks.get()
+        if task is None:
+            return
+        yield task
+
+
+def init_worker(fname_index, options=None):
+# Each worker process opens its own header index, and with --prefetch starts one prefetcher
+#   that reads ahead within each scan the process is handed (threads end with the process)
+    global hdr_index_worker, queue_prefetch
+    hdr_index_worker = None
+    if fname_index:
+        hdr_index_worker = dcm_index.DcmIndex(fname_index)
+    if options is not None and options.prefetch > 0:
+        queue_prefetch = Queue.Queue()
+        start_prefetch(iter_queue(queue_prefetch), options)
+
+
+def qa_scan_worker(task):
+    dir_subj_in, dir_curr_scan, scan_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, options = task
+    if queue_prefetch is not None:
+        queue_prefetch.put(task)
+    with dcm_profile.timer('qa_scan'):
+        list_records = qa_scan(dir_subj_in, dir_curr_scan, scan_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, \
+            options, hdr_index_worker)
+    if hdr_index_worker is not None:
+        hdr_index_worker.commit()     # workers are never closed cleanly by the pool
+    return list_records, dcm_profile.drain()    # stage timings travel back with the records
+
+
+def run_watch(dir_root, options, list_sinks, fp_store):
+# Daemon mode, QA each new series under dir_root once it has stopped growing
+    init_worker(options.fname_index)
+    scan_classifier = None
+    for dir_series in dcm_watch.watch_series(dir_root, options.settle, options.poll, not options.no_inotify):
+        dir_subj_in, dir_curr_scan = dir_series.rsplit('/', 1)
+        try:
+            subj_name, subj_id = parse_subject_dir(dir_subj_in)
+            lut_scans, lut_dcm_hdr, lut_ID_fields = load_MR_params(options.fname_scan_params, subj_name, subj_id)
+            if scan_classifier is None:
+                scan_classifier = dcm_scan_type.build_classifier(sorted(lut_scans))
+            with dcm_profile.timer('qa_scan'):
+                list_records = qa_scan(dir_subj_in, dir_curr_scan, scan_classifier, lut_scans, lut_dcm_hdr, \
+                    lut_ID_fields, options, hdr_index_worker)
+            with dcm_profile.timer('rules'):
+                list_records = check_scan_records(list_records, lut_scans, options.TOL, options.verbose, fp_store)
+        except (SystemExit, Exception), e:
+            # one bad series must not stop the daemon
+            print '%s\n    %s - ERROR : %s' % (dir_subj_in, dir_curr_scan, e)
+            sys.stdout.flush()
+            continue
+
+        if hdr_index_worker is not None:
+            hdr_index_worker.commit()
+        if fp_store is not None:
+            fp_store.flush()
+        if len(list_records) > 0:
+            run_time = dcm_sink.get_run_time()
+            write_scan_records(list_sinks, list_records, run_time)
+            for sink in list_sinks:
+                sink.flush()
+            print '%s    [%s]' % (dir_subj_in, run_time)
+            for record in list_records:
+                for line in format_scan_record(record):
+                    print line
+            sys.stdout.flush()
+
+
 if __name__ == '__main__' :
     usage = "Usage: "+program_name+" <options> subject_name subject_id subject_directory\n"+\
+            "   or  [BATCH MODE] "+program_name+" <options> --batch subject_directory_or_glob [...]\n"+\
+            "   or  [WATCH MODE] "+program_name+" <options> --watch study_directory\n"+\
             "   or  "+program_name+" -help";
     parser = OptionParser(usage)
     parser.add_option("-c","--clobber", action="store_true", dest="clobber",
@@ -306,8 +669,48 @@ if __name__ == '__main__' :
                         default="scan_params.cfg", help="Acceptable scan parameters[default = scan_params.cfg]")
     parser.add_option("-e", "--ext",type="string", dest="ext_type",
                         default="dcm,DCM,ima,IMA", help="Allowable dicom file extension [default = dcm,DCM,ima,IMA]")
+    parser.add_option("--sniff", action="store_true", dest="sniff",
+                        default=0, help="Find dicoms by DICM magic instead of file extension (ie. files with no extension)")
     parser.add_option("-v","--verbose", action="store_true", dest="verbose",
                         default=0, help="Verbose output")
+    parser.add_option("--backend", type="choice", dest="backend", choices=['native','dcmdump'],
+                        default="native", help="DICOM header reader, native or dcmdump [default = native]")
+    parser.add_option("--index", type="string", dest="fname_index",
+                        default="dcm_hdr_index.db", help="Header index, reused across runs, empty string to disable [default = dcm_hdr_index.db]")
+    parser.add_option("-b","--batch", action="store_true", dest="batch",
+                        default=0, help="Batch mode, arguments are subject directories or globs, subject name / ID taken from directory name")
+    parser.add_option("-j","--num_proc", type="int", dest="num_proc",
+                        default=1, help="Number of worker processes [default = 1]")
+    parser.add_option("--prefetch", type="int", dest="prefetch",
+                        default=0, help="Read headers of upcoming files ahead, at most this many in flight, 0 = off (ie. 64 on NFS) [default = 0]")
+    parser.add_option("--prefetch_threads", type="int", dest="prefetch_threads",
+                        default=8, help="Threads issuing --prefetch reads [default = 8]")
+    parser.add_option("--fp_store", type="string", dest="fname_fp_store",
+                        default="", help="Known good protocol fingerprints (SQLite), known series skip the parameter rules [default = off]")
+    parser.add_option("--fp_no_learn", action="store_true", dest="fp_no_learn",
+                        default=0, help="Only use --fp_store, don't add fingerprints of series that pass")
+    parser.add_option("--full", action="store_true", dest="full",
+                        default=0, help="Check consistency of every file in a series, not just first and last")
+    parser.add_option("--pixel", action="store_true", dest="pixel",
+                        default=0, help="Also compute image quality metrics (tSNR, drift, spikes / SNR, ghosting), see dcm_pixel.py")
+    parser.add_option("--watch", action="store_true", dest="watch",
+                        default=0, help="Watch mode, keep running and QA new series under the study directory as they land")
+    parser.add_option("--settle", type="float", dest="settle",
+                        default=120, help="Watch mode, seconds a series must stop growing before QA [default = 120]")
+    parser.add_option("--poll", type="float", dest="poll",
+                        default=5, help="Watch mode, seconds between checks [default = 5]")
+    parser.add_option("--no_inotify", action="store_true", dest="no_inotify",
+                        default=0, help="Watch mode, poll with stat() even if inotify is available")
+    parser.add_option("-o","--out", type="string", dest="list_out", action="append",
+                        default=[], help="Structured QA results, .jsonl / .csv / .db (SQLite), appended to, can be repeated")
+    parser.add_option("--journal", type="string", dest="fname_journal",
+                        default="", help="Append each finished scan to this job journal (.jsonl) [default = off]")
+    parser.add_option("--resume", action="store_true", dest="resume",
+                        default=0, help="Skip scans already in --journal, ie. after a crashed batch")
+    parser.add_option("--profile", action="store_true", dest="profile",
+                        default=0, help="Time each stage, summary printed to stderr at exit")
+    parser.add_option("--profile_out", type="string", dest="fname_profile",
+                        default="", help="Also write the stage timings to a .json or .csv file (implies --profile)")
     # parser.add_option("--pinfo", type="string", dest="pinfo",
                         # help="File containing processing parameters")
     # parser.add_option("--info", type="string", dest="info",
@@ -325,102 +728,108 @@ if __name__ == '__main__' :
 
 # # Parse input arguments and store them
     options, args = parser.parse_args()     
+    dcm_profile.setup(options.profile, options.fname_profile)
         
 # # Example of checking for proper number of arguments
-    if len(args) != 3:
-        parser.error("incorrect number of arguments")
-    
-    subj_name, subj_id, dir_subj_in = args
-
-    
-    list_dir_scan = os.listdir(dir_subj_in)
-    list_dir_scan.sort()
-    num_dir_scan = len(list_dir_scan)
-   
-    if dir_subj_in[-1] == '/':
-        dir_subj_in = dir_subj_in[0:len(dir_subj_in)-1]
-
-    lut_scans, lut_dcm_hdr, lut_ID_fields = load_MR_params(options.fname_scan_params, subj_name, subj_id)
-    
-    for dir_curr_scan in list_dir_scan:
-        dir_curr_scan_clean = dir_curr_scan.replace('-','_')   # remove variability of - or _
-        
-        SCAN_PASS = 1 # RESET SCAN PASS BOOLEAN
-        SCAN_LOG = []
-        tag_values = {}
-        for scan_type in lut_scans:
-            scan_type = scan_type.replace('-','_')
-            
-            QA_THIS_SCAN = check_scan_type(dir_curr_scan_clean, scan_type)
-            # Check scan type
-            
-            if QA_THIS_SCAN:
-                # ignore ADC, TRACEW, FA, ColFA scans
-                
-                fdir_curr_scan = "%s/%s" % (dir_subj_in , dir_curr_scan)
-                
-            # Check number of dicoms / mosaic format / number of slices
-                list_files_curr_scan = []
-                for ext_type in options.ext_type.split(','):
-                    list_files_curr_scan = list_files_curr_scan + glob.glob(fdir_curr_scan + '/*.' + ext_type)
-                list_files_curr_scan.sort()
-                num_dcm = len(list_files_curr_scan)
-                # Pull dicom header values of potential interest
-                tag_values['first'] = get_dcm_value(list_files_curr_scan[0], lut_dcm_hdr)
-                tag_values['last']  = get_dcm_value(list_files_curr_scan[-1], lut_dcm_hdr)
-                
-                # Extract parameters of interest from dicom header                
-                params_out = {}
-                params_out = get_FOV_RES(tag_values, num_dcm, params_out)
-                
-                # Check patient info
-                SCAN_PASS, SCAN_LOG = check_patient_info(tag_values['first'], lut_ID_fields, SCAN_PASS, SCAN_LOG)
-                
-                # Check parameters to see if match range
-                for param_field in params_out:
-                    # Numerical Header field
-                    param_PASS = 0;
-                    if type(params_out[param_field]) in [float,int]:
-                        if type(lut_scans[scan_type][param_field]) is dict:
-                            # Min / Max values
-                            param_min = lut_scans[scan_type][param_field]['min']
-                            param_max = lut_scans[scan_type][param_field]['max']
-                            if (float(params_out[param_field]) >= float(lut_scans[scan_type][param_field]['min']) ) and \
-                                (float(params_out[param_field]) <= float(lut_scans[scan_type][param_field]['max'] )):
-                                param_PASS = 1
-                        elif type(lut_scans[scan_type][param_field]) is list:
-                            # List of Values
-                            param_diff = abs(float(params_out[param_field]))
-                            for param_value in lut_scans[scan_type][param_field]:
-                                param_diff = min(param_diff, abs(float(params_out[param_field]) - float(param_value)))
-
-                            if (param_field.find('RES')>-1 and param_diff == 0) or \
-                                 (param_field.find('RES')<0 and param_diff < max(options.TOL * float(params_out[param_field]), options.TOL)):
-                                # Resolution must be exact unless MIN/MAX values have been specified
-                                param_PASS = 1
-                        else:
-                            param_diff = abs(float(params_out[param_field]) - float(lut_scans[scan_type][param_field]))
-                            if (param_field.find('RES')>-1 and param_diff == 0) or \
-                                 (param_field.find('RES')<0 and param_diff < max(options.TOL * float(params_out[param_field]), options.TOL)):
-                                # Resolution must be exact unless MIN/MAX values have been specified
-                                param_PASS = 1
-                    elif  type(params_out[param_field]) in [str]:
-                        # STRING based header
-                        if params_out[param_field] in lut_scans[scan_type][param_field]:
-                            param_PASS = 1
-                        
-                    if not param_PASS:
-                        SCAN_PASS = 0
-                        SCAN_LOG = SCAN_LOG + ['        [%s] : %s != %s : FAIL' % \
-                            (param_field, lut_scans[scan_type][param_field], params_out[param_field] ) ]
-                    elif options.verbose:
-                        SCAN_LOG = SCAN_LOG + ['        [%s] : %s == %s : PASS' % \
-                            (param_field, lut_scans[scan_type][param_field], params_out[param_field] ) ]
-                        
-
-                if SCAN_PASS:
-                    print '    %s - PASS' % (dir_curr_scan,)
-                else:
-                    print '    %s - FAIL' % (dir_curr_scan,)
-                    for line in SCAN_LOG:
-                        print line
+    list_sinks = [dcm_sink.open_sink(fname_out) for fname_out in options.list_out]
+    run_time = dcm_sink.get_run_time()
+    fp_store = None
+    if options.fname_fp_store:
+        fp_store = dcm_fingerprint.FingerprintStore(options.fname_fp_store, not options.fp_no_learn)
+
+    journal = None
+    if options.resume and not options.fname_journal:
+        parser.error("--resume needs --journal")
+    if options.fname_journal and not options.watch:
+        journal = dcm_journal.DcmJournal(options.fname_journal)
+
+    list_subj = []
+    if options.watch:
+        if len(args) != 1:
+            parser.error("incorrect number of arguments")
+        run_watch(args[0], options, list_sinks, fp_store)
+    elif options.batch:
+        if len(args) < 1:
+            parser.error("incorrect number of arguments")
+        for arg in args:
+            list_dir_subj = glob.glob(arg)
+            list_dir_subj.sort()
+            for dir_subj_in in list_dir_subj:
+                if os.path.isdir(dir_subj_in):
+                    subj_name, subj_id = parse_subject_dir(dir_subj_in)
+                    list_subj.append((dir_subj_in.rstrip('/'), subj_name, subj_id))
+    else:
+        if len(args) != 3:
+            parser.error("incorrect number of arguments")
+        subj_name, subj_id, dir_subj_in = args
+        list_subj.append((dir_subj_in.rstrip('/'), subj_name, subj_id))
+
+    # One task per scan directory, results are printed in task order
+    list_tasks = []
+    num_resumed = 0
+    scan_classifier = None
+    for dir_subj_in, subj_name, subj_id in list_subj:
+        lut_scans, lut_dcm_hdr, lut_ID_fields = load_MR_params(options.fname_scan_params, subj_name, subj_id)
+        if scan_classifier is None:
+            scan_classifier = dcm_scan_type.build_classifier(sorted(lut_scans))
+        list_dir_scan = os.listdir(dir_subj_in)
+        list_dir_scan.sort()
+        for dir_curr_scan in list_dir_scan:
+            if options.resume and journal.is_done(dir_subj_in, dir_curr_scan, dcm_journal.STAGE_QA):
+                num_resumed = num_resumed + 1
+                continue
+            list_tasks.append((dir_subj_in, dir_curr_scan, scan_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, options))
+    if options.resume:
+        print 'Resumed : %d scans already in %s' % (num_resumed, options.fname_journal)
+
+    pool = None
+    if options.num_proc > 1:
+        pool = multiprocessing.Pool(options.num_proc, init_worker, (options.fname_index, options))
+        results = pool.imap(qa_scan_worker, list_tasks)
+    else:
+        init_worker(options.fname_index)
+        start_prefetch(list_tasks, options)
+        results = itertools.imap(qa_scan_worker, list_tasks)
+
+    # Parameter rules are checked a block of scans at a time, output stays in task order
+    dir_subj_prev = None
+    list_block = []
+    list_block_tasks = []
+    for count_task in range(len(list_tasks)):
+        list_records, lut_times = results.next()
+        dcm_profile.merge(lut_times)
+        list_block = list_block + list_records
+        list_block_tasks.append(count_task)
+        if len(list_block) < RULE_BLOCK and count_task < len(list_tasks)-1:
+            continue
+        with dcm_profile.timer('rules'):
+            list_block = check_scan_records(list_block, lut_scans, options.TOL, options.verbose, fp_store)
+        write_scan_records(list_sinks, list_block, run_time)
+        for record in list_block:
+            if options.batch and record['dir_subj'] != dir_subj_prev:
+                print record['dir_subj']
+                dir_subj_prev = record['dir_subj']
+            for line in format_scan_record(record):
+                print line
+        if journal is not None:
+            # blocks hold whole scans, every scan of the block is finished and on disk
+            for sink in list_sinks:
+                sink.sync()
+            journal.write([journal.make_entry(list_tasks[count_block_task][0], list_tasks[count_block_task][1], \
+                dcm_journal.STAGE_QA, get_scan_outcome(list_block, list_tasks[count_block_task][0:2])) \
+                for count_block_task in list_block_tasks])
+        list_block = []
+        list_block_tasks = []
+
+    stop_prefetch()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    elif hdr_index_worker is not None:
+        hdr_index_worker.close()
+    for sink in list_sinks:
+        sink.close()
+    if fp_store is not None:
+        fp_store.close()
+    if journal is not None:
+        journal.close()
@@ -0,0 +1,322 @@
+#!/usr/bin/python
+
+# Benchmark suite for the QA and fix scripts
+#   Runs each stage against a synthetic corpus (make_dcm_corpus.py), reports files/s, series/s
+#   and peak RSS, and compares them with a stored baseline
+
+#    File Name:  bench_dcm.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - qa_fix_brainCODE stage
+#       C - 2026-10-18 - Baseline kept with the corpus, not in the code directory
+
+
+# NOTES
+#     1) Typical use
+#   ./bench_dcm.py --generate /tmp/dcm_corpus --save         # first run, stores /tmp/dcm_corpus/bench_baseline.json
+#   ./bench_dcm.py /tmp/dcm_corpus                            # later runs, compared with the baseline
+#     2) Stages
+#           get_dcm_value       - header read of every file (no header index)
+#           get_FOV_RES         - parameter extraction per series, headers read beforehand
+#           DCM_QA              - full DCM_QA.py --batch run over the corpus
+#           DCM_QA_full         - as above with --full
+#           fix_dcm             - fix_dcm.py with dcm_mod_basic.txt, once per series
+#           fix_dcm_brainCODE   - fix_dcm_brainCODE.py, once per series
+#           qa_fix_brainCODE    - qa_fix_brainCODE.py --full over the corpus, QA and rewrite in one pass
+#                                 (compare with DCM_QA_full + fix_dcm_brainCODE)
+#     3) Each stage runs in its own process, so peak RSS is per stage (child processes included)
+#     4) Stages needing an external tool that is not installed (ie. dcmodify) are reported as SKIP
+#     5) A stage regresses when files/s or series/s drop, or peak RSS grows, by more than --tol
+#        Exit status is 1 on any regression
+#     6) The baseline is of this machine and corpus, it is stored in the corpus directory unless
+#        --baseline says otherwise
+
+
+from optparse import OptionParser, Option, OptionValueError
+from distutils.spawn import find_executable
+import os, sys, subprocess
+import glob
+import json
+import time
+import shutil
+import tempfile
+import resource
+import dcm_series
+
+program_name = 'bench_dcm.py'
+
+dir_code = os.path.dirname(os.path.abspath(__file__))
+
+list_stages = ['get_dcm_value', 'get_FOV_RES', 'DCM_QA', 'DCM_QA_full', 'fix_dcm', 'fix_dcm_brainCODE', 'qa_fix_brainCODE']
+
+# external programs each stage depends on
+lut_stage_tools = {}
+
+list_metrics = ['files_per_sec', 'series_per_sec', 'peak_rss_mb']
+
+#*************************************************************************************
+# FUNCTIONS
+
+def list_corpus(dir_corpus):
+# (subject dirs, series dirs) of a corpus
+    list_subj = sorted(glob.glob('%s/MR160/MR160-*-*' % (dir_corpus,)))
+    list_series = []
+    for dir_subj in list_subj:
+        list_series = list_series + sorted([dir_series for dir_series in glob.glob(dir_subj + '/*') \
+            if os.path.isdir(dir_series)])
+    return list_subj, list_series
+
+
+def get_peak_rss_mb():
+# Peak RSS of this process and its finished children (ru_maxrss is KB on Linux)
+    peak_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(peak_self, peak_children) / 1024.0
+
+
+def run_script(list_args):
+# Run one of the repo scripts quietly, fail loudly
+    p = subprocess.Popen([sys.executable] + list_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=dir_code)
+    output, errors = p.communicate()
+    if p.returncode != 0:
+        raise SystemExit, 'ERROR - %s failed (%d): %s' % (list_args[0], p.returncode, errors.strip())
+    return output
+
+
+def bench_get_dcm_value(dir_corpus, options):
+    import DCM_QA
+    lut_dcm_hdr = DCM_QA.load_MR_params(dir_code + '/scan_params.cfg', 'BENCH', '01')[1]
+    list_subj, list_series = list_corpus(dir_corpus)
+    list_files = []
+    for dir_series in list_series:
+        list_files = list_files + dcm_series.list_series_files(dir_series, ['dcm'])
+
+    time_start = time.time()
+    for fname_dcm in list_files:
+        DCM_QA.get_dcm_value(fname_dcm, lut_dcm_hdr, options.backend)
+    return len(list_files), len(list_series), time.time() - time_start
+
+
+def bench_get_FOV_RES(dir_corpus, options):
+    import DCM_QA
+    lut_dcm_hdr = DCM_QA.load_MR_params(dir_code + '/scan_params.cfg', 'BENCH', '01')[1]
+    list_subj, list_series = list_corpus(dir_corpus)
+    list_inputs = []
+    for dir_series in list_series:
+        list_files = dcm_series.list_series_files(dir_series, ['dcm'])
+        list_inputs.append((DCM_QA.get_dcm_value(list_files[0], lut_dcm_hdr, options.backend), \
+            DCM_QA.get_dcm_value(list_files[-1], lut_dcm_hdr, options.backend), len(list_files)))
+
+    # too fast to time once, repeat every series
+    time_start = time.time()
+    for count_loop in range(options.loops):
+        for tag_first, tag_last, num_dcm in list_inputs:
+            DCM_QA.get_FOV_RES({'first': dict(tag_first), 'last': tag_last}, num_dcm, {})
+    return 0, len(list_inputs) * options.loops, time.time() - time_start
+
+
+def bench_DCM_QA(dir_corpus, options, list_extra=[]):
+    list_subj, list_series = list_corpus(dir_corpus)
+    num_files = sum([len(dcm_series.list_series_files(dir_series, ['dcm'])) for dir_series in list_series])
+    time_start = time.time()
+    run_script(['DCM_QA.py', '--index', '', '-j', str(options.num_proc), '--backend', options.backend] + \
+        list_extra + ['--batch'] + list_subj)
+    return num_files, len(list_series), time.time() - time_start
+
+
+def bench_fix_dcm(dir_corpus, options):
+    list_subj, list_series = list_corpus(dir_corpus)
+    dir_out = tempfile.mkdtemp(prefix='bench_fix_dcm_')
+    num_files = 0
+    try:
+        time_start = time.time()
+        for dir_series in list_series:
+            num_files = num_files + len(dcm_series.list_series_files(dir_series, ['dcm']))
+            dir_out_subj = '%s/%s' % (dir_out, os.path.basename(os.path.dirname(dir_series)))
+            if not os.path.exists(dir_out_subj):
+                os.mkdir(dir_out_subj)
+            run_script(['fix_dcm.py', 'dcm_mod_basic.txt', dir_series, dir_out_subj])
+        time_total = time.time() - time_start
+    finally:
+        shutil.rmtree(dir_out)
+    return num_files, len(list_series), time_total
+
+
+def bench_fix_dcm_brainCODE(dir_corpus, options):
+    list_subj, list_series = list_corpus(dir_corpus)
+    dir_out = tempfile.mkdtemp(prefix='bench_fix_brainCODE_')
+    num_files = 0
+    try:
+        time_start = time.time()
+        for dir_series in list_series:
+            num_files = num_files + len(dcm_series.list_series_files(dir_series, ['dcm']))
+            run_script(['fix_dcm_brainCODE.py', dir_series, dir_out])
+        time_total = time.time() - time_start
+    finally:
+        shutil.rmtree(dir_out)
+    return num_files, len(list_series), time_total
+
+
+def bench_qa_fix_brainCODE(dir_corpus, options):
+    list_subj, list_series = list_corpus(dir_corpus)
+    num_files = sum([len(dcm_series.list_series_files(dir_series, ['dcm'])) for dir_series in list_series])
+    dir_out = tempfile.mkdtemp(prefix='bench_qa_fix_brainCODE_')
+    try:
+        time_start = time.time()
+        run_script(['qa_fix_brainCODE.py', '--full', '-j', str(options.num_proc)] + list_subj + [dir_out])
+        time_total = time.time() - time_start
+    finally:
+        shutil.rmtree(dir_out)
+    return num_files, len(list_series), time_total
+
+
+def run_stage(stage, dir_corpus, options):
+# Body of a stage process, returns its result dict
+    list_missing = [tool for tool in lut_stage_tools.get(stage, []) if find_executable(tool) is None]
+    if list_missing:
+        return {'stage': stage, 'skip': 'not installed: %s' % (', '.join(list_missing),)}
+
+    if stage == 'get_dcm_value':
+        num_files, num_series, time_total = bench_get_dcm_value(dir_corpus, options)
+    elif stage == 'get_FOV_RES':
+        num_files, num_series, time_total = bench_get_FOV_RES(dir_corpus, options)
+    elif stage == 'DCM_QA':
+        num_files, num_series, time_total = bench_DCM_QA(dir_corpus, options)
+    elif stage == 'DCM_QA_full':
+        num_files, num_series, time_total = bench_DCM_QA(dir_corpus, options, ['--full'])
+    elif stage == 'fix_dcm':
+        num_files, num_series, time_total = bench_fix_dcm(dir_corpus, options)
+    elif stage == 'fix_dcm_brainCODE':
+        num_files, num_series, time_total = bench_fix_dcm_brainCODE(dir_corpus, options)
+    elif stage == 'qa_fix_brainCODE':
+        num_files, num_series, time_total = bench_qa_fix_brainCODE(dir_corpus, options)
+    else:
+        raise SystemExit, 'ERROR - Unknown benchmark stage: %s' % (stage,)
+
+    time_total = max(time_total, 1e-6)
+    return {'stage': stage, 'files': num_files, 'series': num_series, 'sec': round(time_total, 3),
+            'files_per_sec': round(num_files / time_total, 1),
+            'series_per_sec': round(num_series / time_total, 2),
+            'peak_rss_mb': round(get_peak_rss_mb(), 1)}
+
+
+def spawn_stage(stage, dir_corpus, options):
+# Run a stage in a fresh process, best of --repeat runs
+    list_args = [os.path.abspath(__file__), '--stage', stage, '--backend', options.backend, \
+        '-j', str(options.num_proc), '--loops', str(options.loops), dir_corpus]
+    result_best = None
+    for count_repeat in range(options.repeat):
+        result = json.loads(run_script(list_args).strip().split('\n')[-1])
+        if 'skip' in result:
+            return result
+        if result_best is None or result['sec'] < result_best['sec']:
+            result_best = result
+    return result_best
+
+
+def compare_result(result, result_base, tol):
+# Lines for metrics that regressed beyond tol
+    list_regress = []
+    for metric in list_metrics:
+        if not result_base.get(metric) or metric not in result:
+            continue
+        ratio = result[metric] / float(result_base[metric])
+        if metric == 'peak_rss_mb':
+            regress = ratio > 1 + tol
+        else:
+            regress = ratio < 1 - tol
+        if regress:
+            list_regress.append('    %s : %s -> %s (x%.2f) : REGRESSION' % (metric, result_base[metric], result[metric], ratio))
+    return list_regress
+
+
+def format_result(result, result_base):
+    if 'skip' in result:
+        return '%-18s SKIP (%s)' % (result['stage'], result['skip'])
+    line = '%-18s %7d files %5d series %9.3f s %10.1f files/s %9.2f series/s %8.1f MB' % \
+        (result['stage'], result['files'], result['series'], result['sec'], \
+         result['files_per_sec'], result['series_per_sec'], result['peak_rss_mb'])
+    if result_base and 'skip' not in result_base:
+        if result_base.get('files_per_sec'):
+            line = '%s  [files/s x%.2f]' % (line, result['files_per_sec'] / float(result_base['files_per_sec']))
+        elif result_base.get('series_per_sec'):
+            line = '%s  [series/s x%.2f]' % (line, result['series_per_sec'] / float(result_base['series_per_sec']))
+    return line
+
+#**********************************************************************
+
+def main():
+    usage = "Usage: "+program_name+" <options> dir_corpus \n" + \
+            "   or  "+program_name+" --help";
+    parser = OptionParser(usage)
+    parser.add_option("--generate", action="store_true", dest="generate",
+                        default=0, help="Create the corpus first if it does not exist")
+    parser.add_option("--num_subj", type="int", dest="num_subj",
+                        default=2, help="Subjects in a generated corpus [default = 2]")
+    parser.add_option("--scale", type="float", dest="scale",
+                        default=1.0, help="Fraction of fMRI / DTI volumes in a generated corpus [default = 1.0]")
+    parser.add_option("-s","--stages", type="string", dest="stages",
+                        default=','.join(list_stages), help="Comma separated stages to run [default = all]")
+    parser.add_option("--stage", type="string", dest="stage",
+                        default='', help=" (internal) run a single stage and print its result")
+    parser.add_option("--backend", type="choice", dest="backend", choices=['native','dcmdump'],
+                        default='native', help="Header reader backend [default = native]")
+    parser.add_option("-j","--num_proc", type="int", dest="num_proc",
+                        default=1, help="Worker processes for DCM_QA.py [default = 1]")
+    parser.add_option("--loops", type="int", dest="loops",
+                        default=1000, help="Repeats of get_FOV_RES per series [default = 1000]")
+    parser.add_option("--repeat", type="int", dest="repeat",
+                        default=1, help="Runs per stage, best is kept [default = 1]")
+    parser.add_option("--baseline", type="string", dest="fname_baseline",
+                        default="", help="Stored baseline [default = dir_corpus/bench_baseline.json]")
+    parser.add_option("--save", action="store_true", dest="save",
+                        default=0, help="Store this run as the new baseline")
+    parser.add_option("--tol", type="float", dest="tol",
+                        default=0.2, help="Allowed relative regression [default = 0.2]")
+
+    options, args = parser.parse_args()
+    if len(args) == 1:
+        dir_corpus = os.path.abspath(args[0])
+    else:
+        parser.error("incorrect number of arguments")
+    if not options.fname_baseline:
+        options.fname_baseline = dir_corpus + '/bench_baseline.json'
+
+    if options.stage:
+        print json.dumps(run_stage(options.stage, dir_corpus, options), sort_keys=True)
+        return
+
+    if not os.path.exists(dir_corpus + '/MR160'):
+        if not options.generate:
+            raise SystemExit, 'ERROR - Corpus not found, use --generate to create it: %s' % (dir_corpus,)
+        import make_dcm_corpus
+        make_dcm_corpus.make_corpus(dir_corpus, options.num_subj, options.scale)
+
+    lut_baseline = {}
+    if os.path.exists(options.fname_baseline) and not options.save:
+        lut_baseline = json.load(open(options.fname_baseline))
+
+    lut_results = {}
+    list_regress = []
+    for stage in options.stages.split(','):
+        result = spawn_stage(stage, dir_corpus, options)
+        lut_results[stage] = result
+        print format_result(result, lut_baseline.get(stage))
+        sys.stdout.flush()
+        if stage in lut_baseline and 'skip' not in result and 'skip' not in lut_baseline[stage]:
+            list_stage_regress = compare_result(result, lut_baseline[stage], options.tol)
+            if list_stage_regress:
+                list_regress = list_regress + [stage] + list_stage_regress
+
+    if options.save:
+        f = open(options.fname_baseline, 'w')
+        json.dump(lut_results, f, indent=1, sort_keys=True)
+        f.close()
+        print 'Baseline stored: %s' % (options.fname_baseline,)
+    elif list_regress:
+        print '\n'.join(list_regress)
+        sys.exit(1)
+
+if __name__ == '__main__' :
+    main()
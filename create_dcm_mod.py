@@ -23,6 +23,7 @@ import string
 import glob
 import os, shlex, subprocess
 import numpy
+import dcm_scan_type
 
 program_name = 'create_dcm_mod.py'
 
@@ -77,24 +78,6 @@ def load_dcm_list(fname_dcm_list, lut_dcm_hdrs):
         lut_dcm_hdrs[line_dcm.split(':')[0].strip(' ')] = line_dcm.split(':')[1].strip(' ')
     return lut_dcm_hdrs
 
-def check_scan_type(dir_curr_scan_clean, scan_type):
-# Function to check if current scan needs to be prepped
-    list_ignore = ['_ADC','_TRACEW','_FA','_ColFA']   # processed DTI scans to ignore
-
-    QA_THIS_SCAN = 1
-    list_scan_type = scan_type.split(',')
-    # make sure all keywords present in directory name
-    for scan_keywords in list_scan_type:
-        if dir_curr_scan_clean.find(scan_keywords)<0:
-            QA_THIS_SCAN = 0
-            
-    # make sure all ignore words are absent in directory name
-    for ignore_keywords in list_ignore:
-        if dir_curr_scan_clean.find(ignore_keywords)>-1:
-            QA_THIS_SCAN = 0
-            
-    return QA_THIS_SCAN
-
 #**********************************************************************
     
 def main():
@@ -122,16 +105,14 @@ def main():
         parser.error("incorrect number of arguments")
 
     lut_scan_type = load_lut_scan_type(options.fname_lut_scan_type)    
-    dir_target_clean = targetDir.replace('-','_')   # remove variability of - or _
 
     # Check if targetDir is one that requires modifications    
-    for scan_type in lut_scan_type:
-        QA_THIS_SCAN = check_scan_type(dir_target_clean, scan_type) 
-        if QA_THIS_SCAN:
-            new_scanType = lut_scan_type[scan_type]
-            new_subjectID = subjectID
-            new_sessionName = '%s_%s' % (subjectID,sessionSuffix)
-            print targetDir, new_subjectID, new_sessionName, new_scanType
+    scan_classifier = dcm_scan_type.build_classifier(sorted(lut_scan_type))
+    for scan_type in dcm_scan_type.classify_scan(scan_classifier, targetDir):
+        new_scanType = lut_scan_type[scan_type]
+        new_subjectID = subjectID
+        new_sessionName = '%s_%s' % (subjectID,sessionSuffix)
+        print targetDir, new_subjectID, new_sessionName, new_scanType
     
     
 if __name__ == '__main__' :
@@ -0,0 +1,173 @@
+#!/usr/bin/python
+
+# Session upload archives (fix_dcm_brainCODE.py --archive)
+#   Rewritten files are streamed straight into one tar or zip per session, in place of an output
+#   tree that gets archived afterwards
+
+#    File Name:  dcm_archive.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - Member hashes (dcm_write.DcmHasher), add_string for manifests
+#       C - 2026-10-18 - abort() to let go of an archive that was only looked at
+#       D - 2026-10-18 - add_plan, write of a rewrite planned by the caller
+
+
+# NOTES
+#     1) The size of a rewritten file is known from its rewrite plan (dcm_write.open_plan), so the
+#        member header is written first and the file follows, with the same kernel side copy of
+#        the pixel data as a rewrite to disk
+#     2) Tar members are GNU format. Zip members are stored, DICOM pixel data barely compresses.
+#        Their CRC is computed from the mapped input before the header is written, zip64 is used
+#        for archives over 4 GB
+#     3) A session that spans several runs (one series per run) is appended to - tar after its
+#        last member, zip through zipfile's append mode. A member name is never written twice
+#     4) Members are written as they are rewritten, an interrupted run leaves an incomplete
+#        archive that should be removed before running again. The same goes for an error while
+#        a member is written - callers only fall back (ie. to dcmodify) on errors of the plan
+
+
+import os
+import time
+import mmap
+import zlib
+import tarfile
+import zipfile
+import dcm_write
+
+
+def get_crc(buf, list_chunks):
+# CRC-32 of a list of chunks, input ranges are read through buffer() views of the mapping
+    crc = 0
+    for chunk in list_chunks:
+        if type(chunk) is tuple:
+            crc = zlib.crc32(buffer(buf, chunk[0], chunk[1] - chunk[0]), crc)
+        else:
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+
+class DcmArchive(object):
+# One session archive, .zip or .tar by name
+
+    def __init__(self, fname_archive):
+        self.fname_archive = fname_archive
+        self.is_zip = fname_archive.lower().endswith('.zip')
+        self.zf = None
+        if self.is_zip:
+            if os.path.exists(fname_archive):
+                self.zf = zipfile.ZipFile(fname_archive, 'a', zipfile.ZIP_STORED, allowZip64=True)
+            else:
+                self.zf = zipfile.ZipFile(fname_archive, 'w', zipfile.ZIP_STORED, allowZip64=True)
+            self.f = self.zf.fp
+            self.set_names = set(self.zf.namelist())
+        elif os.path.exists(fname_archive):
+            self.f = open(fname_archive, 'r+b')
+            tar = tarfile.open(fileobj=self.f, mode='r')
+            self.set_names = set(tar.getnames())
+            # new members overwrite the end of archive blocks, the file is only touched once they do
+            self.f.seek(tar.offset)
+        else:
+            self.f = open(fname_archive, 'wb')
+            self.set_names = set()
+
+    def has_dir(self, dir_name):
+    # True if any member is under dir_name
+        dir_name = dir_name.rstrip('/') + '/'
+        for arcname in self.set_names:
+            if arcname.startswith(dir_name):
+                return True
+        return False
+
+    def add_dcm(self, arcname, fname_in, lut_dcm_hdrs, algorithm=None):
+    # Write fname_in into the archive with the changes {'gggg,eeee': text} applied
+    #   Returns the hashes of the member if a hash algorithm is given, as dcm_write.modify_dcm
+        dcm_file, list_chunks = dcm_write.open_plan(fname_in, lut_dcm_hdrs)
+        try:
+            hasher = dcm_write.get_hasher(dcm_file, algorithm)
+            self.add_plan(arcname, dcm_file, list_chunks, hasher)
+        finally:
+            dcm_file.close()
+        if hasher is not None:
+            return hasher.result()
+        return None
+
+    def add_plan(self, arcname, dcm_file, list_chunks, hasher=None):
+    # Write a planned rewrite (dcm_write.open_plan) into the archive, the caller closes dcm_file
+    #   An error from here on may leave a partly written member, the archive can't be added to
+        fd_in = os.open(dcm_file.full_name_dcm, os.O_RDONLY)
+        try:
+            self.add_chunks(arcname, dcm_file.buf, dcm_file.full_name_dcm, fd_in, list_chunks, \
+                os.fstat(fd_in).st_mtime, hasher)
+        finally:
+            os.close(fd_in)
+
+    def add_string(self, arcname, data):
+    # Member made in memory (ie. a manifest)
+        self.add_chunks(arcname, '', arcname, None, [data], time.time())
+
+    def add_file(self, arcname, fname_in):
+    # Unmodified copy of a file
+        fd_in = os.open(fname_in, os.O_RDONLY)
+        try:
+            st = os.fstat(fd_in)
+            if st.st_size == 0:
+                self.add_chunks(arcname, '', fname_in, fd_in, [], st.st_mtime)
+                return
+            buf = mmap.mmap(fd_in, 0, access=mmap.ACCESS_READ)
+            try:
+                self.add_chunks(arcname, buf, fname_in, fd_in, [(0, st.st_size)], st.st_mtime)
+            finally:
+                buf.close()
+        finally:
+            os.close(fd_in)
+
+    def add_chunks(self, arcname, buf, fname_in, fd_in, list_chunks, mtime, hasher=None):
+        if arcname in self.set_names:
+            raise dcm_write.DcmWriteError('%s already in %s' % (arcname, self.fname_archive))
+        size = sum([dcm_write.chunk_size(chunk) for chunk in list_chunks])
+        if self.is_zip:
+            zinfo = zipfile.ZipInfo(arcname, max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0)))
+            zinfo.compress_type = zipfile.ZIP_STORED
+            zinfo.external_attr = 0644 << 16L
+            zinfo.file_size = size
+            zinfo.compress_size = size
+            zinfo.CRC = get_crc(buf, list_chunks)
+            zinfo.header_offset = self.f.tell()
+            self.f.write(zinfo.FileHeader())
+        else:
+            tarinfo = tarfile.TarInfo(arcname)
+            tarinfo.size = size
+            tarinfo.mtime = int(mtime)
+            tarinfo.mode = 0644
+            self.f.write(tarinfo.tobuf(tarfile.GNU_FORMAT))
+        self.f.flush()
+        pos_end = self.f.tell() + size
+        dcm_write.stream_chunks(buf, fname_in, fd_in, list_chunks, self.f.fileno(), hasher)
+        self.f.seek(pos_end)
+        if self.is_zip:
+            self.zf.filelist.append(zinfo)
+            self.zf.NameToInfo[arcname] = zinfo
+            self.zf._didModify = True
+        else:
+            self.f.write('\0' * ((-size) % tarfile.BLOCKSIZE))
+        self.set_names.add(arcname)
+
+    def abort(self):
+    # Close without writing the end of archive, only before any member was added
+        if self.is_zip:
+            self.zf._didModify = False
+            self.zf.close()
+        else:
+            self.f.close()
+
+    def close(self):
+        if self.is_zip:
+            self.zf.close()
+            return
+        # end of archive, padded to a full record as tarfile does
+        self.f.write('\0' * (2 * tarfile.BLOCKSIZE))
+        pos = self.f.tell()
+        self.f.write('\0' * ((-pos) % tarfile.RECORDSIZE))
+        self.f.truncate()
+        self.f.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+# Protocol fingerprints of QA'd series (DCM_QA.py --fp_store)
+#   Most sessions are protocol clones of a reference session from the same site. A series whose
+#   fingerprint has passed before passes the parameter rules after one set lookup, only new
+#   fingerprints go through the rule evaluation
+
+#    File Name:  dcm_fingerprint.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+
+
+# NOTES
+#     1) Fingerprint = hash of params_out plus the protocol fields of lut_dcm_hdr (list_fp_fields),
+#        numbers rounded to FP_DECIMALS. Patient / position / timing fields are left out so clones
+#        of a protocol share a fingerprint
+#     2) Fingerprints are known per (scan type, site, rules), rules being a hash of the compiled
+#        scan_params.cfg rules of the scan type and TOL - editing the config starts a fresh set
+#     3) Series that pass every parameter rule are added to the store (unless --fp_no_learn), so a
+#        run over golden reference sessions seeds it. Patient info and --full checks always run
+#     4) The store is an SQLite table, loaded into memory when opened, new entries are written on close
+
+
+import os
+import sqlite3
+import hashlib
+import datetime
+
+FP_DECIMALS = 3
+
+# lut_dcm_hdr fields that define a protocol (besides params_out)
+list_fp_fields = ['ImageType', 'TR', 'TE', 'TI', 'FA', 'AcquisitionMatrix', 'Rows', 'Cols', 'PhaseDir', \
+    'PixelSpacing', 'SliceThick', 'SliceSpace', 'MOSAIC_slices']
+
+
+def normalise_value(value):
+    if type(value) is float:
+        return round(value, FP_DECIMALS)
+    if type(value) is list:
+        return tuple([normalise_value(curr_value) for curr_value in value])
+    return value
+
+
+def get_fingerprint(params_out, tag_values_first):
+# Short hex digest of the protocol of a series
+    list_items = [('params', sorted([(param_field, normalise_value(params_out[param_field])) for param_field in params_out]))]
+    list_items.append(('hdr', [(field, normalise_value(tag_values_first.get(field, 'NULL'))) for field in list_fp_fields]))
+    return hashlib.sha1(repr(list_items)).hexdigest()[:20]
+
+
+def get_rules_hash(lut_rules, TOL):
+# Hash of the rules of one scan type, fingerprints are only reused under identical rules
+    return hashlib.sha1(repr((sorted([(param_field, lut_rules[param_field]['text']) for param_field in lut_rules]), TOL))).hexdigest()[:12]
+
+
+def get_site(dir_subj):
+# Site code from the session directory, ie. .../MR160-088-0002-01 -> 088
+    list_ID = os.path.basename(dir_subj.rstrip('/')).split('-')
+    if len(list_ID) > 2:
+        return list_ID[1]
+    return ''
+
+
+class FingerprintStore(object):
+
+    def __init__(self, fname_store, learn=1):
+        self.learn = learn
+        self.conn = sqlite3.connect(fname_store, timeout=60)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS known_fp (scan_type TEXT, site TEXT, rules TEXT, ' + \
+            'fingerprint TEXT, first_seen TEXT, series TEXT, PRIMARY KEY (scan_type, site, rules, fingerprint))')
+        self.conn.commit()
+        self.set_known = set(self.conn.execute('SELECT scan_type, site, rules, fingerprint FROM known_fp'))
+        self.list_new = []
+
+    def is_known(self, scan_type, site, rules_hash, fingerprint):
+        return (scan_type, site, rules_hash, fingerprint) in self.set_known
+
+    def add(self, scan_type, site, rules_hash, fingerprint, series):
+        key = (scan_type, site, rules_hash, fingerprint)
+        if self.learn and key not in self.set_known:
+            self.set_known.add(key)
+            self.list_new.append(key + (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), series))
+
+    def flush(self):
+        if self.list_new:
+            with self.conn:
+                self.conn.executemany('INSERT OR IGNORE INTO known_fp VALUES (?,?,?,?,?,?)', self.list_new)
+            self.list_new = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+# Header fix of single files and the ordered worker pool they run in
+#   Shared by fix_dcm.py, fix_dcm_brainCODE.py and qa_fix_brainCODE.py - the in-process rewrite
+#   (dcm_write), its dcmodify fallback, the per file worker and the -j pool whose results come back
+#   in task order
+
+#    File Name:  dcm_fix.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation, out of fix_dcm.py / fix_dcm_brainCODE.py
+
+
+# NOTES
+#     1) fix_dcm_file rewrites a file with dcm_write (modify_dcm, or write_dcm from a mapping the
+#        caller already has open). Files dcm_write can't handle go through one dcmodify call with
+#        every tag, on a temporary copy renamed into place once dcmodify succeeded
+#     2) A failed (or missing) dcmodify raises DcmWriteError and leaves nothing behind, -imt leaves
+#        tags that are not in the file out, as dcm_write does
+#     3) Messages, the verbose dcmodify command lines included, are returned rather than printed so
+#        they come out in file order whatever process wrote the file
+#     4) imap_tasks runs a worker over -j processes (in process for -j 1). A worker returns a tuple
+#        whose last item is its dcm_profile.drain(), merged here, the rest is yielded in task order
+#     5) Errors of a file are handed back by fix_dcm_worker rather than raised, report() prints
+#        them after the file's messages
+
+
+import os, subprocess
+import shutil
+import itertools
+import multiprocessing
+import dcm_profile
+import dcm_read
+import dcm_write
+
+FIX_CHUNK = 16      # files handed to a worker process at a time
+
+#*************************************************************************************
+# FUNCTIONS
+
+# General utility function to call system commands
+def run_cmd(sys_cmd, debug, verbose, list_msgs=None):
+# one line call to output system command and control debug state
+#   With list_msgs (worker processes) the verbose lines are added to it instead of printed, so
+#   they come out in file order
+    list_verbose = []
+    if verbose:
+        list_verbose.append(sys_cmd)
+    output, errors, returncode = '', '', 0
+    if not debug:
+        with dcm_profile.timer('cmd:' + sys_cmd.split(' ', 1)[0]):
+            p = subprocess.Popen(sys_cmd, stdout = subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+            output, errors = p.communicate()
+        returncode = p.returncode
+        if verbose:
+            list_verbose.append('%s %s' % (output, errors))
+    if list_msgs is None:
+        for msg in list_verbose:
+            print msg
+    else:
+        list_msgs.extend(list_verbose)
+    return output, errors, returncode
+
+def fix_dcm_dcmodify(full_name_in, full_name_out, lut_dcm_hdrs, debug, verbose, list_msgs):
+#   Single dcmodify call with all tags, for files dcm_write can't rewrite
+#   Verbose command lines go to list_msgs
+    fname_tmp = dcm_write.get_tmp_name(full_name_out)
+    shutil.copyfile(full_name_in, fname_tmp)
+    try:
+        dcmodify_string = ' '.join(['-ma "(%s)"=%s' % (curr_dcm_hdr_index, lut_dcm_hdrs[curr_dcm_hdr_index].strip('\n')) \
+            for curr_dcm_hdr_index in sorted(lut_dcm_hdrs)])
+        cmd_dcmodify = 'dcmodify -imt %s %s' % (dcmodify_string, fname_tmp)
+        output, errors, returncode = run_cmd(cmd_dcmodify, debug, verbose, list_msgs)
+
+        cmd_rmbak = 'rm -f %s.bak' % (fname_tmp,)
+        run_cmd(cmd_rmbak, debug, verbose, list_msgs)
+        if returncode != 0:
+            raise dcm_write.DcmWriteError('dcmodify failed (exit %d) %s' % (returncode, errors.strip()))
+        if dcm_write.sync_writes:
+            dcm_write.sync_file(fname_tmp)
+        os.rename(fname_tmp, full_name_out)
+    except:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+        raise
+
+def fix_dcm_file(full_name_in, full_name_out, lut_dcm_hdrs, debug, verbose, algorithm='', dcm_file=None):
+#   Read full_name_in once and write it to full_name_out with all header changes applied
+#   dcm_file is full_name_in already mapped by the caller (qa_fix_brainCODE.py), who closes it
+#   Returns the messages to print, so they come out in file order when run from the pool, and
+#   the hashes of the output if a hash algorithm is given
+    list_msgs = []
+    lut_hashes = None
+    if verbose:
+        list_msgs.append('rewrite %s -> %s' % (full_name_in, full_name_out))
+    if debug:
+        return list_msgs, lut_hashes
+    try:
+        with dcm_profile.timer('rewrite'):
+            if dcm_file is None:
+                lut_hashes = dcm_write.modify_dcm(full_name_in, full_name_out, lut_dcm_hdrs, algorithm)
+            else:
+                lut_hashes = dcm_write.write_dcm(dcm_file, full_name_out, lut_dcm_hdrs, algorithm)
+    except (dcm_read.DcmReadError, dcm_write.DcmWriteError), e:
+        if verbose:
+            list_msgs.append('* WARNING - %s, falling back to dcmodify' % (e,))
+        fix_dcm_dcmodify(full_name_in, full_name_out, lut_dcm_hdrs, debug, verbose, list_msgs)
+        if algorithm:
+            lut_hashes = dcm_write.hash_file(full_name_out, algorithm)
+    return list_msgs, lut_hashes
+
+def fix_dcm_worker(task):
+#   One file, errors are handed back rather than raised so every file gets reported
+    full_name_in, full_name_out, lut_dcm_hdrs, debug, verbose, algorithm = task
+    try:
+        list_msgs, lut_hashes = fix_dcm_file(full_name_in, full_name_out, lut_dcm_hdrs, debug, verbose, algorithm)
+        error = None
+    except Exception, e:
+        list_msgs = []
+        lut_hashes = None
+        error = '%s : %s' % (full_name_in, e)
+    return list_msgs, error, lut_hashes, dcm_profile.drain()    # stage timings travel back with the result
+
+def imap_tasks(worker, list_tasks, num_proc, chunk=1):
+#   Results of worker over list_tasks in task order, from num_proc worker processes
+#   The stage timings each result ends with are merged, the rest of the result is yielded
+#   Left early (an error of the caller), the pool is stopped rather than run to the end
+    pool = None
+    if num_proc > 1:
+        pool = multiprocessing.Pool(num_proc)
+        results = pool.imap(worker, list_tasks, chunk)
+    else:
+        results = itertools.imap(worker, list_tasks)
+    try:
+        for result in results:
+            dcm_profile.merge(result[-1])
+            yield result[:-1]
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def report(list_msgs, error, list_errors):
+#   Messages of a task, then its error (added to list_errors) if it failed
+    for msg in list_msgs:
+        print msg
+    if error is not None:
+        print '* ERROR - %s' % (error,)
+        list_errors.append(error)
+
+def run_fix_tasks(list_tasks, num_proc):
+#   Rewrite all files (fix_dcm_worker tasks) over num_proc worker processes
+#   Returns the errors, and the output hashes of each task (None if there are none), in task order
+    list_errors = []
+    list_hashes = []
+    for list_msgs, error, lut_hashes in imap_tasks(fix_dcm_worker, list_tasks, num_proc, FIX_CHUNK):
+        report(list_msgs, error, list_errors)
+        list_hashes.append(lut_hashes)
+    return list_errors, list_hashes
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# Persistent on-disk index of DICOM header values
+#   Stores the tag values pulled from each file in a SQLite database so repeat runs over
+#   an unchanged study tree only need a stat() per file
+
+#    File Name:  dcm_index.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - Failed reads (UncachedValues) are never stored
+
+
+# NOTES
+#     1) Entries are keyed on (path, size, mtime_ns), any change to a file invalidates its entry
+#     2) Values are stored per dicom tag ('0018,0080'), not per field name, so different
+#        lut_dcm_hdr definitions share entries. Requesting a tag that was not stored re-reads the file
+#     3) Writes are committed in batches, call close() when done. Each process needs its own
+#        DcmIndex, SQLite handles the locking between processes (WAL mode)
+#     4) A read_func result that is an UncachedValues (ie. dcmdump fallback that is missing or
+#        failed, all NULL) is returned but not stored, the file is read again next run
+
+
+import os
+import sqlite3
+import cPickle
+
+COMMIT_EVERY = 500
+
+
+class UncachedValues(dict):
+# {tag: value} of a read that failed, returned as is but never stored in the index
+    pass
+
+
+def get_file_key(full_name_dcm):
+# (path, size, mtime_ns) used to detect changed files
+    stat_dcm = os.stat(full_name_dcm)
+    mtime_ns = getattr(stat_dcm, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(round(stat_dcm.st_mtime * 1e9))
+    return (os.path.abspath(full_name_dcm), stat_dcm.st_size, mtime_ns)
+
+
+class DcmIndex(object):
+
+    def __init__(self, fname_index, commit_every=COMMIT_EVERY):
+        self.fname_index = fname_index
+        self.commit_every = commit_every
+        self.num_pending = 0
+        self.conn = sqlite3.connect(fname_index, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS dcm_hdr ' + \
+            '(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, tag_values BLOB)')
+        self.conn.commit()
+
+    def lookup_all(self, file_key):
+    # Returns every stored {tag: value} for a current entry, None if missing or stale
+        row = self.conn.execute('SELECT size, mtime_ns, tag_values FROM dcm_hdr WHERE path=?', \
+            (file_key[0],)).fetchone()
+        if row is None or row[0] != file_key[1] or row[1] != file_key[2]:
+            return None
+        return cPickle.loads(str(row[2]))
+
+    def store(self, file_key, tag_values):
+        self.conn.execute('INSERT OR REPLACE INTO dcm_hdr (path, size, mtime_ns, tag_values) VALUES (?,?,?,?)', \
+            (file_key[0], file_key[1], file_key[2], sqlite3.Binary(cPickle.dumps(tag_values, 2))))
+        self.num_pending = self.num_pending + 1
+        if self.num_pending >= self.commit_every:
+            self.commit()
+
+    def get_values(self, full_name_dcm, list_tags, read_func):
+    # Values of list_tags for a file, only calls read_func(full_name_dcm, list_tags) on a miss
+        file_key = get_file_key(full_name_dcm)
+        stored_values = self.lookup_all(file_key)
+        if stored_values is not None:
+            list_missing = [dcm_tag for dcm_tag in list_tags if dcm_tag not in stored_values]
+            if len(list_missing) == 0:
+                return dict((dcm_tag, stored_values[dcm_tag]) for dcm_tag in list_tags)
+        else:
+            stored_values = {}
+        tag_values = read_func(full_name_dcm, list_tags)
+        if isinstance(tag_values, UncachedValues):
+            return tag_values
+        stored_values.update(tag_values)
+        self.store(file_key, stored_values)
+        return tag_values
+
+    def commit(self):
+        self.conn.commit()
+        self.num_pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,133 @@
+#!/usr/bin/python
+
+# Crash-safe job journal of the QA and fix scripts (--journal, --resume)
+#   One line per finished (session, series, stage) with its outcome and output checksums, so a
+#   batch that dies partway through is picked up where it stopped
+
+#    File Name:  dcm_journal.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - Outputs are on disk (fsync) before their entry, new journals sync their directory
+
+
+# NOTES
+#     1) JSON Lines, append only. An entry is written once its series is completely done (outputs
+#        renamed into place, sinks written), as one locked write() followed by fsync, so a crash
+#        loses at most the series in flight. With --journal the outputs, manifests, state files,
+#        their directories (dcm_write.sync_writes / sync_dirs) and the sinks are fsync'd before
+#        the entry, so this holds for a power loss too, not just a killed process
+#     2) A crash during the write leaves a torn last line. It is ignored when loading, and the
+#        next run ends it with a newline before appending, so it never swallows a new entry.
+#        Lines that don't parse anywhere else are ignored too
+#     3) Stages
+#           qa          - DCM_QA.py, outcome PASS / FAIL / NOT CHECKED
+#           fix         - fix_dcm_brainCODE.py, outcome written
+#           qa_fix      - qa_fix_brainCODE.py, outcome written / quarantined / skipped / not written
+#     4) outputs is {output series directory (relative): checksum}, the checksum being the hash of
+#        the series manifest (dcm_manifest.format_manifest), ie. md5sum of its manifest.csv
+#        --journal turns on --manifest JOURNAL_ALGORITHM unless another algorithm is given
+#     5) --resume skips everything the journal has an entry for (same session directory, series
+#        and stage), errors are never journalled so failed series are retried
+#     6) Several runs can share a journal, entries are appended under an exclusive flock
+
+
+import os
+import json
+import fcntl
+import hashlib
+import datetime
+import dcm_manifest
+
+JOURNAL_ALGORITHM = 'md5'
+
+STAGE_QA = 'qa'
+STAGE_FIX = 'fix'
+STAGE_QA_FIX = 'qa_fix'
+
+
+def get_key(dir_session, series, stage):
+# Sessions are keyed by absolute path, runs from another directory find their entries
+    return (os.path.abspath(dir_session), series, stage)
+
+
+def load_journal(fname_journal):
+# {(session, series, stage): entry} of the entries in a journal, the last one wins
+    lut_entries = {}
+    if not os.path.exists(fname_journal):
+        return lut_entries
+    data = open(fname_journal, 'rb').read()
+    list_lines = data.split('\n')
+    for line in list_lines[:-1]:            # anything after the last newline is a torn entry
+        try:
+            entry = json.loads(line)
+            lut_entries[(entry['session'], entry['series'], entry['stage'])] = entry
+        except (ValueError, KeyError, TypeError):
+            continue
+    return lut_entries
+
+
+def get_checksum(algorithm, list_rows):
+# Checksum of the outputs of a series, hash of its manifest text
+    return hashlib.new(algorithm, dcm_manifest.format_manifest(list_rows)).hexdigest()
+
+
+class DcmJournal(object):
+
+    def __init__(self, fname_journal):
+        self.fname_journal = fname_journal
+        self.lut_entries = load_journal(fname_journal)
+        is_new = not os.path.exists(fname_journal)
+        self.fd = os.open(fname_journal, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0644)
+        if is_new:
+            # directory entry of the new journal on disk with its first entries
+            fd_dir = os.open(os.path.dirname(os.path.abspath(fname_journal)), os.O_RDONLY)
+            try:
+                os.fsync(fd_dir)
+            finally:
+                os.close(fd_dir)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            # end a torn last line, so the next entry starts on a line of its own
+            if os.fstat(self.fd).st_size > 0:
+                os.lseek(self.fd, -1, os.SEEK_END)
+                if os.read(self.fd, 1) != '\n':
+                    self.write_data('\n')
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def is_done(self, dir_session, series, stage):
+        return get_key(dir_session, series, stage) in self.lut_entries
+
+    def get_entry(self, dir_session, series, stage):
+        return self.lut_entries.get(get_key(dir_session, series, stage))
+
+    def make_entry(self, dir_session, series, stage, outcome, lut_outputs=None, algorithm=''):
+        session, series, stage = get_key(dir_session, series, stage)
+        entry = {'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                 'session': session, 'series': series, 'stage': stage, 'outcome': outcome}
+        if lut_outputs:
+            entry['algorithm'] = algorithm
+            entry['outputs'] = lut_outputs
+        return entry
+
+    def write_data(self, data):
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def write(self, list_entries):
+    # Append finished entries, one locked write and an fsync
+        if len(list_entries) == 0:
+            return
+        data = ''.join([json.dumps(entry, sort_keys=True) + '\n' for entry in list_entries])
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            self.write_data(data)
+            os.fsync(self.fd)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        for entry in list_entries:
+            self.lut_entries[(entry['session'], entry['series'], entry['stage'])] = entry
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+# Per series checksum manifests of the fix scripts (--manifest)
+#   One row per output file with its size, hash and the hash of its pixel data section, the
+#   hashes are computed while the file is written (dcm_write.DcmHasher)
+
+#    File Name:  dcm_manifest.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - remove_manifest, for outputs rewritten without --manifest
+#       C - 2026-10-18 - write_manifest sync, fsync before the rename (--journal)
+
+
+# NOTES
+#     1) FNAME_MANIFEST in each output series directory (or archive series directory), CSV
+#     2) pixel_hash is the hash of the Pixel Data value only, which the rewrite never changes -
+#        it can be checked against the source file. Empty for files without pixel data
+#     3) The algorithm is any hashlib one, recorded on every row
+#     4) A series rewritten without --manifest has its old manifest removed, its hashes would no
+#        longer match the files
+
+
+import os
+import csv
+import hashlib
+import StringIO
+
+FNAME_MANIFEST = 'manifest.csv'
+
+list_columns = ['fname', 'size', 'algorithm', 'file_hash', 'pixel_hash']
+list_algorithms = sorted(hashlib.algorithms)
+
+
+def get_row(fname, algorithm, lut_hashes):
+# Manifest row from dcm_write hashes {'size', 'file', 'pixel'}
+    return {'fname': fname, 'size': lut_hashes['size'], 'algorithm': algorithm,
+            'file_hash': lut_hashes['file'], 'pixel_hash': lut_hashes['pixel']}
+
+
+def format_manifest(list_rows):
+    f = StringIO.StringIO()
+    writer = csv.DictWriter(f, list_columns, lineterminator='\n')
+    writer.writeheader()
+    for row in sorted(list_rows, key=lambda row: row['fname']):
+        writer.writerow(row)
+    return f.getvalue()
+
+
+def write_manifest(dir_out, list_rows, sync=0):
+# Manifest of an output directory, temporary file + rename, fsync'd first with sync
+    fname_manifest = '%s/%s' % (dir_out, FNAME_MANIFEST)
+    f = open(fname_manifest + '.tmp', 'w')
+    f.write(format_manifest(list_rows))
+    if sync:
+        f.flush()
+        os.fsync(f.fileno())
+    f.close()
+    os.rename(fname_manifest + '.tmp', fname_manifest)
+
+
+def remove_manifest(dir_out):
+# Drop the manifest of an output directory rewritten without hashes
+    fname_manifest = '%s/%s' % (dir_out, FNAME_MANIFEST)
+    if os.path.exists(fname_manifest):
+        os.remove(fname_manifest)
+
+
+def load_manifest(dir_out):
+# {fname: row} of an existing manifest, {} if there is none
+    fname_manifest = '%s/%s' % (dir_out, FNAME_MANIFEST)
+    if not os.path.exists(fname_manifest):
+        return {}
+    lut_rows = {}
+    for row in csv.DictReader(open(fname_manifest, 'r')):
+        lut_rows[row['fname']] = row
+    return lut_rows
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+
+# Pixel level QA metrics of a series (DCM_QA.py --pixel)
+#   Header checks can't see artefacts, these metrics look at the images themselves
+#       Time series (fMRI / DTI)    - temporal SNR, mean signal drift, slice-wise spike count
+#       Single volume (structural)  - SNR, background ghosting ratio
+
+#    File Name:  dcm_pixel.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+
+
+# NOTES
+#     1) Volumes are streamed one at a time (a volume is one MOSAIC file, or num_slices files),
+#        only running sums are kept, so memory is constant in the number of volumes
+#        Single volume series are streamed one slice at a time
+#     2) MOSAIC files are un-tiled with MOSAIC_slices (0019,100a), tiles are ceil(sqrt(slices))
+#        across and down
+#     3) Uncompressed, single frame, single sample per pixel data only, anything else raises
+#        DcmReadError and the series is reported as SKIPPED
+#     4) Time series
+#           tSNR        - median over the brain mask of mean / std across volumes
+#           drift_pct   - linear trend of mask mean signal over the run, % of mean signal
+#           spikes      - (volume, slice) pairs whose slice mean, relative to the median slice mean
+#                         of its volume, is more than SPIKE_Z robust z-scores away from that slice's median
+#        The mask is voxels above the mean of the first volume. DTI volumes mix b-values so tSNR
+#        and drift there mostly reflect diffusion weighting, spikes are still meaningful
+#     5) Single volume, central half of the slices
+#           SNR         - 0.655 * mean(central ROI) / std(corner background), Rayleigh corrected
+#           ghost_ratio - (mean(ghost strips) - mean(corner background)) / mean(central ROI)
+#                         ghost strips are the edges along the phase encode direction (PhaseDir)
+
+
+import numpy
+import dcm_read
+
+SPIKE_Z = 5.0
+RAYLEIGH = 0.655        # background std of magnitude images is 0.655 * noise sigma
+EDGE_FRACTION = 8       # background corner / ghost strip width is 1/8 of the image
+
+TAG_ROWS = 0x00280010
+TAG_COLS = 0x00280011
+TAG_SAMPLES = 0x00280002
+TAG_BITS_ALLOC = 0x00280100
+TAG_PIXEL_REP = 0x00280103
+
+
+def read_pixels(full_name_dcm):
+# Image of one file as float32 [rows, cols], straight out of the mapped file
+    dcm_file = dcm_read.open_dcm(full_name_dcm)
+    dcm_file.index_to(dcm_read.TAG_PIXEL_DATA)
+    rows = dcm_file.get_value(TAG_ROWS)
+    cols = dcm_file.get_value(TAG_COLS)
+    bits_alloc = dcm_file.get_value(TAG_BITS_ALLOC)
+    if dcm_file.pixel_element is None or 'NULL' in [rows, cols, bits_alloc]:
+        raise dcm_read.DcmReadError('%s : no pixel data' % (full_name_dcm,))
+    if dcm_file.get_value(TAG_SAMPLES) not in [1, 'NULL'] or bits_alloc not in [8, 16, 32]:
+        raise dcm_read.DcmReadError('%s : unsupported pixel format' % (full_name_dcm,))
+    vr, pos_value, length = dcm_file.pixel_element
+    if length == dcm_read.UNDEFINED_LENGTH:
+        raise dcm_read.DcmReadError('%s : compressed pixel data' % (full_name_dcm,))
+    if dcm_file.get_value(TAG_PIXEL_REP) == 1:
+        dtype = numpy.dtype('%si%d' % (dcm_file.endian, bits_alloc // 8))
+    else:
+        dtype = numpy.dtype('%su%d' % (dcm_file.endian, bits_alloc // 8))
+    if rows * cols * dtype.itemsize > length or pos_value + length > dcm_file.size:
+        raise dcm_read.DcmReadError('%s : truncated pixel data' % (full_name_dcm,))
+    # astype copies, nothing keeps pointing into the mapping once it is evicted
+    return numpy.frombuffer(dcm_file.buf, dtype, rows * cols, pos_value).reshape(rows, cols).astype(numpy.float32)
+
+
+def untile_mosaic(image, num_slices):
+# MOSAIC image -> [slices, rows, cols]
+    num_tiles = int(numpy.ceil(numpy.sqrt(num_slices)))
+    rows = image.shape[0] // num_tiles
+    cols = image.shape[1] // num_tiles
+    tiles = image[:rows*num_tiles, :cols*num_tiles].reshape(num_tiles, rows, num_tiles, cols)
+    return tiles.transpose(0, 2, 1, 3).reshape(num_tiles * num_tiles, rows, cols)[:num_slices]
+
+
+def iter_volumes(list_files, num_vol, num_slices, is_mosaic):
+# Volumes [slices, rows, cols] in acquisition order, one at a time
+    if is_mosaic:
+        for full_name_dcm in list_files:
+            yield untile_mosaic(read_pixels(full_name_dcm), num_slices)
+        return
+    files_per_vol = len(list_files) // num_vol
+    for count_vol in range(num_vol):
+        yield numpy.array([read_pixels(full_name_dcm) for full_name_dcm in \
+            list_files[count_vol*files_per_vol:(count_vol+1)*files_per_vol]])
+
+
+def iter_slices(list_files, num_slices, is_mosaic):
+# Slices [rows, cols] of a single volume series, one at a time
+    for full_name_dcm in list_files:
+        if is_mosaic:
+            for image in untile_mosaic(read_pixels(full_name_dcm), num_slices):
+                yield image
+        else:
+            yield read_pixels(full_name_dcm)
+
+
+def count_spikes(slice_means):
+# slice_means[volume, slice] -> (number of spikes, number of slices with a spike)
+    median = numpy.median(slice_means, axis=0)
+    mad = numpy.median(numpy.abs(slice_means - median), axis=0) * 1.4826
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        z = numpy.abs(slice_means - median) / mad
+    spikes = numpy.nan_to_num(z) > SPIKE_Z
+    return int(spikes.sum()), int(spikes.any(axis=0).sum())
+
+
+def temporal_metrics(volumes):
+# tSNR, drift and spikes from a stream of volumes, Welford running mean / variance
+    num_vol = 0
+    for volume in volumes:
+        volume = volume.astype(numpy.float64)
+        num_vol = num_vol + 1
+        if num_vol == 1:
+            mask = volume > volume.mean()
+            mean_vol = numpy.zeros(volume.shape)
+            sum_sq = numpy.zeros(volume.shape)
+            list_signal = []
+            list_slice_means = []
+        delta = volume - mean_vol
+        mean_vol += delta / num_vol
+        sum_sq += delta * (volume - mean_vol)
+        signal = volume[mask].mean()
+        list_signal.append(signal)
+        slice_means = volume.reshape(volume.shape[0], -1).mean(axis=1)
+        list_slice_means.append(slice_means / max(numpy.median(slice_means), 1e-6))
+
+    if num_vol < 2:
+        return {}
+    std_vol = numpy.sqrt(sum_sq[mask] / (num_vol - 1))
+    valid = std_vol > 0
+    tsnr = numpy.median(mean_vol[mask][valid] / std_vol[valid]) if valid.any() else 0.0
+    list_signal = numpy.array(list_signal)
+    slope = numpy.polyfit(numpy.arange(num_vol), list_signal, 1)[0]
+    drift_pct = 100.0 * slope * (num_vol - 1) / max(list_signal.mean(), 1e-6)
+    num_spikes, num_spike_slices = count_spikes(numpy.array(list_slice_means))
+    return {'tSNR': round(float(tsnr), 2), 'drift_pct': round(float(drift_pct), 3),
+            'spikes': num_spikes, 'spike_slices': num_spike_slices}
+
+
+def structural_metrics(slices, num_slices, phase_dir):
+# SNR and ghosting ratio from a stream of slices, central half of the slices only
+    lut_sum = {'signal': [0.0, 0], 'ghost': [0.0, 0], 'noise': [0.0, 0]}
+    sum_sq_noise = 0.0
+    count_slice = -1
+    for image in slices:
+        count_slice = count_slice + 1
+        if count_slice < num_slices // 4 or count_slice >= num_slices - num_slices // 4:
+            continue
+        image = image.astype(numpy.float64)
+        rows, cols = image.shape
+        edge_r = max(rows // EDGE_FRACTION, 1)
+        edge_c = max(cols // EDGE_FRACTION, 1)
+        signal = image[rows//4:rows-rows//4, cols//4:cols-cols//4]
+        noise = numpy.concatenate([image[:edge_r, :edge_c].ravel(), image[:edge_r, -edge_c:].ravel(),
+            image[-edge_r:, :edge_c].ravel(), image[-edge_r:, -edge_c:].ravel()])
+        if phase_dir == 'ROW':
+            # phase encoded along a row, ghosts repeat left / right
+            ghost = numpy.concatenate([image[rows//4:rows-rows//4, :edge_c].ravel(), \
+                image[rows//4:rows-rows//4, -edge_c:].ravel()])
+        else:
+            ghost = numpy.concatenate([image[:edge_r, cols//4:cols-cols//4].ravel(), \
+                image[-edge_r:, cols//4:cols-cols//4].ravel()])
+        for name, values in [('signal', signal), ('ghost', ghost), ('noise', noise)]:
+            lut_sum[name][0] = lut_sum[name][0] + values.sum()
+            lut_sum[name][1] = lut_sum[name][1] + values.size
+        sum_sq_noise = sum_sq_noise + (noise ** 2).sum()
+
+    if lut_sum['signal'][1] == 0 or lut_sum['noise'][1] < 2:
+        return {}
+    mean_signal, mean_ghost, mean_noise = [lut_sum[name][0] / lut_sum[name][1] for name in ['signal', 'ghost', 'noise']]
+    std_noise = numpy.sqrt(max(sum_sq_noise / lut_sum['noise'][1] - mean_noise ** 2, 0))
+    metrics = {'ghost_ratio': round(float((mean_ghost - mean_noise) / max(mean_signal, 1e-6)), 4)}
+    if std_noise > 0:
+        metrics['SNR'] = round(float(RAYLEIGH * mean_signal / std_noise), 2)
+    return metrics
+
+
+def series_metrics(list_files, num_vol, num_slices, is_mosaic, phase_dir):
+# Pixel QA metrics of a series, time series metrics if there is more than one volume
+    if num_vol > 1:
+        return temporal_metrics(iter_volumes(list_files, num_vol, num_slices, is_mosaic))
+    return structural_metrics(iter_slices(list_files, num_slices, is_mosaic), num_slices, phase_dir)
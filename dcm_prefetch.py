@@ -0,0 +1,134 @@
+#!/usr/bin/python
+
+# Bounded-concurrency read-ahead for high latency storage (ie. NFS)
+#   A producer thread walks the reads a consumer is going to make, in order, and a pool of
+#   threads runs them ahead of time. The consumer picks the results up in the same order,
+#   so wall time depends on bandwidth rather than on the round trip of each open / read
+
+#    File Name:  dcm_prefetch.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - close() wakes and joins every thread
+
+
+# NOTES
+#     1) Threads, not asyncio (not available in python 2), the blocking reads release the GIL
+#     2) At most max_inflight results are running or waiting to be consumed, the producer blocks
+#        until the consumer catches up, memory stays bounded
+#     3) get() of a key that was never prefetched (or already consumed) calls the read directly,
+#        results of keys skipped by the consumer are dropped, so the consumer never waits on
+#        something that is not coming
+#     4) iter_keys runs on the producer thread, anything it opens (ie. an SQLite connection)
+#        must be opened inside it
+#     5) read_func must be thread safe (ie. dcm_read.read_dcm_tags with cache=0)
+#     6) close() wakes the producer and readers and joins them, nothing is left running at
+#        interpreter shutdown. The producer stops between keys, and closes iter_keys on its thread
+
+
+import sys
+import Queue
+import threading
+import itertools
+
+
+class PendingRead(object):
+    __slots__ = ['seq', 'event', 'result', 'error', 'dropped']
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.dropped = 0
+
+
+class Prefetcher(object):
+
+    def __init__(self, read_func, iter_keys, num_threads=8, max_inflight=64):
+        self.read_func = read_func
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(max_inflight)
+        self.queue = Queue.Queue()
+        self.lut_pending = {}       # key -> PendingRead, submitted and not yet consumed
+        self.stopped = 0
+        self.list_threads = [threading.Thread(target=self.run_producer, args=(iter_keys, num_threads))]
+        for count_thread in range(num_threads):
+            self.list_threads.append(threading.Thread(target=self.run_reader))
+        for thread in self.list_threads:
+            thread.daemon = True
+            thread.start()
+
+    def run_producer(self, iter_keys, num_threads):
+        try:
+            for seq, key in itertools.izip(itertools.count(), iter_keys):
+                if self.stopped:
+                    break
+                self.slots.acquire()
+                with self.lock:
+                    if self.stopped:
+                        break
+                    if key in self.lut_pending:
+                        self.slots.release()
+                        continue
+                    pending = PendingRead(seq)
+                    self.lut_pending[key] = pending
+                self.queue.put((key, pending))
+        except Exception:
+            pass        # the consumer will run into the same problem reading directly
+        finally:
+            if hasattr(iter_keys, 'close'):
+                iter_keys.close()
+            for count_thread in range(num_threads):
+                self.queue.put(None)
+
+    def run_reader(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            key, pending = item
+            if not pending.dropped:
+                try:
+                    pending.result = self.read_func(key)
+                except Exception:
+                    pending.error = sys.exc_info()
+            with self.lock:
+                pending.event.set()
+                if pending.dropped:
+                    self.slots.release()
+
+    def get(self, key, read_direct, *args):
+    # Prefetched result of key, read_direct(*args) if it was not prefetched
+        with self.lock:
+            pending = self.lut_pending.pop(key, None)
+            if pending is not None:
+                # anything submitted before key was skipped by the consumer, give its slot back
+                for key_stale in [key_curr for key_curr in self.lut_pending if self.lut_pending[key_curr].seq < pending.seq]:
+                    self.drop(self.lut_pending.pop(key_stale))
+        if pending is None:
+            return read_direct(*args)
+        pending.event.wait()
+        self.slots.release()
+        if pending.error is not None:
+            raise pending.error[0], pending.error[1], pending.error[2]
+        return pending.result
+
+    def drop(self, pending):
+    # (lock held) forget a pending read, its slot is freed once it is no longer running
+        pending.dropped = 1
+        if pending.event.is_set():
+            self.slots.release()
+
+    def close(self):
+        with self.lock:
+            self.stopped = 1
+            for key in self.lut_pending.keys():
+                self.drop(self.lut_pending.pop(key))
+        # wake anything waiting for a slot or a read, then wait for every thread to finish
+        for thread in self.list_threads:
+            self.slots.release()
+        for count_thread in range(len(self.list_threads) - 1):
+            self.queue.put(None)
+        for thread in self.list_threads:
+            thread.join()
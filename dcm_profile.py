@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+# Per-stage timing for DCM_QA.py and the fix scripts (--profile)
+#   Stages are timed with "with dcm_profile.timer('stage'):" blocks, and a summary of counts,
+#   totals and p50 / p95 / p99 latencies is printed at exit
+
+#    File Name:  dcm_profile.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+
+
+# NOTES
+#     1) When profiling is off timer() hands back one shared do-nothing object, a hook costs a
+#        function call and nothing is stored
+#     2) Stages can nest (ie. read_hdr inside full), so stage totals do not add up to the run time
+#     3) Worker processes hand their samples back with each result (drain / merge)
+#     4) Summary goes to stderr so it stays out of QA logs, --profile_out also writes it to a
+#        .json or .csv file
+
+
+import os
+import sys
+import time
+import json
+import array
+import atexit
+import numpy
+
+enabled = 0
+lut_samples = {}        # stage -> durations [s]
+
+
+class StageTimer(object):
+    __slots__ = ['stage', 'time_start']
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.time_start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.stage, time.time() - self.time_start)
+
+
+class NullTimer(object):
+    __slots__ = []
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+null_timer = NullTimer()
+
+
+def timer(stage):
+    if enabled:
+        return StageTimer(stage)
+    return null_timer
+
+
+def record(stage, sec):
+    if stage not in lut_samples:
+        lut_samples[stage] = array.array('d')
+    lut_samples[stage].append(sec)
+
+
+def drain():
+# Samples collected so far (as plain lists, for pickling), and forget them
+    global lut_samples
+    lut_drained = dict([(stage, list(lut_samples[stage])) for stage in lut_samples])
+    lut_samples = {}
+    return lut_drained
+
+
+def merge(lut_other):
+    for stage in lut_other:
+        if stage not in lut_samples:
+            lut_samples[stage] = array.array('d')
+        lut_samples[stage].extend(lut_other[stage])
+
+
+def summarize():
+# One row per stage, largest total first
+    list_rows = []
+    for stage in lut_samples:
+        samples = numpy.frombuffer(lut_samples[stage], dtype=float) * 1000
+        if len(samples) == 0:
+            continue
+        p50, p95, p99 = numpy.percentile(samples, [50, 95, 99])
+        list_rows.append({'stage': stage, 'count': len(samples), 'total_sec': round(samples.sum() / 1000, 4),
+            'mean_ms': round(samples.mean(), 3), 'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3),
+            'p99_ms': round(p99, 3)})
+    list_rows.sort(key=lambda row: -row['total_sec'])
+    return list_rows
+
+
+list_columns = ['stage', 'count', 'total_sec', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms']
+
+
+def report(fname_out=''):
+    list_rows = summarize()
+    sys.stderr.write('PROFILE %-16s %8s %10s %10s %10s %10s %10s\n' % tuple(list_columns))
+    for row in list_rows:
+        sys.stderr.write('        %-16s %8d %10.3f %10.3f %10.3f %10.3f %10.3f\n' % \
+            tuple([row[column] for column in list_columns]))
+    if fname_out:
+        f = open(fname_out, 'w')
+        if os.path.splitext(fname_out)[1].lower() == '.csv':
+            f.write(','.join(list_columns) + '\n')
+            for row in list_rows:
+                f.write(','.join([str(row[column]) for column in list_columns]) + '\n')
+        else:
+            json.dump({'argv': sys.argv, 'stages': list_rows}, f, indent=1, sort_keys=True)
+        f.close()
+
+
+def setup(profile, fname_out=''):
+# Turn on profiling from the command line options, summary printed when the program exits
+    if profile or fname_out:
+        enable()
+        atexit.register(report, fname_out)
+
+
+def enable():
+    global enabled
+    enabled = 1
@@ -0,0 +1,372 @@
+#!/usr/bin/python
+
+# Native DICOM header reader
+#   Walks the data elements of a DICOM file in-process and returns typed values for the
+#   requested tags. Used by DCM_QA.py in place of one dcmdump call per file.
+
+#    File Name:  dcm_read.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation, replaces dcmdump text parsing in get_dcm_value
+#       B - 2026-10-18 - mmap'd, offset indexed reading (DcmFile)
+#       C - 2026-10-18 - Whole file element walk (iter_elements) for dcm_write
+
+
+# NOTES
+#     1) Parsing stops at the first tag past the largest requested tag, and never goes past
+#        Pixel Data (7FE0,0010), so only the header portion of a file is read
+#     2) Supports implicit VR little endian, explicit VR little/big endian and all the
+#        encapsulated (JPEG etc.) transfer syntaxes. Deflated files raise DcmReadError so the
+#        caller can fall back to dcmdump
+#     3) Values are typed by VR - DS/FL/FD become float, IS/US/UL/SS/SL become int, multi-valued
+#        fields become lists (ie. ImageOrient, PixelSpacing, AcquisitionMatrix, ImageType)
+#        Tags not in the file are returned as 'NULL', as dcmdump parsing did
+#     4) Files are mmap'd and walked by element offsets (DcmFile). Values are only copied out for
+#        requested tags, and pixel data / large binary values are skipped by length, so their
+#        pages are never touched. The last CACHE_FILES files stay mapped with their offset index,
+#        a later lookup in one of them (ie. --full after first / last) does no extra I/O
+#        - files must not be truncated in place while mapped (rewrites go through a new file)
+
+
+import os
+import mmap
+import struct
+import collections
+
+TAG_PIXEL_DATA = 0x7fe00010
+TAG_ITEM = 0xfffee000
+TAG_ITEM_DELIM = 0xfffee00d
+TAG_SEQ_DELIM = 0xfffee0dd
+UNDEFINED_LENGTH = 0xffffffff
+
+CACHE_FILES = 8     # recently read files kept mapped, with their offset index
+
+TS_IMPLICIT_LE = '1.2.840.10008.1.2'
+TS_EXPLICIT_BE = '1.2.840.10008.1.2.2'
+TS_DEFLATED = '1.2.840.10008.1.2.1.99'
+
+# Explicit VRs that carry 2 reserved bytes and a 4 byte length
+list_long_vr = set(['OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'SQ', 'SV', 'UC', 'UN', 'UR', 'UT', 'UV'])
+# Explicit VRs with binary values that are never converted
+list_binary_vr = set(['OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'SQ', 'UN'])
+# Text VRs where backslash is not a value separator
+list_text_vr = set(['LT', 'ST', 'UT', 'UR'])
+# struct formats of numeric binary VRs
+lut_numeric_fmt = {'US': 'H', 'SS': 'h', 'UL': 'I', 'SL': 'i', 'FL': 'f', 'FD': 'd'}
+
+# VR of tags read or written by the QA / fix scripts, needed for implicit VR files
+# (and for Siemens private tags that arrive as UN)
+lut_dcm_vr = {
+    '0002,0010': 'UI',
+    '0008,0008': 'CS',
+    '0008,0020': 'DA',
+    '0008,0030': 'TM',
+    '0008,0070': 'LO',
+    '0008,1030': 'LO',
+    '0008,103e': 'LO',
+    '0010,0010': 'PN',
+    '0010,0020': 'LO',
+    '0010,0030': 'DA',
+    '0010,0040': 'CS',
+    '0010,1010': 'AS',
+    '0010,1020': 'DS',
+    '0010,1030': 'DS',
+    '0010,2154': 'SH',
+    '0018,0050': 'DS',
+    '0018,0080': 'DS',
+    '0018,0081': 'DS',
+    '0018,0082': 'DS',
+    '0018,0088': 'DS',
+    '0018,1310': 'US',
+    '0018,1312': 'CS',
+    '0018,1314': 'DS',
+    '0019,100a': 'US',      # Siemens NumberOfImagesInMosaic
+    '0020,000d': 'UI',
+    '0020,000e': 'UI',
+    '0020,0011': 'IS',
+    '0020,0012': 'IS',
+    '0020,0013': 'IS',
+    '0020,0032': 'DS',
+    '0020,0037': 'DS',
+    '0020,1041': 'DS',
+    '0028,0002': 'US',
+    '0028,0010': 'US',
+    '0028,0011': 'US',
+    '0028,0030': 'DS',
+    '0028,0100': 'US',
+    '0028,0101': 'US',
+    '0028,0103': 'US',
+}
+
+
+class DcmReadError(Exception):
+    pass
+
+
+def tag_to_int(dcm_tag):
+# '0018,0080' -> 0x00180080
+    group, element = dcm_tag.split(',')
+    return (int(group, 16) << 16) | int(element, 16)
+
+
+def int_to_tag(tag_int):
+# 0x00180080 -> '0018,0080'
+    return '%04x,%04x' % (tag_int >> 16, tag_int & 0xffff)
+
+
+lut_int_vr = dict((tag_to_int(dcm_tag), lut_dcm_vr[dcm_tag]) for dcm_tag in lut_dcm_vr)
+lut_tag_int = dict((dcm_tag, tag_to_int(dcm_tag)) for dcm_tag in lut_dcm_vr)
+
+# (tag + 4 byte length, 2 byte length, 4 byte length) element header layouts per endian
+lut_structs = dict((endian, (struct.Struct(endian + 'HHI'), struct.Struct(endian + 'H'), struct.Struct(endian + 'I'))) \
+    for endian in ['<', '>'])
+
+lut_open = collections.OrderedDict()        # path -> DcmFile, least recently used first
+
+
+def convert_text(vr, text):
+# Convert the text form of a value (as stored, or as printed by dcmdump) based on its VR
+    text = text.strip(' \x00')
+    if vr in list_text_vr:
+        return text
+    if vr in ['DS', 'FL', 'FD', 'IS', 'US', 'SS', 'UL', 'SL']:
+        if len(text) == 0:
+            return 'NULL'
+        if vr in ['DS', 'FL', 'FD']:
+            values = [float(value) for value in text.split('\\')]
+        else:
+            values = [int(value) for value in text.split('\\')]
+    else:
+        values = [value.strip(' ') for value in text.split('\\')]
+    if len(values) == 1:
+        return values[0]
+    return values
+
+
+def convert_value(vr, raw, endian='<', tag_int=None):
+# Convert raw value bytes of an element based on its VR
+    if vr == 'UN' and tag_int in lut_int_vr:
+        vr = lut_int_vr[tag_int]
+    if vr in lut_numeric_fmt:
+        fmt = lut_numeric_fmt[vr]
+        num_values = len(raw) // struct.calcsize(fmt)
+        if num_values == 0:
+            return 'NULL'
+        values = list(struct.unpack(endian + fmt * num_values, raw[:num_values * struct.calcsize(fmt)]))
+        if len(values) == 1:
+            return values[0]
+        return values
+    if vr in list_binary_vr:
+        return raw
+    return convert_text(vr, raw)
+
+
+class DcmFile(object):
+# A DICOM file mapped into memory, with an index of its top level element offsets
+#   The index is built lazily, only as far as the largest tag asked for, and never past Pixel Data
+
+    def __init__(self, full_name_dcm, file_key=None):
+        self.full_name_dcm = full_name_dcm
+        f = open(full_name_dcm, 'rb')
+        try:
+            st = os.fstat(f.fileno())
+            if st.st_size == 0:
+                raise DcmReadError('Empty file')
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()           # the mapping outlives the file descriptor
+        self.size = st.st_size
+        self.file_key = file_key or (st.st_size, st.st_mtime)
+        self.lut_offsets = {}       # tag -> (vr, value offset, length)
+        self.tag_last = -1          # largest tag indexed so far
+        self.pixel_offset = None    # offset of the Pixel Data element header
+        self.pixel_element = None   # (vr, value offset, length) of Pixel Data
+        self.done = False
+        self.endian, self.explicit_vr = self._read_meta()
+        self.pos_dataset = self.pos     # end of preamble / file meta
+
+    def _header(self, pos, endian, explicit_vr):
+    # (tag, vr, length, value offset) of the element at pos, None at end of file
+        if pos + 8 > self.size:
+            return None
+        struct_tag, struct_short, struct_long = lut_structs[endian]
+        group, element, length = struct_tag.unpack_from(self.buf, pos)
+        tag_int = (group << 16) | element
+        if group == 0xfffe:
+            # Item / delimiters never have a VR
+            return tag_int, None, length, pos + 8
+        if not explicit_vr:
+            if length == UNDEFINED_LENGTH:
+                return tag_int, 'SQ', length, pos + 8
+            return tag_int, lut_int_vr.get(tag_int, 'UN'), length, pos + 8
+        vr = self.buf[pos+4:pos+6]
+        if vr in list_long_vr:
+            if pos + 12 > self.size:
+                raise DcmReadError('Truncated element header')
+            return tag_int, vr, struct_long.unpack_from(self.buf, pos + 8)[0], pos + 12
+        return tag_int, vr, struct_short.unpack_from(self.buf, pos + 6)[0], pos + 8
+
+    def _skip(self, pos, length, explicit_vr):
+    # Offset past a value, walking items for undefined length sequences / encapsulated data
+        if length != UNDEFINED_LENGTH:
+            return pos + length
+        while True:
+            elem = self._header(pos, self.endian, explicit_vr)
+            if elem is None:
+                raise DcmReadError('Unterminated sequence')
+            tag_int, vr, length, pos = elem
+            if tag_int in (TAG_SEQ_DELIM, TAG_ITEM_DELIM):
+                return pos
+            # UN of undefined length is always implicit VR inside
+            pos = self._skip(pos, length, explicit_vr and vr != 'UN')
+
+    def _read_meta(self):
+    # Index group 0002, returns (endian, explicit_vr) and sets where the dataset starts
+        if self.size >= 132 and self.buf[128:132] == 'DICM':
+            pos = 132
+            transfer_syntax = None
+            while True:
+                elem = self._header(pos, '<', True)
+                if elem is None or (elem[0] >> 16) != 0x0002:
+                    break
+                tag_int, vr, length, pos_value = elem
+                self.lut_offsets[tag_int] = (vr, pos_value, length)
+                if tag_int == 0x00020010:
+                    transfer_syntax = self.buf[pos_value:pos_value+length].strip(' \x00')
+                pos = pos_value + length
+            self.pos = pos
+            if transfer_syntax == TS_DEFLATED:
+                raise DcmReadError('Deflated transfer syntax not supported')
+            if transfer_syntax == TS_IMPLICIT_LE:
+                return '<', False
+            if transfer_syntax == TS_EXPLICIT_BE:
+                return '>', True
+            return '<', True
+
+        # No preamble (ACR-NEMA style), guess VR encoding from the first element
+        self.pos = 0
+        if self.size < 8:
+            raise DcmReadError('Not a DICOM file')
+        if self.buf[4:6].isalpha() and self.buf[4:6].isupper():
+            return '<', True
+        return '<', False
+
+    def iter_elements(self, pos, pos_stop, endian, explicit_vr):
+    # (tag, vr, start, value offset, length, end) of every top level element from pos, used to rewrite files
+        while pos + 8 <= pos_stop:
+            tag_int, vr, length, pos_value = self._header(pos, endian, explicit_vr)
+            if length == UNDEFINED_LENGTH:
+                pos_end = self._skip(pos_value, length, explicit_vr and vr != 'UN')
+            else:
+                pos_end = pos_value + length
+            if pos_end > self.size:
+                raise DcmReadError('Truncated value for %s' % (int_to_tag(tag_int),))
+            yield tag_int, vr, pos, pos_value, length, pos_end
+            pos = pos_end
+
+    def index_to(self, tag_stop):
+    # Extend the offset index until tag_stop (or Pixel Data / end of file) has been passed
+        endian = self.endian
+        explicit_vr = self.explicit_vr
+        lut_offsets = self.lut_offsets
+        buf = self.buf
+        struct_tag, struct_short = lut_structs[endian][0:2]
+        pos = self.pos
+        pos_end = self.size - 8
+        while not self.done and self.tag_last < tag_stop:
+            if pos > pos_end:
+                self.done = True
+                break
+            # common case inline, short explicit VR element
+            group, element, length = struct_tag.unpack_from(buf, pos)
+            vr = buf[pos+4:pos+6]
+            if explicit_vr and group != 0xfffe and vr not in list_long_vr:
+                tag_int = (group << 16) | element
+                length = struct_short.unpack_from(buf, pos + 6)[0]
+                pos_value = pos + 8
+            else:
+                tag_int, vr, length, pos_value = self._header(pos, endian, explicit_vr)
+            if tag_int >= TAG_PIXEL_DATA:
+                if tag_int == TAG_PIXEL_DATA:
+                    # kept out of lut_offsets, header lookups never copy pixels
+                    self.pixel_offset = pos
+                    self.pixel_element = (vr, pos_value, length)
+                self.done = True
+                break
+            lut_offsets[tag_int] = (vr, pos_value, length)
+            self.tag_last = tag_int
+            if length == UNDEFINED_LENGTH:
+                pos = self._skip(pos_value, length, explicit_vr and vr != 'UN')
+            else:
+                pos = pos_value + length
+        self.pos = pos
+
+    def get_raw(self, tag_int):
+    # (vr, raw bytes) of a top level element, (None, None) if absent or of undefined length
+        if tag_int > self.tag_last:
+            self.index_to(tag_int)
+        if tag_int not in self.lut_offsets:
+            return None, None
+        vr, pos_value, length = self.lut_offsets[tag_int]
+        if length == UNDEFINED_LENGTH:
+            return None, None
+        if pos_value + length > self.size:
+            raise DcmReadError('Truncated value for %s' % (int_to_tag(tag_int),))
+        return vr, self.buf[pos_value:pos_value+length]
+
+    def get_value(self, tag_int):
+        vr, raw = self.get_raw(tag_int)
+        if raw is None:
+            return 'NULL'
+        if (tag_int >> 16) == 0x0002:
+            return convert_value(vr, raw, '<', tag_int)        # file meta is always little endian
+        return convert_value(vr, raw, self.endian, tag_int)
+
+    def get_values(self, list_tags):
+    # {tag: value} for a list of 'gggg,eeee' tags, 'NULL' for tags not in the header
+        list_tag_int = [lut_tag_int.get(dcm_tag) or tag_to_int(dcm_tag) for dcm_tag in list_tags]
+        if len(list_tag_int) > 0:
+            self.index_to(max(list_tag_int))
+        tag_values = {}
+        for count_tag in range(len(list_tags)):
+            tag_int = list_tag_int[count_tag]
+            if tag_int in self.lut_offsets:
+                tag_values[list_tags[count_tag]] = self.get_value(tag_int)
+            else:
+                tag_values[list_tags[count_tag]] = 'NULL'
+        return tag_values
+
+    def close(self):
+        self.buf.close()
+
+
+def open_dcm(full_name_dcm):
+# DcmFile of a path, reused while the file keeps its size / mtime
+    st = os.stat(full_name_dcm)
+    file_key = (st.st_size, st.st_mtime)
+    dcm_file = lut_open.pop(full_name_dcm, None)
+    if dcm_file is not None and dcm_file.file_key != file_key:
+        dcm_file.close()
+        dcm_file = None
+    if dcm_file is None:
+        dcm_file = DcmFile(full_name_dcm, file_key)
+    lut_open[full_name_dcm] = dcm_file
+    while len(lut_open) > CACHE_FILES:
+        lut_open.popitem(last=False)[1].close()
+    return dcm_file
+
+
+def read_dcm_tags(full_name_dcm, list_tags, cache=1):
+# Returns {tag: value} for a list of 'gggg,eeee' tags, 'NULL' for tags not in the header
+#   cache=0 maps the file just for this call, needed from threads (the cache is not thread safe)
+    list_tags = list(list_tags)
+    try:
+        if cache:
+            return open_dcm(full_name_dcm).get_values(list_tags)
+        dcm_file = DcmFile(full_name_dcm)
+        try:
+            return dcm_file.get_values(list_tags)
+        finally:
+            dcm_file.close()
+    except (struct.error, ValueError), e:
+        raise DcmReadError('%s : %s' % (full_name_dcm, e))
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+# Compiled parameter rules for scan_params.cfg
+#   Each field of each scan type is compiled once into a typed rule, rules are then evaluated
+#   against a whole table of series parameters at a time
+
+#    File Name:  dcm_rules.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation, replaces per-field string parsing in DCM_QA.py
+
+
+# NOTES
+#     1) Rule kinds, from the config text of a field
+#           NULL        - "NULL", field is not checked
+#           RANGE       - "7-9", min <= value <= max
+#           EXACT       - "64" or "50,100" on a RES_ field, value must equal one of the values
+#           SET_TOL     - "5.19,7.65", value within max(TOL * value, TOL) of one of the values
+#           STRING      - "AX,SAG", value must be one of the strings
+#     2) A string value checked against a numeric rule (ie. TI = NULL vs 900) fails, and so does
+#        a number checked against a STRING rule
+
+
+import numpy
+
+RULE_NULL = 'NULL'
+RULE_RANGE = 'RANGE'
+RULE_EXACT = 'EXACT'
+RULE_SET_TOL = 'SET_TOL'
+RULE_STRING = 'STRING'
+
+
+def compile_rule(param_field, rule_text):
+# Typed rule for one field, keeps the config text for logging
+    rule = {'text': rule_text}
+    if rule_text == 'NULL':
+        rule['kind'] = RULE_NULL
+        return rule
+
+    try:
+        if rule_text.find('-') > -1:
+            rule['kind'] = RULE_RANGE
+            rule['min'] = float(rule_text.split('-')[0])
+            rule['max'] = float(rule_text.split('-')[1])
+            return rule
+        rule['values'] = numpy.array([float(value) for value in rule_text.split(',')])
+        if param_field.find('RES') > -1:
+            # Resolution must be exact unless MIN/MAX values have been specified
+            rule['kind'] = RULE_EXACT
+        else:
+            rule['kind'] = RULE_SET_TOL
+    except ValueError:
+        rule['kind'] = RULE_STRING
+        rule['values'] = set(rule_text.split(','))
+    return rule
+
+
+def to_float_array(list_values):
+# Numeric column, anything that is not a number becomes nan (and fails numeric rules)
+    column = numpy.empty(len(list_values))
+    for count_value in range(len(list_values)):
+        if type(list_values[count_value]) in [float, int]:
+            column[count_value] = list_values[count_value]
+        else:
+            column[count_value] = numpy.nan
+    return column
+
+
+def evaluate_rule(rule, list_values, TOL):
+# PASS (True) / FAIL (False) for a column of values of one field
+    if rule['kind'] == RULE_NULL:
+        return numpy.ones(len(list_values), dtype=bool)
+    if rule['kind'] == RULE_STRING:
+        return numpy.array([type(value) is str and value in rule['values'] for value in list_values], dtype=bool)
+
+    column = to_float_array(list_values)
+    with numpy.errstate(invalid='ignore'):
+        if rule['kind'] == RULE_RANGE:
+            return (column >= rule['min']) & (column <= rule['max'])
+        param_diff = numpy.abs(column[:, None] - rule['values'][None, :]).min(axis=1)
+        if rule['kind'] == RULE_EXACT:
+            return param_diff == 0
+        return param_diff < numpy.maximum(TOL * column, TOL)
+
+
+def evaluate_rules(lut_rules, list_params, TOL):
+# Check a table of series (list of params_out) against the rules of one scan type
+#   returns (list_fields, pass_matrix), pass_matrix[series, field]
+    list_fields = []
+    for param_field in sorted(lut_rules):
+        for params_out in list_params:
+            if param_field in params_out:
+                list_fields.append(param_field)
+                break
+
+    pass_matrix = numpy.ones((len(list_params), len(list_fields)), dtype=bool)
+    for count_field in range(len(list_fields)):
+        param_field = list_fields[count_field]
+        list_values = [params_out.get(param_field, 'NULL') for params_out in list_params]
+        pass_matrix[:, count_field] = evaluate_rule(lut_rules[param_field], list_values, TOL)
+    return list_fields, pass_matrix
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+
+# Scan type classifier shared by DCM_QA.py, fix_dcm_brainCODE.py and create_dcm_mod.py
+#   Replaces a check_scan_type call per (directory, scan type) with a single pass over the
+#   directory name
+
+#    File Name:  dcm_scan_type.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+
+
+# NOTES
+#     1) A scan type is a comma separated list of keywords (ie. "DTI,19dir", "fMRI,Stop_Signal")
+#        A directory matches when it contains every keyword of the scan type (substring match)
+#        and none of the ignore words
+#     2) Directory names and keywords have "-" replaced by "_" to remove variability
+#     3) All keywords of all scan types (and the ignore words) go into one Aho-Corasick
+#        automaton, so a directory name is scanned once whatever the number of scan types
+
+
+import collections
+
+list_ignore = ['_ADC','_TRACEW','_FA','_ColFA']   # processed DTI scans to ignore
+
+
+def clean_name(name):
+# remove variability of - or _
+    return name.replace('-','_')
+
+
+def build_classifier(list_scan_types):
+# Build the keyword automaton once from the scan types of a config
+    list_keywords = []
+    lut_keyword_id = {}
+
+    def add_keyword(keyword):
+        if keyword not in lut_keyword_id:
+            lut_keyword_id[keyword] = len(list_keywords)
+            list_keywords.append(keyword)
+        return lut_keyword_id[keyword]
+
+    ignore_ids = set([add_keyword(keyword) for keyword in list_ignore])
+
+    # keyword -> scan types needing it, and number of distinct keywords per scan type
+    lut_keyword_types = collections.defaultdict(list)
+    list_num_required = []
+    for count_type in range(len(list_scan_types)):
+        required_ids = set()
+        for keyword in list_scan_types[count_type].split(','):
+            keyword = clean_name(keyword.strip())
+            if len(keyword) > 0:            # empty keyword is always found
+                required_ids.add(add_keyword(keyword))
+        for keyword_id in required_ids:
+            lut_keyword_types[keyword_id].append(count_type)
+        list_num_required.append(len(required_ids))
+
+    # Trie of all keywords
+    goto = [{}]
+    out = [set()]
+    for keyword_id in range(len(list_keywords)):
+        state = 0
+        for char in list_keywords[keyword_id]:
+            if char not in goto[state]:
+                goto.append({})
+                out.append(set())
+                goto[state][char] = len(goto) - 1
+            state = goto[state][char]
+        out[state].add(keyword_id)
+
+    # Failure links, breadth first
+    fail = [0] * len(goto)
+    queue = collections.deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char in goto[state]:
+            next_state = goto[state][char]
+            queue.append(next_state)
+            fail_state = fail[state]
+            while fail_state and char not in goto[fail_state]:
+                fail_state = fail[fail_state]
+            fail[next_state] = goto[fail_state].get(char, 0)
+            out[next_state] = out[next_state] | out[fail[next_state]]
+
+    return {'scan_types': list(list_scan_types), 'goto': goto, 'fail': fail, 'out': out,
+            'ignore_ids': ignore_ids, 'keyword_types': dict(lut_keyword_types),
+            'num_required': list_num_required}
+
+
+def classify_scan(classifier, dir_curr_scan):
+# All scan types matching a directory name, in the order given to build_classifier
+    goto = classifier['goto']
+    fail = classifier['fail']
+    out = classifier['out']
+
+    found_ids = set()
+    state = 0
+    for char in clean_name(dir_curr_scan):
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        if out[state]:
+            found_ids.update(out[state])
+
+    if found_ids & classifier['ignore_ids']:
+        return []
+
+    num_found = [0] * len(classifier['scan_types'])
+    for keyword_id in found_ids:
+        for count_type in classifier['keyword_types'].get(keyword_id, []):
+            num_found[count_type] = num_found[count_type] + 1
+    return [classifier['scan_types'][count_type] for count_type in range(len(num_found)) \
+        if num_found[count_type] == classifier['num_required'][count_type]]
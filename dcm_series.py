@@ -0,0 +1,221 @@
+#!/usr/bin/python
+
+# Series level helpers for DCM_QA.py
+#   Series file discovery, and full-series consistency checks run on the headers of every
+#   file in a series
+
+#    File Name:  dcm_series.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation, full-series validation (--full)
+#       B - 2026-10-18 - Single pass series file listing
+
+
+# NOTES
+#     1) Headers are streamed into one numpy array per field, the checks themselves are array
+#        operations so a 448 volume fMRI series costs about the same as reading its headers
+#     2) MOSAIC series have one volume per file - slice position must stay constant and the
+#        AcquisitionNumber must increase file to file
+#        Single-frame series have one slice per file - every acquisition must have the same number
+#        of slices, with regular spacing along the slice normal
+#     3) Series files are listed with one scandir pass (dirent type, no stat per file). Falls back
+#        to listdir when scandir is not available (python < 3.5 without the scandir package)
+#        Sniffing identifies DICOM files by the DICM magic at offset 128, so files without an
+#        extension are found, but files without a preamble (old ACR-NEMA) are not
+
+
+import os
+import re
+import numpy
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+re_digits = re.compile(r'(\d+)')
+
+# lut_dcm_hdr fields loaded for every file of a series, with their value count
+lut_full_fields = {
+    'InstanceNumber': 1,
+    'AcquisitionNumber': 1,
+    'ImagePosition': 3,
+    'ImageOrient': 6,
+    'TR': 1,
+    'TE': 1,
+    'SliceLocation': 1,
+}
+
+TOL_ORIENT = 1e-3       # direction cosines
+TOL_POSITION = 0.01     # mm
+
+
+def natural_key(fname):
+# Sort key with numbers compared by value, IM-2.dcm before IM-10.dcm
+    return [int(part) if part.isdigit() else part for part in re_digits.split(fname)]
+
+
+def is_dicom_file(full_name_dcm):
+# DICM magic after the 128 byte preamble
+    try:
+        f = open(full_name_dcm, 'rb')
+        try:
+            f.seek(128)
+            return f.read(4) == 'DICM'
+        finally:
+            f.close()
+    except IOError:
+        return 0
+
+
+def list_series_files(fdir_curr_scan, list_ext, sniff=0):
+# Files of a series in natural order, by extension or (sniff) by DICM magic
+    set_ext = set(list_ext)
+    list_names = []
+    if scandir is not None:
+        for entry in scandir(fdir_curr_scan):
+            if not entry.name.startswith('.') and entry.is_file():
+                list_names.append(entry.name)
+    else:
+        list_names = [fname for fname in os.listdir(fdir_curr_scan) if not fname.startswith('.')]
+
+    list_files = []
+    for fname in list_names:
+        full_name_dcm = '%s/%s' % (fdir_curr_scan, fname)
+        if sniff:
+            if is_dicom_file(full_name_dcm):
+                list_files.append(full_name_dcm)
+        elif fname.find('.') > -1 and fname.rsplit('.', 1)[1] in set_ext:
+            list_files.append(full_name_dcm)
+    list_files.sort(key=lambda full_name_dcm: natural_key(full_name_dcm.rsplit('/', 1)[1]))
+    return list_files
+
+
+def load_series_hdr(list_files, read_func):
+# Stream header values of every file into arrays, read_func(fname) returns {field: value}
+#   missing values are left as nan
+    num_dcm = len(list_files)
+    hdr_series = {}
+    for field in lut_full_fields:
+        if lut_full_fields[field] == 1:
+            hdr_series[field] = numpy.empty(num_dcm)
+        else:
+            hdr_series[field] = numpy.empty((num_dcm, lut_full_fields[field]))
+        hdr_series[field].fill(numpy.nan)
+
+    for count_dcm in range(num_dcm):
+        tag_values = read_func(list_files[count_dcm])
+        for field in lut_full_fields:
+            value = tag_values[field]
+            if type(value) in [int, float, list]:
+                try:
+                    hdr_series[field][count_dcm] = value
+                except ValueError:
+                    pass        # wrong number of values, leave as nan
+    return hdr_series
+
+
+def log_fail(SCAN_LOG, field, message):
+    return SCAN_LOG + ['        [%s] : %s : FAIL' % (field, message)]
+
+
+def check_uniform(values, instance, field, TOL, SCAN_PASS, SCAN_LOG):
+# Every file must match the first file within tolerance
+    ref = values[0]
+    bad = numpy.abs(values - ref) > max(TOL * abs(ref), TOL)
+    bad = bad | (numpy.isnan(values) != numpy.isnan(ref))
+    if bad.any():
+        SCAN_PASS = 0
+        SCAN_LOG = log_fail(SCAN_LOG, field, '%s != %s in %d files (first at instance %g)' % \
+            (ref, values[bad][0], bad.sum(), instance[bad][0]))
+    return SCAN_PASS, SCAN_LOG
+
+
+def check_series_full(hdr_series, is_mosaic, TOL, SCAN_PASS, SCAN_LOG):
+# Consistency checks across all files of a series
+    num_dcm = len(hdr_series['InstanceNumber'])
+    if num_dcm == 0:
+        return SCAN_PASS, SCAN_LOG
+
+    # Work in instance order
+    order = numpy.argsort(hdr_series['InstanceNumber'], kind='mergesort')
+    instance = hdr_series['InstanceNumber'][order]
+    acquisition = hdr_series['AcquisitionNumber'][order]
+    position = hdr_series['ImagePosition'][order]
+    orient = hdr_series['ImageOrient'][order]
+
+    # Instance numbers must be unique and contiguous (no dropped files)
+    if numpy.isnan(instance).any():
+        SCAN_PASS = 0
+        SCAN_LOG = log_fail(SCAN_LOG, 'InstanceNumber', 'missing in %d files' % (numpy.isnan(instance).sum(),))
+    else:
+        steps = numpy.diff(instance)
+        if (steps == 0).any():
+            SCAN_PASS = 0
+            SCAN_LOG = log_fail(SCAN_LOG, 'InstanceNumber', '%d duplicates (first %d)' % \
+                ((steps == 0).sum(), instance[1:][steps == 0][0]))
+        if (steps > 1).any():
+            SCAN_PASS = 0
+            SCAN_LOG = log_fail(SCAN_LOG, 'InstanceNumber', '%d missing (first gap after %d)' % \
+                ((steps[steps > 1] - 1).sum(), instance[:-1][steps > 1][0]))
+
+    # Timing parameters must not change mid-series
+    for field in ['TR', 'TE']:
+        SCAN_PASS, SCAN_LOG = check_uniform(hdr_series[field][order], instance, field, TOL, SCAN_PASS, SCAN_LOG)
+
+    # Orientation must not change mid-series
+    bad = (numpy.abs(orient - orient[0]) > TOL_ORIENT).any(axis=1) | numpy.isnan(orient).any(axis=1)
+    if bad.any():
+        SCAN_PASS = 0
+        SCAN_LOG = log_fail(SCAN_LOG, 'ImageOrient', 'changes in %d files (first at instance %g)' % \
+            (bad.sum(), instance[bad][0]))
+        return SCAN_PASS, SCAN_LOG      # slice geometry below is meaningless
+
+    # Distance along the slice normal, SliceLocation if positions are not available
+    normal = numpy.cross(orient[0, 0:3], orient[0, 3:6])
+    if numpy.isnan(position).any():
+        slice_dist = hdr_series['SliceLocation'][order]
+    else:
+        slice_dist = position.dot(normal)
+    if numpy.isnan(slice_dist).any():
+        SCAN_PASS = 0
+        SCAN_LOG = log_fail(SCAN_LOG, 'ImagePosition', 'no slice position in %d files' % (numpy.isnan(slice_dist).sum(),))
+        return SCAN_PASS, SCAN_LOG
+
+    if is_mosaic:
+        # One volume per file, acquisitions increase and the slab does not move
+        if (numpy.diff(acquisition) <= 0).any():
+            SCAN_PASS = 0
+            SCAN_LOG = log_fail(SCAN_LOG, 'AcquisitionNumber', 'not increasing with InstanceNumber')
+        shift = numpy.abs(slice_dist - slice_dist[0])
+        if (shift > TOL_POSITION).any():
+            SCAN_PASS = 0
+            SCAN_LOG = log_fail(SCAN_LOG, 'ImagePosition', 'slab moves by up to %.2f mm' % (shift.max(),))
+        return SCAN_PASS, SCAN_LOG
+
+    # One slice per file, every acquisition must hold the same number of slices
+    if (numpy.diff(acquisition) < 0).any():
+        SCAN_PASS = 0
+        SCAN_LOG = log_fail(SCAN_LOG, 'AcquisitionNumber', 'decreases with InstanceNumber')
+    list_acq, slices_per_acq = numpy.unique(acquisition, return_counts=True)
+    if (slices_per_acq != slices_per_acq[0]).any():
+        SCAN_PASS = 0
+        SCAN_LOG = log_fail(SCAN_LOG, 'AcquisitionNumber', 'slices per volume vary %d-%d' % \
+            (slices_per_acq.min(), slices_per_acq.max()))
+        return SCAN_PASS, SCAN_LOG
+    if slices_per_acq[0] < 2:
+        return SCAN_PASS, SCAN_LOG
+
+    # Slice spacing regular within each volume, and the same for every volume
+    slice_dist = slice_dist[numpy.lexsort((slice_dist, acquisition))].reshape(len(list_acq), slices_per_acq[0])
+    spacing = numpy.diff(slice_dist, axis=1)
+    spacing_ref = numpy.median(spacing)
+    bad = numpy.abs(spacing - spacing_ref) > max(TOL * abs(spacing_ref), TOL_POSITION)
+    if bad.any():
+        SCAN_PASS = 0
+        SCAN_LOG = log_fail(SCAN_LOG, 'SliceSpace', 'irregular in %d of %d gaps (expected %.2f mm)' % \
+            (bad.sum(), spacing.size, spacing_ref))
+
+    return SCAN_PASS, SCAN_LOG
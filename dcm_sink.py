@@ -0,0 +1,191 @@
+#!/usr/bin/python
+
+# Structured QA result sinks for DCM_QA.py
+#   One record per QA'd scan - subject, series, scan type, every params_out value and
+#   each per-field verdict - written as JSON Lines, CSV or SQLite
+
+#    File Name:  dcm_sink.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - sync(), records on disk before a job journal entry (--journal)
+
+
+# NOTES
+#     1) Sink type comes from the file extension - .jsonl / .json, .csv, .db / .sqlite
+#     2) Records are buffered and written in batches. JSONL / CSV batches are appended with one
+#        write() under an exclusive flock, SQLite batches are one transaction, so several
+#        processes (ie. concurrent batch runs) can share an output file without interleaving
+#     3) --pixel metrics go to JSONL and SQLite (qa_field rows named PIXEL_*), the CSV columns are
+#        left as they are so existing CSV files can still be appended to
+#     4) Cohort summaries, ie.
+#           sqlite3 qa.db "SELECT field, COUNT(*) FROM qa_field WHERE pass=0 GROUP BY field"
+
+
+import os
+import csv
+import json
+import fcntl
+import sqlite3
+import datetime
+import cStringIO
+
+BUFFER_RECORDS = 256
+
+# params_out fields written as CSV columns, as in the scan_params.cfg header
+list_param_fields = ['TR', 'TE', 'TI', 'FA', 'ORIENT', 'FOV_X', 'FOV_Y', 'FOV_Z', \
+    'RES_X', 'RES_Y', 'RES_Z', 'SLICE_GAP', 'NUM_VOL']
+
+
+def flatten_record(record, run_time):
+# Checked scan record (see DCM_QA.check_scan_records) -> plain dict
+    if record['SCAN_PASS']:
+        result = 'PASS'
+    else:
+        result = 'FAIL'
+    return {'run_time': run_time,
+            'subject': os.path.basename(record['dir_subj']),
+            'subject_dir': record['dir_subj'],
+            'series': record['dir_scan'],
+            'scan_type': record['scan_type'],
+            'num_dcm': record['num_dcm'],
+            'result': result,
+            'params': record['params_out'],
+            'param_rule': record.get('param_rule', {}),
+            'param_PASS': record.get('param_PASS', {}),
+            'pixel': record.get('pixel_metrics', {}),
+            'fingerprint': record.get('fingerprint'),
+            'param_known': record.get('param_known', 0),
+            'log': [line.strip() for line in record['SCAN_LOG']]}
+
+
+class FileSink(object):
+# Append-only text sink, a batch goes out as one locked write
+
+    def __init__(self, fname_out):
+        self.fname_out = fname_out
+        self.list_buffer = []
+        self.fd = os.open(fname_out, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+    def write(self, flat_record):
+        self.list_buffer.append(flat_record)
+        if len(self.list_buffer) >= BUFFER_RECORDS:
+            self.flush()
+
+    def flush(self):
+        if len(self.list_buffer) == 0:
+            return
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            data = self.format_batch(self.list_buffer, os.fstat(self.fd).st_size == 0)
+            while data:
+                data = data[os.write(self.fd, data):]
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.list_buffer = []
+
+    def sync(self):
+        self.flush()
+        os.fsync(self.fd)
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+
+class JsonlSink(FileSink):
+
+    def format_batch(self, list_records, new_file):
+        return ''.join([json.dumps(flat_record, sort_keys=True, default=str) + '\n' for flat_record in list_records])
+
+
+class CsvSink(FileSink):
+
+    def format_batch(self, list_records, new_file):
+        buf = cStringIO.StringIO()
+        writer = csv.writer(buf)
+        if new_file:
+            writer.writerow(['run_time', 'subject', 'series', 'scan_type', 'num_dcm', 'result'] + \
+                list_param_fields + ['%s_PASS' % (param_field,) for param_field in list_param_fields] + ['log'])
+        for flat_record in list_records:
+            row = [flat_record['run_time'], flat_record['subject'], flat_record['series'], \
+                flat_record['scan_type'], flat_record['num_dcm'], flat_record['result']]
+            row = row + [flat_record['params'].get(param_field, '') for param_field in list_param_fields]
+            for param_field in list_param_fields:
+                if param_field in flat_record['param_PASS']:
+                    row.append(int(flat_record['param_PASS'][param_field]))
+                else:
+                    row.append('')
+            row.append(' | '.join(flat_record['log']))
+            writer.writerow(row)
+        return buf.getvalue()
+
+
+class SqliteSink(object):
+# One row per scan in qa_scan, one row per checked field in qa_field
+
+    def __init__(self, fname_out):
+        self.list_buffer = []
+        self.conn = sqlite3.connect(fname_out, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS qa_scan (scan_id INTEGER PRIMARY KEY, run_time TEXT, ' + \
+            'subject TEXT, subject_dir TEXT, series TEXT, scan_type TEXT, num_dcm INTEGER, result TEXT, log TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS qa_field (scan_id INTEGER, field TEXT, value, rule TEXT, pass INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS qa_scan_subject ON qa_scan (subject, series)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS qa_field_scan ON qa_field (scan_id)')
+        self.conn.commit()
+
+    def write(self, flat_record):
+        self.list_buffer.append(flat_record)
+        if len(self.list_buffer) >= BUFFER_RECORDS:
+            self.flush()
+
+    def flush(self):
+        if len(self.list_buffer) == 0:
+            return
+        with self.conn:
+            for flat_record in self.list_buffer:
+                cursor = self.conn.execute('INSERT INTO qa_scan (run_time, subject, subject_dir, series, scan_type, ' + \
+                    'num_dcm, result, log) VALUES (?,?,?,?,?,?,?,?)', (flat_record['run_time'], flat_record['subject'], \
+                    flat_record['subject_dir'], flat_record['series'], flat_record['scan_type'], flat_record['num_dcm'], \
+                    flat_record['result'], '\n'.join(flat_record['log'])))
+                list_rows = []
+                for param_field in sorted(flat_record['params']):
+                    value = flat_record['params'][param_field]
+                    if type(value) not in [int, float, str]:
+                        value = str(value)
+                    verdict = flat_record['param_PASS'].get(param_field)
+                    if verdict is not None:
+                        verdict = int(verdict)
+                    list_rows.append((cursor.lastrowid, param_field, value, \
+                        flat_record['param_rule'].get(param_field), verdict))
+                if flat_record['fingerprint'] is not None:
+                    list_rows.append((cursor.lastrowid, 'FINGERPRINT', flat_record['fingerprint'], None, \
+                        flat_record['param_known']))
+                for metric in sorted(flat_record['pixel']):
+                    list_rows.append((cursor.lastrowid, 'PIXEL_' + metric, flat_record['pixel'][metric], None, None))
+                self.conn.executemany('INSERT INTO qa_field (scan_id, field, value, rule, pass) VALUES (?,?,?,?,?)', list_rows)
+        self.list_buffer = []
+
+    def sync(self):
+    # commits are durable, synchronous is FULL by default
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def open_sink(fname_out):
+    ext = os.path.splitext(fname_out)[1].lower()
+    if ext in ['.jsonl', '.json']:
+        return JsonlSink(fname_out)
+    if ext == '.csv':
+        return CsvSink(fname_out)
+    if ext in ['.db', '.sqlite', '.sqlite3']:
+        return SqliteSink(fname_out)
+    raise SystemExit, 'ERROR - Unknown QA output type (use .jsonl, .csv or .db): %s' % (fname_out,)
+
+
+def get_run_time():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
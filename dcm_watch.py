@@ -0,0 +1,217 @@
+#!/usr/bin/python
+
+# Watch a study root for new series
+#   Used by DCM_QA.py --watch to QA each series shortly after it lands, instead of
+#   re-walking the whole tree
+
+#    File Name:  dcm_watch.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - Directories that vanish before they are watched are skipped
+
+
+# NOTES
+#     1) Layout is study_root/subject_dir/series_dir/files, ie. /data8/mrdata/MR160/MR160-088-0002-01/5-fMRI_Stop_Signal
+#     2) Uses inotify (through libc, Linux only) when available, otherwise polls with stat()
+#        - the poller only lists a directory when its mtime changes, and only sums file sizes
+#          for series that are still being written
+#     3) A series is reported once nothing has been added to / written in it for settle_sec seconds
+#        Series present when watching starts are not reported unless they change
+#     4) inotify watch limits (fs.inotify.max_user_watches) apply, one watch per directory
+#     5) A subject / series dir removed or renamed between its event and its watch (ie. the temp
+#        dir of a transfer tool) is skipped, its new name comes as an event of its own
+
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+MASK_DIR = IN_CREATE | IN_MOVED_TO
+MASK_SERIES = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_MODIFY
+
+
+def list_subdirs(dir_in):
+# Sub directories, [] if dir_in is gone, entries removed while listing are left out
+    try:
+        return ['%s/%s' % (dir_in, fname) for fname in sorted(os.listdir(dir_in)) \
+            if not fname.startswith('.') and os.path.isdir('%s/%s' % (dir_in, fname))]
+    except OSError:
+        return []
+
+
+class PollWatcher(object):
+# stat() based change detection
+
+    def __init__(self, dir_root):
+        self.dir_root = dir_root
+        self.lut_mtime = {}         # root / subject / series dir -> mtime
+        self.lut_subj_series = {}   # subject dir -> series dirs
+        self.lut_size = {}          # series dir -> (num files, total size), only while active
+        self.scan_tree(1)
+
+    def get_mtime(self, dir_in):
+        try:
+            return os.stat(dir_in).st_mtime
+        except OSError:
+            return None
+
+    def scan_tree(self, initial=0):
+    # Series dirs with new entries since the last scan
+        set_active = set()
+        mtime = self.get_mtime(self.dir_root)
+        if mtime != self.lut_mtime.get(self.dir_root):
+            self.lut_mtime[self.dir_root] = mtime
+            for dir_subj in list_subdirs(self.dir_root):
+                self.lut_subj_series.setdefault(dir_subj, [])
+
+        for dir_subj in self.lut_subj_series:
+            mtime = self.get_mtime(dir_subj)
+            if mtime != self.lut_mtime.get(dir_subj):
+                self.lut_mtime[dir_subj] = mtime
+                self.lut_subj_series[dir_subj] = list_subdirs(dir_subj)
+            for dir_series in self.lut_subj_series[dir_subj]:
+                mtime = self.get_mtime(dir_series)
+                if mtime != self.lut_mtime.get(dir_series):
+                    if dir_series in self.lut_mtime or not initial:
+                        set_active.add(dir_series)
+                    self.lut_mtime[dir_series] = mtime
+        return set_active
+
+    def get_size(self, dir_series):
+        num_files = 0
+        total_size = 0
+        try:
+            for fname in os.listdir(dir_series):
+                num_files = num_files + 1
+                total_size = total_size + os.path.getsize('%s/%s' % (dir_series, fname))
+        except OSError:
+            pass
+        return num_files, total_size
+
+    def poll(self, timeout, list_pending):
+    # Series dirs with activity, files growing in place are caught for pending series only
+        time.sleep(timeout)
+        set_active = self.scan_tree()
+        for dir_series in list_pending:
+            size_series = self.get_size(dir_series)
+            if size_series != self.lut_size.get(dir_series):
+                self.lut_size[dir_series] = size_series
+                set_active.add(dir_series)
+        for dir_series in self.lut_size.keys():
+            if dir_series not in list_pending and dir_series not in set_active:
+                del self.lut_size[dir_series]
+        return set_active
+
+
+class InotifyWatcher(object):
+# inotify based change detection, one watch per root / subject / series directory
+
+    def __init__(self, dir_root):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.dir_root = dir_root
+        self.lut_wd = {}            # watch descriptor -> (dir, depth)
+        self.add_watch(dir_root, 0)
+        for dir_subj in list_subdirs(dir_root):
+            if self.add_watch(dir_subj, 1):
+                for dir_series in list_subdirs(dir_subj):
+                    self.add_watch(dir_series, 2)
+
+    def add_watch(self, dir_in, depth):
+    # 0 if a subject / series dir is already gone (removed or renamed)
+        if depth == 2:
+            mask = MASK_SERIES
+        else:
+            mask = MASK_DIR
+        wd = self.libc.inotify_add_watch(self.fd, dir_in, mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if depth > 0 and err in (errno.ENOENT, errno.ENOTDIR):
+                return 0
+            raise OSError(err, 'inotify_add_watch failed: %s' % (dir_in,))
+        self.lut_wd[wd] = (dir_in, depth)
+        return 1
+
+    def new_dir(self, dir_in, depth, set_active):
+    # Watch a new subject / series dir, anything created before the watch counts as activity
+        if not self.add_watch(dir_in, depth):
+            return
+        if depth == 1:
+            for dir_series in list_subdirs(dir_in):
+                self.new_dir(dir_series, 2, set_active)
+        else:
+            set_active.add(dir_in)
+
+    def poll(self, timeout, list_pending):
+        set_active = set()
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return set_active
+            raise
+        if not ready:
+            return set_active
+
+        buf = os.read(self.fd, 65536)
+        pos = 0
+        while pos + 16 <= len(buf):
+            wd, mask, cookie, len_name = struct.unpack('iIII', buf[pos:pos+16])
+            fname = buf[pos+16:pos+16+len_name].rstrip('\0')
+            pos = pos + 16 + len_name
+            if mask & IN_Q_OVERFLOW:
+                # events lost, treat every series as active
+                for wd_curr in self.lut_wd:
+                    if self.lut_wd[wd_curr][1] == 2:
+                        set_active.add(self.lut_wd[wd_curr][0])
+                continue
+            if wd not in self.lut_wd:
+                continue
+            if mask & IN_IGNORED:
+                del self.lut_wd[wd]
+                continue
+            dir_in, depth = self.lut_wd[wd]
+            if depth < 2 and (mask & IN_ISDIR):
+                self.new_dir('%s/%s' % (dir_in, fname), depth + 1, set_active)
+            elif depth == 2:
+                set_active.add(dir_in)
+        return set_active
+
+
+def get_watcher(dir_root, use_inotify=1):
+    if use_inotify:
+        try:
+            return InotifyWatcher(dir_root)
+        except (OSError, AttributeError):
+            pass        # no inotify (not Linux, or no libc symbol), poll instead
+    return PollWatcher(dir_root)
+
+
+def watch_series(dir_root, settle_sec=60, poll_sec=5, use_inotify=1):
+# Generator of series dirs that have stopped growing
+    watcher = get_watcher(dir_root.rstrip('/'), use_inotify)
+    lut_pending = {}        # series dir -> time of last activity
+    while True:
+        for dir_series in watcher.poll(poll_sec, lut_pending.keys()):
+            lut_pending[dir_series] = time.time()
+        time_now = time.time()
+        for dir_series in sorted(lut_pending):
+            if time_now - lut_pending[dir_series] >= settle_sec:
+                del lut_pending[dir_series]
+                if os.path.isdir(dir_series):
+                    yield dir_series
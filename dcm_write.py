@@ -0,0 +1,560 @@
+#!/usr/bin/python
+
+# In-process DICOM header rewriter
+#   Applies a set of header changes to a file in one read-modify-write pass, in place of one
+#   dcmodify call (and one .bak file) per tag. Used by fix_dcm.py and fix_dcm_brainCODE.py,
+#   which read each source file once and write the modified copy straight to the output tree
+
+#    File Name:  dcm_write.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - Kernel side copy of the pixel data tail
+#       C - 2026-10-18 - check_dcm, header only test of an existing output
+#       D - 2026-10-18 - Output / pixel data hashes computed while writing (DcmHasher)
+#       E - 2026-10-18 - write_dcm, rewrite of a file the caller already has mapped
+#       F - 2026-10-18 - Tags inside sequences are rewritten too, missing tags are no longer added
+#       G - 2026-10-18 - sync_writes, outputs fsync'd before they are renamed into place (--journal)
+
+
+# NOTES
+#     1) The file is walked element by element (dcm_read.DcmFile.iter_elements), and into the items
+#        of every sequence (SQ, or UN holding items). Unchanged elements, sequences and pixel data
+#        are copied as byte ranges, only the modified elements are encoded, so their lengths (and
+#        padding to an even length) always match the new values
+#     2) New values are given as text, as dcmodify -ma takes them. Numeric binary VRs (US/UL/FD..)
+#        are packed, multiple values separated by backslash. As -ma, every element of a tag is
+#        changed, nested ones included, and tags not in the file are not added
+#     3) Group length elements (gggg,0000) of modified groups are recomputed, including the file
+#        meta group (0002,0000) when a meta tag is changed. The lengths of sequences and items
+#        holding a modified element are recomputed, undefined length ones keep their delimiters
+#     4) Anything that can't be written (binary VR, value too long, sequence that doesn't parse)
+#        raises DcmWriteError / DcmReadError, and nothing is written
+#     5) Output goes to a temporary file in the output directory that is renamed over the output
+#        name, so fname_in == fname_out is safe (the input stays mapped while it is read) and a
+#        crash never leaves a half written file
+#     6) Unchanged ranges of at least ZERO_COPY_MIN bytes (the pixel data tail) are copied file to
+#        file by the kernel, os.copy_file_range / os.sendfile where python has them, otherwise the
+#        same libc calls through ctypes. Where neither works (ie. a file system without
+#        copy_file_range and sendfile to regular files) the range is written from the mapped
+#        input in COPY_BLOCK slices, through buffer() views. Pixel bytes never become strings
+#     7) check_dcm plans the same changes over a file, it is up to date when nothing would be
+#        re-encoded differently (fix_dcm_brainCODE.py --incremental). Only the element headers are
+#        read, pixel data is skipped by length
+#     8) With a hash algorithm (--manifest), the output is hashed from what is written - the new
+#        header bytes and buffer() views of the mapped input ranges - and the pixel data section
+#        (value of 7FE0,0010) on its own, which is identical in the source. The output is never
+#        read back
+#     9) write_dcm writes from a DcmFile the caller already has open (qa_fix_brainCODE.py, where the
+#        same mapping has just been read by the QA checks), the caller closes it
+#    10) With sync_writes set (--journal), each output is fsync'd before it is renamed into place.
+#        The caller syncs the output directories (sync_dirs) before journalling them, so a journal
+#        entry never outlives its files after a power loss. Set before the worker pool is forked
+
+
+import os
+import errno
+import mmap
+import hashlib
+import struct
+import ctypes
+import ctypes.util
+import dcm_read
+
+ZERO_COPY_MIN = 65536               # unchanged ranges at least this long are copied by the kernel
+COPY_BLOCK = 64 * 1024 * 1024       # bytes per copy call
+
+sync_writes = 0                     # fsync outputs before the rename (--journal)
+
+
+class DcmWriteError(Exception):
+    pass
+
+
+def encode_value(vr, text, endian, tag_int):
+# Value bytes of an element from the text form of its value, padded to an even length
+    if vr == 'UN' and tag_int in dcm_read.lut_int_vr:
+        vr = dcm_read.lut_int_vr[tag_int]
+    if vr in dcm_read.lut_numeric_fmt:
+        fmt = dcm_read.lut_numeric_fmt[vr]
+        if len(text.strip(' ')) == 0:
+            return ''
+        try:
+            if vr in ['FL', 'FD']:
+                values = [float(value) for value in text.split('\\')]
+            else:
+                values = [int(value) for value in text.split('\\')]
+            return struct.pack(endian + fmt * len(values), *values)
+        except (ValueError, struct.error), e:
+            raise DcmWriteError('Bad %s value for %s : %s' % (vr, dcm_read.int_to_tag(tag_int), text))
+    if vr in dcm_read.list_binary_vr:
+        raise DcmWriteError('Cannot set %s value of %s' % (vr, dcm_read.int_to_tag(tag_int)))
+    if len(text) % 2:
+        if vr == 'UI':
+            text = text + '\x00'
+        else:
+            text = text + ' '
+    return text
+
+
+def encode_header(tag_int, vr, length, endian, explicit_vr):
+# Header bytes of an element (or item) with a value of length bytes
+    struct_tag, struct_short, struct_long = dcm_read.lut_structs[endian]
+    group = tag_int >> 16
+    element = tag_int & 0xffff
+    if not explicit_vr or group == 0xfffe:
+        return struct_tag.pack(group, element, length)
+    if vr in dcm_read.list_long_vr:
+        return struct.pack(endian + 'HH', group, element) + vr + '\x00\x00' + struct_long.pack(length)
+    if length > 0xffff:
+        raise DcmWriteError('Value too long for %s' % (dcm_read.int_to_tag(tag_int),))
+    return struct.pack(endian + 'HH', group, element) + vr + struct_short.pack(length)
+
+
+def encode_element(tag_int, vr, raw, endian, explicit_vr):
+# Header + value bytes of one element
+    return encode_header(tag_int, vr, len(raw), endian, explicit_vr) + raw
+
+
+def keep_same(dcm_file, chunk, pos_start, pos_end):
+# The input range instead of newly encoded bytes when they are the same, so a file that already
+#   holds every change plans as one unchanged range (check_dcm)
+    if dcm_file.buf[pos_start:pos_end] == chunk:
+        return (pos_start, pos_end)
+    return chunk
+
+
+def rewrite_elements(dcm_file, pos, pos_stop, endian, explicit_vr, lut_new):
+# [(tag, chunk)] covering pos..pos_stop with lut_new {tag: text} applied
+#   Every element of a tag in lut_new is rewritten, at this level and in the items of sequences,
+#   as dcmodify -ma did. Tags that are not in the file are not added
+#   A chunk is either encoded bytes or a (start, end) range of the input file
+    list_elements = []
+    for tag_int, vr, pos_start, pos_value, length, pos_end in \
+            dcm_file.iter_elements(pos, pos_stop, endian, explicit_vr):
+        if tag_int in lut_new:
+            raw = encode_value(vr, lut_new[tag_int], endian, tag_int)
+            list_elements.append((tag_int, keep_same(dcm_file, encode_element(tag_int, vr, raw, endian, explicit_vr), \
+                pos_start, pos_end)))
+        else:
+            list_seq = rewrite_sequence(dcm_file, tag_int, vr, pos_start, pos_value, length, pos_end, \
+                endian, explicit_vr, lut_new)
+            if list_seq is None:
+                list_elements.append((tag_int, (pos_start, pos_end)))
+            else:
+                list_elements.extend([(tag_int, chunk) for chunk in list_seq])
+        pos = pos_end
+    if pos < pos_stop:
+        # trailing bytes too short to be an element, kept as they were
+        list_elements.append((None, (pos, pos_stop)))
+    update_group_lengths(dcm_file, list_elements, endian, explicit_vr)
+    return list_elements
+
+
+def rewrite_sequence(dcm_file, tag_int, vr, pos_start, pos_value, length, pos_end, endian, explicit_vr, lut_new):
+# Chunks of a sequence element with the elements of lut_new in its items rewritten, None if none
+#   of them change (or the element is not a sequence)
+    if tag_int == dcm_read.TAG_PIXEL_DATA:
+        return None
+    if vr == 'SQ':
+        endian_items, explicit_items = endian, explicit_vr
+    elif vr == 'UN' and dcm_file.buf[pos_value:pos_value+4] == struct.pack('<HH', 0xfffe, 0xe000):
+        # sequence without a known VR (UN, or an implicit VR tag not in lut_dcm_vr), its items
+        # are implicit VR little endian
+        endian_items, explicit_items = '<', False
+    else:
+        return None
+    try:
+        list_chunks = rewrite_items(dcm_file, pos_value, length, pos_end, endian_items, explicit_items, lut_new)
+    except (dcm_read.DcmReadError, struct.error):
+        if vr == 'SQ':
+            raise
+        return None     # UN value that only looked like a sequence, copied as it is
+    if not [chunk for chunk in list_chunks if type(chunk) is not tuple]:
+        return None
+    if length == dcm_read.UNDEFINED_LENGTH:
+        chunk_header = (pos_start, pos_value)
+    else:
+        chunk_header = keep_same(dcm_file, encode_header(tag_int, vr, sum([chunk_size(chunk) for chunk in list_chunks]), \
+            endian, explicit_vr), pos_start, pos_value)
+    return [chunk_header] + list_chunks
+
+
+def rewrite_items(dcm_file, pos, length, pos_end, endian, explicit_vr, lut_new):
+# Chunks of the items of a sequence value, item lengths recomputed, delimiters kept
+    struct_tag = dcm_read.lut_structs[endian][0]
+    if length == dcm_read.UNDEFINED_LENGTH:
+        pos_stop = pos_end - 8          # sequence delimitation item
+    else:
+        pos_stop = pos_end
+    list_chunks = []
+    while pos < pos_stop:
+        if pos + 8 > pos_stop:
+            raise dcm_read.DcmReadError('Truncated item')
+        group, element, length_item = struct_tag.unpack_from(dcm_file.buf, pos)
+        if ((group << 16) | element) != dcm_read.TAG_ITEM:
+            raise dcm_read.DcmReadError('Expected an item, found %s' % (dcm_read.int_to_tag((group << 16) | element),))
+        if length_item == dcm_read.UNDEFINED_LENGTH:
+            pos_next = dcm_file._skip(pos + 8, length_item, explicit_vr)
+            pos_item_end = pos_next - 8     # item delimitation item
+        else:
+            pos_next = pos_item_end = pos + 8 + length_item
+        if pos_next > pos_stop:
+            raise dcm_read.DcmReadError('Item runs past its sequence')
+        list_item = [chunk for tag_int, chunk in rewrite_elements(dcm_file, pos + 8, pos_item_end, endian, explicit_vr, lut_new)]
+        if length_item == dcm_read.UNDEFINED_LENGTH:
+            list_chunks.extend([(pos, pos + 8)] + list_item + [(pos_item_end, pos_next)])
+        else:
+            list_chunks.append(keep_same(dcm_file, encode_header(dcm_read.TAG_ITEM, None, \
+                sum([chunk_size(chunk) for chunk in list_item]), endian, explicit_vr), pos, pos + 8))
+            list_chunks.extend(list_item)
+        pos = pos_next
+    if pos_stop < pos_end:
+        list_chunks.append((pos_stop, pos_end))
+    return list_chunks
+
+
+def chunk_size(chunk):
+    if type(chunk) is tuple:
+        return chunk[1] - chunk[0]
+    return len(chunk)
+
+
+def update_group_lengths(dcm_file, list_elements, endian, explicit_vr):
+# Re-encode the (gggg,0000) elements of groups that had elements changed
+    set_groups = set([tag_int >> 16 for tag_int, chunk in list_elements \
+        if tag_int is not None and type(chunk) is not tuple])
+    lut_group_index = {}
+    lut_group_size = {}
+    for count_element in range(len(list_elements)):
+        tag_int, chunk = list_elements[count_element]
+        if tag_int is None or (tag_int >> 16) not in set_groups:
+            continue
+        group = tag_int >> 16
+        if (tag_int & 0xffff) == 0:
+            lut_group_index[group] = count_element
+            lut_group_size[group] = 0
+        elif group in lut_group_size:
+            lut_group_size[group] = lut_group_size[group] + chunk_size(chunk)
+    for group in lut_group_index:
+        raw = struct.pack(endian + 'I', lut_group_size[group])
+        chunk = encode_element(group << 16, 'UL', raw, endian, explicit_vr)
+        chunk_old = list_elements[lut_group_index[group]][1]
+        if type(chunk_old) is tuple:
+            chunk = keep_same(dcm_file, chunk, chunk_old[0], chunk_old[1])
+        list_elements[lut_group_index[group]] = (group << 16, chunk)
+
+
+def coalesce(list_chunks):
+# Merge adjacent input ranges, so unchanged stretches of the file are copied in one write
+    list_out = []
+    for chunk in list_chunks:
+        if type(chunk) is tuple and list_out and type(list_out[-1]) is tuple and list_out[-1][1] == chunk[0]:
+            list_out[-1] = (list_out[-1][0], chunk[1])
+        elif chunk_size(chunk) > 0:
+            list_out.append(chunk)
+    return list_out
+
+
+def get_changes(lut_dcm_hdrs):
+# {'gggg,eeee': text} -> {tag: text}
+    lut_new = {}
+    for dcm_tag in lut_dcm_hdrs:
+        try:
+            tag_int = dcm_read.tag_to_int(dcm_tag.strip(' ()'))
+        except ValueError:
+            raise DcmWriteError('Bad tag : %s' % (dcm_tag,))
+        lut_new[tag_int] = lut_dcm_hdrs[dcm_tag].strip('\n')
+    return lut_new
+
+
+def plan_dcm(dcm_file, lut_new):
+# Output of a rewrite as a list of chunks
+    lut_meta = dict([(tag_int, lut_new[tag_int]) for tag_int in lut_new if (tag_int >> 16) == 0x0002])
+    lut_data = dict([(tag_int, lut_new[tag_int]) for tag_int in lut_new if (tag_int >> 16) != 0x0002])
+    if lut_meta and dcm_file.pos_dataset == 0:
+        raise DcmWriteError('No file meta information to modify')
+    if lut_meta:
+        list_chunks = [(0, 132)] + [chunk for tag_int, chunk in \
+            rewrite_elements(dcm_file, 132, dcm_file.pos_dataset, '<', True, lut_meta)]
+    else:
+        list_chunks = [(0, dcm_file.pos_dataset)]
+    list_chunks.extend([chunk for tag_int, chunk in \
+        rewrite_elements(dcm_file, dcm_file.pos_dataset, dcm_file.size, dcm_file.endian, dcm_file.explicit_vr, lut_data)])
+    return coalesce(list_chunks)
+
+
+def load_libc():
+    try:
+        return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (OSError, TypeError):
+        return None
+
+libc = load_libc()
+
+
+def libc_copy_file_range(fd_in, fd_out, offset, count):
+    offset_in = ctypes.c_longlong(offset)
+    sent = libc.copy_file_range(fd_in, ctypes.byref(offset_in), fd_out, None, ctypes.c_size_t(count), 0)
+    if sent < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return sent
+
+
+def libc_sendfile(fd_in, fd_out, offset, count):
+    offset_in = ctypes.c_longlong(offset)
+    sent = libc.sendfile(fd_out, fd_in, ctypes.byref(offset_in), ctypes.c_size_t(count))
+    if sent < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return sent
+
+
+def get_copy_funcs():
+# Kernel side copies available here, best first, as func(fd_in, fd_out, offset, count) -> bytes copied
+#   All of them copy from offset of fd_in to the current position of fd_out
+    list_copy_funcs = []
+    if hasattr(os, 'copy_file_range'):
+        list_copy_funcs.append(lambda fd_in, fd_out, offset, count: os.copy_file_range(fd_in, fd_out, count, offset))
+    elif libc is not None and hasattr(libc, 'copy_file_range'):
+        libc.copy_file_range.restype = ctypes.c_ssize_t
+        list_copy_funcs.append(libc_copy_file_range)
+    if hasattr(os, 'sendfile'):
+        list_copy_funcs.append(lambda fd_in, fd_out, offset, count: os.sendfile(fd_out, fd_in, offset, count))
+    elif libc is not None and hasattr(libc, 'sendfile'):
+        libc.sendfile.restype = ctypes.c_ssize_t
+        list_copy_funcs.append(libc_sendfile)
+    return list_copy_funcs
+
+list_copy_funcs = get_copy_funcs()
+
+# errors meaning a copy call does not work for these files, rather than an I/O error
+set_unsupported = set([errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF])
+
+
+def write_all(fd_out, data):
+    while len(data) > 0:
+        data = data[os.write(fd_out, data):]
+
+
+def copy_range(buf, fname_in, fd_in, fd_out, offset, count):
+# Copy count bytes at offset of the input (fd_in, mapped as buf) to the current position of fd_out
+    while count > 0:
+        if list_copy_funcs:
+            try:
+                sent = list_copy_funcs[0](fd_in, fd_out, offset, min(count, COPY_BLOCK))
+            except OSError, e:
+                if e.errno not in set_unsupported:
+                    raise
+                # not for these files, fall back to the next method for the rest of the run
+                list_copy_funcs.pop(0)
+                continue
+        else:
+            sent = os.write(fd_out, buffer(buf, offset, min(count, COPY_BLOCK)))
+        if sent == 0:
+            raise DcmWriteError('%s : input ended early' % (fname_in,))
+        offset = offset + sent
+        count = count - sent
+
+
+class DcmHasher(object):
+# Hash of a file as it is written, and of its pixel data section (an input range) on its own
+
+    def __init__(self, algorithm, pixel_range):
+        self.hash_file = hashlib.new(algorithm)
+        self.hash_pixel = hashlib.new(algorithm)
+        self.pixel_range = pixel_range
+        self.size = 0
+
+    def update(self, buf, chunk):
+        if type(chunk) is not tuple:
+            self.hash_file.update(chunk)
+            self.size = self.size + len(chunk)
+            return
+        self.hash_file.update(buffer(buf, chunk[0], chunk[1] - chunk[0]))
+        self.size = self.size + chunk[1] - chunk[0]
+        if self.pixel_range is not None:
+            pos_start = max(chunk[0], self.pixel_range[0])
+            pos_end = min(chunk[1], self.pixel_range[1])
+            if pos_start < pos_end:
+                self.hash_pixel.update(buffer(buf, pos_start, pos_end - pos_start))
+
+    def result(self):
+    # {'size', 'file', 'pixel'}, pixel is '' for files without pixel data
+        lut_hashes = {'size': self.size, 'file': self.hash_file.hexdigest(), 'pixel': ''}
+        if self.pixel_range is not None:
+            lut_hashes['pixel'] = self.hash_pixel.hexdigest()
+        return lut_hashes
+
+
+def get_pixel_range(dcm_file):
+# (start, end) of the Pixel Data value in the file, None if there is none
+    dcm_file.index_to(dcm_read.TAG_PIXEL_DATA)
+    if dcm_file.pixel_offset is None:
+        return None
+    for tag_int, vr, pos_start, pos_value, length, pos_end in \
+            dcm_file.iter_elements(dcm_file.pixel_offset, dcm_file.size, dcm_file.endian, dcm_file.explicit_vr):
+        return pos_value, pos_end
+    return None
+
+
+def hash_file(fname, algorithm):
+# Hashes of a file already on disk (ie. written by dcmodify), as DcmHasher.result
+    pixel_range = None
+    try:
+        dcm_file = dcm_read.DcmFile(fname)
+        try:
+            pixel_range = get_pixel_range(dcm_file)
+        finally:
+            dcm_file.close()
+    except (dcm_read.DcmReadError, struct.error, ValueError, TypeError):
+        pass        # not DICOM, whole file hash only
+    f = open(fname, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        hasher = DcmHasher(algorithm, pixel_range)
+        if size > 0:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                hasher.update(buf, (0, size))
+            finally:
+                buf.close()
+    finally:
+        f.close()
+    return hasher.result()
+
+
+def get_tmp_name(fname_out):
+# Temporary name next to fname_out (same file system, so the rename is atomic)
+    return '%s.tmp%d' % (fname_out, os.getpid())
+
+
+def stream_chunks(buf, fname_in, fd_in, list_chunks, fd_out, hasher=None):
+# Write list_chunks at the current position of fd_out
+#   Header chunks are gathered into one write, large unchanged ranges are copied by the kernel
+    list_pending = []
+    for chunk in list_chunks:
+        if hasher is not None:
+            hasher.update(buf, chunk)
+        if type(chunk) is not tuple:
+            list_pending.append(chunk)
+        elif chunk[1] - chunk[0] < ZERO_COPY_MIN:
+            list_pending.append(buf[chunk[0]:chunk[1]])
+        else:
+            write_all(fd_out, ''.join(list_pending))
+            list_pending = []
+            copy_range(buf, fname_in, fd_in, fd_out, chunk[0], chunk[1] - chunk[0])
+    write_all(fd_out, ''.join(list_pending))
+
+
+def write_chunks(dcm_file, list_chunks, fname_out, hasher=None):
+# Write to a temporary file next to fname_out, then rename it into place
+    fname_tmp = get_tmp_name(fname_out)
+    fd_in = os.open(dcm_file.full_name_dcm, os.O_RDONLY)
+    try:
+        fd_out = os.open(fname_tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+    except:
+        os.close(fd_in)
+        raise
+    try:
+        stream_chunks(dcm_file.buf, dcm_file.full_name_dcm, fd_in, list_chunks, fd_out, hasher)
+        if sync_writes:
+            os.fsync(fd_out)
+        os.close(fd_out)
+        fd_out = None
+        os.rename(fname_tmp, fname_out)
+    except:
+        if fd_out is not None:
+            os.close(fd_out)
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+        raise
+    finally:
+        os.close(fd_in)
+
+
+def sync_file(fname):
+# fsync a file written by someone else (ie. dcmodify)
+    fd = os.open(fname, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_dirs(dir_base, dir_out_rel):
+# fsync an output directory and its parents up to dir_base, so their entries (renamed files,
+#   new directories) are on disk
+    list_parts = dir_out_rel.strip('/').split('/')
+    for count_part in range(len(list_parts), -1, -1):
+        sync_file('/'.join([dir_base] + list_parts[:count_part]))
+
+
+def open_plan(fname_in, lut_dcm_hdrs):
+# (DcmFile, chunks) of fname_in with the changes {'gggg,eeee': text} applied, the caller closes the DcmFile
+    lut_new = get_changes(lut_dcm_hdrs)
+    try:
+        dcm_file = dcm_read.DcmFile(fname_in)
+    except (struct.error, ValueError), e:
+        raise dcm_read.DcmReadError('%s : %s' % (fname_in, e))
+    try:
+        return dcm_file, plan_dcm(dcm_file, lut_new)
+    except (struct.error, ValueError, TypeError), e:
+        dcm_file.close()
+        raise dcm_read.DcmReadError('%s : %s' % (fname_in, e))
+    except:
+        dcm_file.close()
+        raise
+
+
+def get_hasher(dcm_file, algorithm):
+    if not algorithm:
+        return None
+    try:
+        return DcmHasher(algorithm, get_pixel_range(dcm_file))
+    except (struct.error, ValueError, TypeError), e:
+        raise dcm_read.DcmReadError('%s : %s' % (dcm_file.full_name_dcm, e))
+
+
+def modify_dcm(fname_in, fname_out, lut_dcm_hdrs, algorithm=None):
+# Write fname_in to fname_out with the changes {'gggg,eeee': text} applied
+#   Returns the hashes of the output (DcmHasher.result) if a hash algorithm is given
+    dcm_file, list_chunks = open_plan(fname_in, lut_dcm_hdrs)
+    try:
+        hasher = get_hasher(dcm_file, algorithm)
+        write_chunks(dcm_file, list_chunks, fname_out, hasher)
+    finally:
+        dcm_file.close()
+    if hasher is not None:
+        return hasher.result()
+    return None
+
+
+def write_dcm(dcm_file, fname_out, lut_dcm_hdrs, algorithm=None):
+# Write an open DcmFile to fname_out with the changes {'gggg,eeee': text} applied, as modify_dcm
+    try:
+        list_chunks = plan_dcm(dcm_file, get_changes(lut_dcm_hdrs))
+    except (struct.error, ValueError, TypeError), e:
+        raise dcm_read.DcmReadError('%s : %s' % (dcm_file.full_name_dcm, e))
+    hasher = get_hasher(dcm_file, algorithm)
+    write_chunks(dcm_file, list_chunks, fname_out, hasher)
+    if hasher is not None:
+        return hasher.result()
+    return None
+
+
+def check_dcm(fname_dcm, lut_dcm_hdrs):
+# True if fname_dcm already holds every change {'gggg,eeee': text}, encoded as modify_dcm would
+#   ie. its rewrite plan is the whole file unchanged
+    lut_new = get_changes(lut_dcm_hdrs)
+    try:
+        dcm_file = dcm_read.DcmFile(fname_dcm)
+    except (dcm_read.DcmReadError, struct.error, ValueError, EnvironmentError):
+        return False
+    try:
+        return plan_dcm(dcm_file, lut_new) == [(0, dcm_file.size)]
+    except (dcm_read.DcmReadError, DcmWriteError, struct.error, ValueError, TypeError):
+        return False
+    finally:
+        dcm_file.close()
@@ -5,7 +5,13 @@
 #           A - Single field - Command line call changes one field only
 #           B - Multi-field - Pass a file containing a list of all headers to change and their new values
 
-# Based on calls to dcmmodify
+# Headers are rewritten in-process (dcm_write), one pass per file for all fields, dcmodify
+# is only called for files the rewriter can't handle (dcm_fix, shared with fix_dcm_brainCODE.py)
+# Each source file is read once and its modified copy written straight to the output directory
+# (temporary file + rename), an interrupted run never leaves half modified files behind
+# Files are spread over -j worker processes, messages and errors are reported in file order
+# --manifest <algorithm> hashes each output file (and its pixel data section) while it is written,
+# into a per series manifest (dcm_manifest)
 
 #    File Name:  fix_dcm.py
 #
@@ -17,33 +23,31 @@
 
 #       A - 2013-07-04 - WL - Original Creation, loose class and function definitions
 #       B - 2015-03-19 - WL - GitHub'd
+#       C - 2026-10-18 - In-process batched header rewrite (dcm_write) instead of dcmodify per tag
+#       D - 2026-10-18 - Stream copy and modify, no more cp -rf followed by in-place edits
+#       E - 2026-10-18 - Process pool over the file rewrites (-j)
+#       F - 2026-10-18 - Checksum manifest computed during the rewrite (--manifest)
+#       G - 2026-10-18 - dcmodify fallback failures are errors, nothing is renamed into place
+#       H - 2026-10-18 - Verbose dcmodify lines returned with the file's messages (-j order)
+#       I - 2026-10-18 - Rewrite, dcmodify fallback and worker pool moved to dcm_fix, one dcmodify
+#                        call per file, the fields are listed once (-v) rather than per file
 
 from optparse import OptionParser, Option, OptionValueError
 import datetime
 import string
 import glob
 import os, shlex, subprocess
+import shutil
 import numpy
+import dcm_profile
+import dcm_fix
+import dcm_manifest
 
 program_name = 'fix_dcm.py'
 
 #*************************************************************************************
 # FUNCTIONS
 
-# General utility function to call system commands
-def run_cmd(sys_cmd, debug, verbose):
-# one line call to output system command and control debug state
-    if verbose:
-        print sys_cmd
-    if not debug:
-        p = subprocess.Popen(sys_cmd, stdout = subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        output, errors = p.communicate()
-        if verbose:
-            print output, errors
-        return output, errors
-    else:
-        return '','' 
-
 def load_dcm_list(fname_dcm_list, lut_dcm_hdrs):
 #   Loads list of dicom headers to change, and their new value
     if not os.path.exists(fname_dcm_list):
@@ -53,7 +57,7 @@ def load_dcm_list(fname_dcm_list, lut_dcm_hdrs):
     for line_dcm in file_dcm_list:
         lut_dcm_hdrs[line_dcm.split(':')[0].strip(' ')] = line_dcm.split(':')[1].strip(' ')
     return lut_dcm_hdrs
-    
+
 #**********************************************************************
     
 def main():
@@ -67,8 +71,18 @@ def main():
                         default=0, help="Verbose output")
     parser.add_option("-d","--debug", action="store_true", dest="debug",
                         default=0, help="Run in debug mode")
+    parser.add_option("-j","--num_proc", type="int", dest="num_proc",
+                        default=1, help="Number of worker processes [default = 1]")
+    parser.add_option("--manifest", type="choice", dest="manifest", choices=[''] + dcm_manifest.list_algorithms,
+                        default="", help="Hash the output files while writing them, into %s of the output series (%s)" % \
+                        (dcm_manifest.FNAME_MANIFEST, '|'.join(dcm_manifest.list_algorithms)))
+    parser.add_option("--profile", action="store_true", dest="profile",
+                        default=0, help="Time each rewrite / external command (per program), summary printed to stderr at exit")
+    parser.add_option("--profile_out", type="string", dest="fname_profile",
+                        default="", help="Also write the timings to a .json or .csv file (implies --profile)")
 
     options, args = parser.parse_args()
+    dcm_profile.setup(options.profile, options.fname_profile)
 
     lut_dcm_hdrs = {}
     if len(args) == 3:
@@ -79,35 +93,36 @@ def main():
         lut_dcm_hdrs[dcm_hdr] = dcm_new_value
     else:
         parser.error("incorrect number of arguments")
+    if options.verbose:
+        print 'fields : %s' % (', '.join(['(%s)=%s' % (dcm_hdr, lut_dcm_hdrs[dcm_hdr].strip('\n')) \
+            for dcm_hdr in sorted(lut_dcm_hdrs)]),)
 
     # Check for base output directory, create if needed
     if not os.path.exists(dir_dcm_out):
-        run_cmd('mkdir ' + dir_dcm_out, options.debug, options.verbose)
+        dcm_fix.run_cmd('mkdir ' + dir_dcm_out, options.debug, options.verbose)
 
     dir_series_name = dir_dcm_in.split('/')[-1]
+    dir_series_out = '%s/%s' % (dir_dcm_out, dir_series_name)
     # Check for specific output directory, exit if not clobber
-    if  os.path.exists( '%s/%s' % (dir_dcm_out, dir_series_name)) and not options.clobber:
+    if  os.path.exists(dir_series_out) and not options.clobber:
         raise SystemExit, '* ERROR - Output directory already exists, turn on CLOBBER to overwrite: %s/%s' % \
             ((dir_dcm_out, dir_series_name)) 
-    else:
-        cmd_duplicate = ('cp -rf %s %s/') % \
-            (dir_dcm_in, dir_dcm_out)
-        
-        
-    run_cmd(cmd_duplicate, options.debug, options.verbose)
+    if not os.path.exists(dir_series_out):
+        dcm_fix.run_cmd('mkdir ' + dir_series_out, options.debug, options.verbose)
     
-    list_dcm_files = os.listdir(dir_dcm_in)
-
-    for fname_scan in list_dcm_files:
-        # print fname_scan
-        for curr_dcm_hdr_index in lut_dcm_hdrs:
-            curr_dcm_hdr_value = lut_dcm_hdrs[curr_dcm_hdr_index].strip('\n')
-            cmd_dcmodify = 'dcmodify -ma "(%s)"=%s %s/%s/%s' % \
-                (curr_dcm_hdr_index, curr_dcm_hdr_value, dir_dcm_out, dir_series_name, fname_scan)
-            run_cmd(cmd_dcmodify, options.debug, options.verbose)
-            
-            cmd_rmbak = 'rm -f %s/%s/%s.bak' % (dir_dcm_out, dir_series_name, fname_scan)
-            run_cmd(cmd_rmbak, options.debug, options.verbose)
+    list_dcm_files = sorted([fname_scan for fname_scan in os.listdir(dir_dcm_in) \
+        if os.path.isfile('%s/%s' % (dir_dcm_in, fname_scan))])
+
+    list_tasks = [('%s/%s' % (dir_dcm_in, fname_scan), '%s/%s' % (dir_series_out, fname_scan), \
+        lut_dcm_hdrs, options.debug, options.verbose, options.manifest) for fname_scan in list_dcm_files]
+    list_errors, list_hashes = dcm_fix.run_fix_tasks(list_tasks, options.num_proc)
+    if options.manifest and not options.debug:
+        dcm_manifest.write_manifest(dir_series_out, [dcm_manifest.get_row(list_dcm_files[count_task], options.manifest, \
+            list_hashes[count_task]) for count_task in range(len(list_tasks)) if list_hashes[count_task] is not None])
+    elif not options.debug:
+        dcm_manifest.remove_manifest(dir_series_out)
+    if list_errors:
+        raise SystemExit, '* ERROR - %d of %d files could not be written' % (len(list_errors), len(list_tasks))
             
 if __name__ == '__main__' :
     main()
@@ -1,11 +1,31 @@
 #!/usr/bin/python
 
 # Based on an input text file, modifies all dicoms in a given directory 
+# Inputs are series directories or whole session directories (any number of either), config
+# files are loaded once and every series of every session goes through one worker pool
 # Two usage modes
 #           A - Single field - Command line call changes one field only
 #           B - Multi-field - Pass a file containing a list of all headers to change and their new values
 
-# Based on calls to dcmmodify
+# Headers are rewritten in-process (dcm_write), one read of each source file and one atomic
+# write (temporary file + rename) of its modified copy, dcmodify is only called for files the
+# rewriter can't handle (dcm_fix, shared with fix_dcm.py)
+# Files are spread over -j worker processes, messages and errors are reported in file order
+# --incremental only rewrites outputs that are missing or stale - an output is up to date when
+# its source has the size / mtime it was written from and a header read shows every target value
+# already in place. The sizes / mtimes are kept next to the output tree, not in it - one state
+# file per output series, dir_out_base/.fix_state/<subjectID>/<sessionName>/<series>.json, so the
+# series directories only hold what is uploaded. The .fix_state.json an earlier version left in
+# a series directory is read once and removed
+# --archive tar|zip streams the rewritten files into one archive per session instead
+# (dir_out_base/sessionName.tar), members are named as in the output tree, -j writes that many
+# session archives at a time
+# --journal fix_journal.jsonl records each series once its files, state and manifest are all
+# written, after a crash the same command with --resume only redoes the series not in the journal
+# (see dcm_journal.py)
+# --manifest <algorithm> hashes each output file (and its pixel data section) while it is written,
+# into a manifest per output series (dcm_manifest), also as a member of an archive
+# without it, the manifest an earlier run left in a series directory with rewritten files is removed
 
 #    File Name:  fix_dcm_brainCODE.py
 #
@@ -20,8 +40,24 @@
 #       C - 2015-07-22 - WL - Fork of sorts customized for brainCODE
 #                       Takes default cfg file to wipe those dicoms
 #                       Figures stuff out based on what directories it's given
+#       D - 2026-10-18 - Stream copy and modify (dcm_write), no more cp -r followed by dcmodify
+#       E - 2026-10-18 - Process pool over the file rewrites (-j), output directories made up front
+#       F - 2026-10-18 - Incremental mode (--incremental)
+#       G - 2026-10-18 - Session upload archives (--archive)
+#       H - 2026-10-18 - Checksum manifest computed during the rewrite (--manifest)
+#       I - 2026-10-18 - Whole sessions / many sessions per call
+#       J - 2026-10-18 - Job journal, resumable runs (--journal, --resume), state / manifest
+#                        files written as each series finishes
+#       K - 2026-10-18 - dcmodify fallback failures are errors, nothing is renamed into place
+#       L - 2026-10-18 - Verbose dcmodify lines returned with the file's messages (-j order)
+#       M - 2026-10-18 - Archive members only fall back to dcmodify before they are started
+#       N - 2026-10-18 - With --journal, outputs / state / manifest fsync'd before the entry
+#       O - 2026-10-18 - Rewrite, dcmodify fallback and worker pool moved to dcm_fix
+#       P - 2026-10-18 - Incremental state kept under dir_out_base/.fix_state, out of the series directories
 #
-# for dir in /data8/mrdata/MR160/MR160-088-0002-01/*; do ./fix_dcm_brainCODE.py ${dir} ../data;   done
+# ./fix_dcm_brainCODE.py -j 8 /data8/mrdata/MR160/MR160-088-0002-01 ../data
+# ./fix_dcm_brainCODE.py -j 8 /data8/mrdata/MR160/MR160-*-* ../data
+# ./fix_dcm_brainCODE.py /data8/mrdata/MR160/MR160-088-0002-01/9-DTI_20dir ../data     (one series)
 
 
 
@@ -31,27 +67,29 @@ import datetime
 import string
 import glob
 import os, shlex, subprocess
+import shutil
+import re
+import json
 import numpy
+import dcm_scan_type
+import dcm_profile
+import dcm_read
+import dcm_write
+import dcm_fix
+import dcm_archive
+import dcm_manifest
+import dcm_journal
 
 program_name = 'fix_dcm_brainCODE.py'
 
+FIX_STATE_DIR = '.fix_state'        # under dir_out_base, <dir_out_rel>.json per output series, {file: [source size, source mtime]}
+FIX_STATE_OLD = '.fix_state.json'   # where earlier versions kept it, in the output series directory
+
+re_tmp = re.compile(r'\.tmp\d*$')     # temporary files (dcm_write.get_tmp_name, state / manifest files)
+
 #*************************************************************************************
 # FUNCTIONS
 
-# General utility function to call system commands
-def run_cmd(sys_cmd, debug, verbose):
-# one line call to output system command and control debug state
-    if verbose:
-        print sys_cmd
-    if not debug:
-        p = subprocess.Popen(sys_cmd, stdout = subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        output, errors = p.communicate()
-        if verbose:
-            print output, errors
-        return output, errors
-    else:
-        return '','' 
-
 def load_dcm_list(fname_dcm_list):
     lut_dcm_hdrs={}
 #   Loads list of dicom headers to change, and their new value
@@ -73,32 +111,292 @@ def load_lut_scan_type(fname_lut_scan_type):
     for line_file in file_lut_scan_type:
         lut_scan_type[line_file.split(':')[0].strip(' ')] = line_file.split(':')[1].strip(' \n')
     return lut_scan_type
-      
 
-def check_scan_type(dir_curr_scan_clean, scan_type):
-# Function to check if current scan needs to be prepped
-    list_ignore = ['_ADC','_TRACEW','_FA','_ColFA']   # processed DTI scans to ignore
+def parse_session_dir(dir_session):
+#   subjectID and sessionName from the session directory name
+#   ie. /data8/mrdata/MR160/MR160-088-0002-01 -> PND03_HSC_0002, PND03_HSC_0002_01_SE01_MR
+    subjectID_raw = os.path.abspath(dir_session).split('/')[-1]
+    if len(subjectID_raw.split('-')) != 4:
+        raise SystemExit, 'ERROR - Cannot parse subject ID from session directory: %s' % (dir_session,)
+    [Study, Site, Subj, Visit] = subjectID_raw.split('-')
+    
+    if Site=='088':
+        SiteCode = 'HSC'
+    else:
+        SiteCode = 'HBK'
+    
+    subjectID = 'PND03_%s_%s' % (SiteCode,Subj)
+    sessionName = '%s_%s_SE01_MR' % (subjectID, Visit)
+    return subjectID, sessionName
+
+def list_input_series(list_dir_input):
+#   (session directory, series directory name) of every series to fix, in argument order
+#   An input with sub directories is a whole session, its sub directories are its series
+    list_series = []
+    for dir_input in list_dir_input:
+        dir_input = dir_input.rstrip('/')
+        if not os.path.isdir(dir_input):
+            raise SystemExit, 'ERROR - Input directory not found: %s' % (dir_input,)
+        list_dir_scan = sorted([dir_scan for dir_scan in os.listdir(dir_input) \
+            if os.path.isdir('%s/%s' % (dir_input, dir_scan))])
+        if len(list_dir_scan) > 0:
+            list_series = list_series + [(dir_input, dir_scan) for dir_scan in list_dir_scan]
+        else:
+            list_series.append((os.path.dirname(dir_input) or '.', os.path.basename(dir_input)))
+    return list_series
 
-    QA_THIS_SCAN = 1
-    list_scan_type = scan_type.split(',')
-    # make sure all keywords present in directory name
-    for scan_keywords in list_scan_type:
-        if dir_curr_scan_clean.find(scan_keywords)<0:
-            QA_THIS_SCAN = 0
-            
-    # make sure all ignore words are absent in directory name
-    for ignore_keywords in list_ignore:
-        if dir_curr_scan_clean.find(ignore_keywords)>-1:
-            QA_THIS_SCAN = 0
-            
-    return QA_THIS_SCAN
+def make_dirs(list_dirs, debug, verbose):
+#   Output directory skeleton, made in one go before any file is written
+    for dir_out in sorted(set(list_dirs)):
+        if not os.path.exists(dir_out):
+            if verbose:
+                print 'mkdir ' + dir_out
+            if not debug:
+                os.makedirs(dir_out)
+
+def get_src_key(full_name_in):
+    st = os.stat(full_name_in)
+    return [st.st_size, st.st_mtime]
+
+def get_state_name(dir_out_base, dir_out_rel):
+    return '%s/%s/%s.json' % (dir_out_base, FIX_STATE_DIR, dir_out_rel)
+
+def load_fix_state(dir_out_base, dir_out_rel):
+#   {file: [size, mtime]} of the sources the files of an output directory were written from
+    fname_state = get_state_name(dir_out_base, dir_out_rel)
+    if not os.path.exists(fname_state):
+        fname_state = '%s/%s/%s' % (dir_out_base, dir_out_rel, FIX_STATE_OLD)
+    if not os.path.exists(fname_state):
+        return {}
+    try:
+        return json.load(open(fname_state, 'r'))
+    except ValueError:
+        return {}       # damaged state, every file gets rewritten
 
+def save_fix_state(dir_out_base, dir_out_rel, lut_state, sync=0):
+#   With sync (--journal) the state file and its directories are on disk when this returns
+    fname_state = get_state_name(dir_out_base, dir_out_rel)
+    if not os.path.isdir(os.path.dirname(fname_state)):
+        os.makedirs(os.path.dirname(fname_state))
+    file_state = open(fname_state + '.tmp', 'w')
+    json.dump(lut_state, file_state, indent=0, sort_keys=True)
+    if sync:
+        file_state.flush()
+        os.fsync(file_state.fileno())
+    file_state.close()
+    os.rename(fname_state + '.tmp', fname_state)
+    fname_state_old = '%s/%s/%s' % (dir_out_base, dir_out_rel, FIX_STATE_OLD)
+    if os.path.exists(fname_state_old):
+        os.remove(fname_state_old)
+    if sync:
+        dcm_write.sync_dirs(dir_out_base, os.path.dirname(fname_state[len(dir_out_base)+1:]))
+
+def remove_tmp_files(dir_out_full, debug, verbose):
+#   Temporary files a crashed run left in an output directory that is being redone (--resume)
+    if not os.path.isdir(dir_out_full):
+        return
+    for fname_out in os.listdir(dir_out_full):
+        if re_tmp.search(fname_out):
+            if verbose:
+                print 'rm %s/%s' % (dir_out_full, fname_out)
+            if not debug:
+                os.remove('%s/%s' % (dir_out_full, fname_out))
+
+def fix_dcm_worker(task):
+#   One file, errors are handed back rather than raised so every file gets reported
+#   src_key_prev is the source [size, mtime] the existing output was written from (--incremental)
+#   row_prev its manifest row, an up to date output keeps its hashes if they are of the same algorithm
+    full_name_in, full_name_out, lut_dcm_series, debug, verbose, src_key_prev, algorithm, row_prev = task
+    src_key = None
+    skipped = 0
+    lut_hashes = None
+    try:
+        src_key = get_src_key(full_name_in)
+        with dcm_profile.timer('check'):
+            skipped = src_key_prev is not None and src_key_prev == src_key and os.path.exists(full_name_out) and \
+                (not algorithm or (row_prev is not None and row_prev['algorithm'] == algorithm)) and \
+                dcm_write.check_dcm(full_name_out, lut_dcm_series)
+        if skipped:
+            list_msgs = []
+            if verbose:
+                list_msgs.append('up to date %s' % (full_name_out,))
+            if algorithm:
+                lut_hashes = {'size': row_prev['size'], 'file': row_prev['file_hash'], 'pixel': row_prev['pixel_hash']}
+        else:
+            list_msgs, lut_hashes = dcm_fix.fix_dcm_file(full_name_in, full_name_out, lut_dcm_series, debug, verbose, algorithm)
+        error = None
+    except Exception, e:
+        list_msgs = []
+        src_key = None
+        lut_hashes = None
+        error = '%s : %s' % (full_name_in, e)
+    return list_msgs, error, src_key, skipped, lut_hashes, dcm_profile.drain()    # stage timings travel back with the result
+
+def finish_series(series, list_tasks, list_src_keys, list_skipped, list_hashes, dir_out_base, options, journal):
+#   Once every file of a series is done - state and manifest of its output directories, then
+#   its journal entry if none of its files failed
+#   Without --manifest, the old manifest of a directory with rewritten files is removed
+    dir_session, dir_target, task_start, task_end = series
+    if options.debug:
+        return
+    lut_states = {}
+    lut_rows = {}
+    set_rewritten = set()
+    failed = 0
+    for count_task in range(task_start, task_end):
+        dir_out_full, fname_scan = list_tasks[count_task][1].rsplit('/', 1)
+        if dir_out_full not in lut_states:
+            lut_states[dir_out_full] = load_fix_state(dir_out_base, dir_out_full[len(dir_out_base)+1:])
+            lut_rows[dir_out_full] = []
+        if not list_skipped[count_task]:
+            set_rewritten.add(dir_out_full)
+        # Sources the outputs were written from, for the next --incremental run
+        if list_src_keys[count_task] is None:
+            lut_states[dir_out_full].pop(fname_scan, None)
+            failed = 1
+        else:
+            lut_states[dir_out_full][fname_scan] = list_src_keys[count_task]
+        if list_hashes[count_task] is not None:
+            lut_rows[dir_out_full].append(dcm_manifest.get_row(fname_scan, options.manifest, list_hashes[count_task]))
+    for dir_out_full in lut_states:
+        save_fix_state(dir_out_base, dir_out_full[len(dir_out_base)+1:], lut_states[dir_out_full], journal is not None)
+        if options.manifest:
+            dcm_manifest.write_manifest(dir_out_full, lut_rows[dir_out_full], journal is not None)
+        elif dir_out_full in set_rewritten:
+            dcm_manifest.remove_manifest(dir_out_full)
+    if journal is not None and not failed:
+        # files were fsync'd as they were written, their directory entries go to disk before the entry
+        for dir_out_full in lut_states:
+            dcm_write.sync_dirs(dir_out_base, dir_out_full[len(dir_out_base)+1:])
+        lut_outputs = dict([(dir_out_full[len(dir_out_base)+1:], dcm_journal.get_checksum(options.manifest, \
+            lut_rows[dir_out_full])) for dir_out_full in lut_rows])
+        journal.write([journal.make_entry(dir_session, dir_target, dcm_journal.STAGE_FIX, 'written', \
+            lut_outputs, options.manifest)])
+
+def run_fix_tasks(list_tasks, list_series, dir_out_base, options, journal=None):
+#   Rewrite all files over -j worker processes, each series (session dir, series dir, first task, end task)
+#   is finished (finish_series) as soon as its last file is done
+#   Returns the errors and the skip count
+    list_errors = []
+    list_src_keys = []
+    list_skipped = []
+    list_hashes = []
+    num_skipped = 0
+    count_series = 0
+    for list_msgs, error, src_key, skipped, lut_hashes in dcm_fix.imap_tasks(fix_dcm_worker, list_tasks, \
+            options.num_proc, dcm_fix.FIX_CHUNK):
+        dcm_fix.report(list_msgs, error, list_errors)
+        list_src_keys.append(src_key)
+        list_skipped.append(skipped)
+        list_hashes.append(lut_hashes)
+        num_skipped = num_skipped + skipped
+        while count_series < len(list_series) and list_series[count_series][3] <= len(list_src_keys):
+            finish_series(list_series[count_series], list_tasks, list_src_keys, list_skipped, list_hashes, dir_out_base, \
+                options, journal)
+            count_series = count_series + 1
+    return list_errors, num_skipped
+
+def fix_dcm_archive(archive, full_name_in, arcname, lut_dcm_series, debug, verbose, algorithm=''):
+#   Read full_name_in once and write it into the session archive with all header changes applied
+#   Returns the messages and the hashes of the member, as dcm_fix.fix_dcm_file
+    list_msgs = []
+    lut_hashes = None
+    if verbose:
+        list_msgs.append('rewrite %s -> %s' % (full_name_in, arcname))
+    if debug:
+        return list_msgs, lut_hashes
+    try:
+        with dcm_profile.timer('rewrite'):
+            dcm_file, list_chunks = dcm_write.open_plan(full_name_in, lut_dcm_series)
+    except (dcm_read.DcmReadError, dcm_write.DcmWriteError), e:
+        # nothing is written yet, the file goes in through dcmodify
+        if verbose:
+            list_msgs.append('* WARNING - %s, falling back to dcmodify' % (e,))
+        fname_tmp = dcm_write.get_tmp_name(archive.fname_archive)
+        dcm_fix.fix_dcm_dcmodify(full_name_in, fname_tmp, lut_dcm_series, debug, verbose, list_msgs)
+        try:
+            if algorithm:
+                lut_hashes = dcm_write.hash_file(fname_tmp, algorithm)
+            archive.add_file(arcname, fname_tmp)
+        finally:
+            os.remove(fname_tmp)
+        return list_msgs, lut_hashes
+    # errors once the member is started are raised, a second member after a torn one would
+    # leave the archive unreadable
+    try:
+        with dcm_profile.timer('rewrite'):
+            hasher = dcm_write.get_hasher(dcm_file, algorithm)
+            archive.add_plan(arcname, dcm_file, list_chunks, hasher)
+    finally:
+        dcm_file.close()
+    if hasher is not None:
+        lut_hashes = hasher.result()
+    return list_msgs, lut_hashes
 
+def run_archive_tasks(archive, list_tasks, dir_out_base, list_msgs):
+#   Rewrite all files into the session archive, one after the other (one sequential write)
+#   A failure stops the archive, members after a partly written one would be unreadable
+#   The manifest of each series goes in after its files
+    lut_rows = {}
+    list_dirs = []
+    for full_name_in, full_name_out, lut_dcm_series, debug, verbose, src_key_prev, algorithm, row_prev in list_tasks:
+        arcname = full_name_out[len(dir_out_base)+1:]
+        try:
+            list_msgs_file, lut_hashes = fix_dcm_archive(archive, full_name_in, arcname, lut_dcm_series, debug, verbose, algorithm)
+        except Exception, e:
+            raise dcm_write.DcmWriteError('%s : %s' % (full_name_in, e))
+        list_msgs.extend(list_msgs_file)
+        if lut_hashes is not None:
+            dir_out_rel, fname_scan = arcname.rsplit('/', 1)
+            if dir_out_rel not in lut_rows:
+                lut_rows[dir_out_rel] = []
+                list_dirs.append(dir_out_rel)
+            lut_rows[dir_out_rel].append(dcm_manifest.get_row(fname_scan, algorithm, lut_hashes))
+    for dir_out_rel in list_dirs:
+        archive.add_string('%s/%s' % (dir_out_rel, dcm_manifest.FNAME_MANIFEST), dcm_manifest.format_manifest(lut_rows[dir_out_rel]))
+
+def fix_archive_worker(task):
+#   One session archive, written start to end by one process
+#   Series already in the archive are refused before anything is written
+    fname_archive, list_tasks, dir_out_base, debug = task
+    list_msgs = []
+    archive = None
+    try:
+        if not debug:
+            archive = dcm_archive.DcmArchive(fname_archive)
+            list_dir_dup = sorted(set([dir_out_rel for dir_out_rel in \
+                [task_file[1][len(dir_out_base)+1:].rsplit('/', 1)[0] for task_file in list_tasks] \
+                if archive.has_dir(dir_out_rel)]))
+            if len(list_dir_dup) > 0:
+                archive.abort()
+                return list_msgs, 'Series already in archive, remove the archive to redo it: %s %s' % \
+                    (fname_archive, ' '.join(list_dir_dup)), dcm_profile.drain()
+    except Exception, e:
+        return list_msgs, '%s : %s' % (fname_archive, e), dcm_profile.drain()
+    try:
+        try:
+            run_archive_tasks(archive, list_tasks, dir_out_base, list_msgs)
+        finally:
+            if archive is not None:
+                archive.close()
+        error = None
+    except Exception, e:
+        error = '%s, archive left incomplete, remove it before running again: %s' % (e, fname_archive)
+    return list_msgs, error, dcm_profile.drain()
+
+def run_archive_sessions(list_archive_tasks, num_proc):
+#   Write the session archives over num_proc worker processes, returns the errors in session order
+    list_errors = []
+    for list_msgs, error in dcm_fix.imap_tasks(fix_archive_worker, list_archive_tasks, num_proc):
+        dcm_fix.report(list_msgs, error, list_errors)
+    return list_errors
       
+
 #**********************************************************************
     
 def main():
-    usage = "Usage: "+program_name+" <options> dir_input dir_out_base \n" + \
+    usage = "Usage: "+program_name+" <options> dir_input [dir_input ...] dir_out_base \n" + \
+            "   dir_input is a series directory or a session directory (all of its series)\n" + \
             "   or  "+program_name+" --help";
     parser = OptionParser(usage)
     parser.add_option("--lut_ST", type="string", dest="fname_lut_scan_type",
@@ -111,86 +409,140 @@ def main():
                         default=0, help="Verbose output")
     parser.add_option("-d","--debug", action="store_true", dest="debug",
                         default=0, help="Run in debug mode")
+    parser.add_option("--incremental", action="store_true", dest="incremental",
+                        default=0, help="Only rewrite missing / stale files of existing output directories")
+    parser.add_option("--archive", type="choice", dest="archive", choices=['', 'tar', 'zip'],
+                        default="", help="Write each session into dir_out_base/sessionName.tar or .zip instead of an output tree (tar|zip), files are written one after the other")
+    parser.add_option("--manifest", type="choice", dest="manifest", choices=[''] + dcm_manifest.list_algorithms,
+                        default="", help="Hash the output files while writing them, into %s of each output series (%s)" % \
+                        (dcm_manifest.FNAME_MANIFEST, '|'.join(dcm_manifest.list_algorithms)))
+    parser.add_option("--journal", type="string", dest="fname_journal",
+                        default="", help="Append each finished series to this job journal (.jsonl), implies --manifest %s [default = off]" % \
+                        (dcm_journal.JOURNAL_ALGORITHM,))
+    parser.add_option("--resume", action="store_true", dest="resume",
+                        default=0, help="Skip series already in --journal and redo the rest, ie. after a crashed run")
+    parser.add_option("-j","--num_proc", type="int", dest="num_proc",
+                        default=1, help="Number of worker processes, session archives written at a time with --archive [default = 1]")
+    parser.add_option("--profile", action="store_true", dest="profile",
+                        default=0, help="Time each rewrite / external command (per program), summary printed to stderr at exit")
+    parser.add_option("--profile_out", type="string", dest="fname_profile",
+                        default="", help="Also write the timings to a .json or .csv file (implies --profile)")
 
     options, args = parser.parse_args()
+    dcm_profile.setup(options.profile, options.fname_profile)
 
 
-    if len(args) == 2:
-        dir_input, dir_out_base = args
+    if len(args) >= 2:
+        list_dir_input, dir_out_base = args[:-1], args[-1]
     else:
         parser.error("incorrect number of arguments")
+    if options.archive and options.incremental:
+        parser.error("--incremental works on output trees only, not with --archive")
+    if options.archive and options.fname_journal:
+        parser.error("--journal works on output trees only, not with --archive")
+    if options.resume and not options.fname_journal:
+        parser.error("--resume needs --journal")
+    journal = None
+    if options.fname_journal:
+        journal = dcm_journal.DcmJournal(options.fname_journal)
+        if not options.manifest:
+            options.manifest = dcm_journal.JOURNAL_ALGORITHM      # output checksums of the journal entries
+        dcm_write.sync_writes = 1       # journalled outputs are on disk, set before the pool forks
     
+    # Configs are loaded and the classifier built once for every series of every session
     lut_dcm_hdrs = load_dcm_list(options.fname_dcm_list)
     lut_scan_type = load_lut_scan_type(options.fname_lut_scan_type)    
+    scan_classifier = dcm_scan_type.build_classifier(sorted(lut_scan_type))
+    lut_sessions = {}
     
-    
-    dir_target = dir_input.split('/')[-1]
-    dir_target_clean = dir_target.replace('-','_')   # remove variability of - or _
-
-    dir_target_series_num = dir_target_clean.split('_')[0]
-
-    # pull subjectID from directory structure
-    subjectID_raw = dir_input.split('/')[-2]
-    [Study, Site, Subj, Visit] = subjectID_raw.split('-')
-    
-    if Site=='088':
-        SiteCode = 'HSC'
-    else:
-        SiteCode = 'HBK'
-    
-    subjectID = 'PND03_%s_%s' % (SiteCode,Subj)
-    sessionSuffix = '%s_SE01_MR' % (Visit,)
-    
-#    print lut_scan_type
-    # Check if dir_target is one that requires modifications    
-    for scan_type in lut_scan_type:
-        QA_THIS_SCAN = check_scan_type(dir_target_clean, scan_type) 
-#        print QA_THIS_SCAN
-        if QA_THIS_SCAN:
+    # Output directories are all made first, then the files are rewritten in one go
+    list_dirs_out = [dir_out_base]
+    list_tasks = []
+    list_series = []
+    num_resumed = 0
+    lut_archive_tasks = {}
+    list_archives = []
+    for dir_session, dir_target in list_input_series(list_dir_input):
+        dir_target_clean = dcm_scan_type.clean_name(dir_target)   # remove variability of - or _
+        dir_target_series_num = dir_target_clean.split('_')[0]
+        
+        # pull subjectID from directory structure
+        if dir_session not in lut_sessions:
+            lut_sessions[dir_session] = parse_session_dir(dir_session)
+        subjectID, new_sessionName = lut_sessions[dir_session]
+        dir_input = '%s/%s' % (dir_session, dir_target)
+        if options.resume and journal.is_done(dir_session, dir_target, dcm_journal.STAGE_FIX):
+            num_resumed = num_resumed + 1
+            continue
+        task_start = len(list_tasks)
+        
+        # Check if dir_target is one that requires modifications    
+        for scan_type in dcm_scan_type.classify_scan(scan_classifier, dir_target):
             new_scanType = lut_scan_type[scan_type]
             new_subjectID = subjectID
-            new_sessionName = '%s_%s' % (subjectID,sessionSuffix)
-#            print dir_target, new_subjectID, new_sessionName, new_scanType
             
             # need to include series name to differentiate repeats of same ScanType
-            # Check for output directories, create if needed
-            if not os.path.exists(dir_out_base):
-                run_cmd('mkdir ' + dir_out_base, options.debug, options.verbose)
-            if not os.path.exists(dir_out_base + '/' + subjectID):
-                run_cmd('mkdir ' + dir_out_base + '/' + subjectID, options.debug, options.verbose)
-            if not os.path.exists(dir_out_base + '/' + subjectID + '/' + new_sessionName):
-                run_cmd('mkdir ' + dir_out_base + '/' + subjectID + '/' + new_sessionName, options.debug, options.verbose)
+            dir_out_rel = '%s/%s/%s-%s' % (subjectID,new_sessionName, dir_target_series_num, new_scanType)
+            dir_out_full = '%s/%s' % (dir_out_base, dir_out_rel)
             
-            dir_out_full = '%s/%s/%s/%s-%s' % (dir_out_base,subjectID,new_sessionName, dir_target_series_num, new_scanType)
-        
-            # Check for specific output directory, exit if not clobber
-            if  os.path.exists( '%s' % (dir_out_full, )) and not options.clobber:
-                raise SystemExit, '* ERROR - Output directory already exists, turn on CLOBBER to overwrite: %s' % \
-                    ((dir_out_full,)) 
+            if options.archive:
+                # nothing but the session archive is written
+                fname_archive = '%s/%s.%s' % (dir_out_base, new_sessionName, options.archive)
+                if fname_archive not in lut_archive_tasks:
+                    lut_archive_tasks[fname_archive] = []
+                    list_archives.append(fname_archive)
+                list_series_tasks = lut_archive_tasks[fname_archive]
             else:
-                cmd_duplicate = ('cp -r %s %s/') % \
-                    (dir_input, dir_out_full)
-                
-                
-            run_cmd(cmd_duplicate, options.debug, options.verbose)
+                # Check for specific output directory, exit if not clobber
+                if  os.path.exists( '%s' % (dir_out_full, )) and not options.clobber and not options.incremental and \
+                        not options.resume:
+                    raise SystemExit, '* ERROR - Output directory already exists, turn on CLOBBER to overwrite: %s' % \
+                        ((dir_out_full,)) 
+                if options.resume:
+                    remove_tmp_files(dir_out_full, options.debug, options.verbose)
+                    remove_tmp_files(os.path.dirname(get_state_name(dir_out_base, dir_out_rel)), options.debug, options.verbose)
+                list_dirs_out.append(dir_out_full)
+                list_series_tasks = list_tasks
             
-            list_dcm_files = os.listdir(dir_input)
-
-            for fname_scan in list_dcm_files:
-                # print fname_scan
-                dcmodify_string = '-ma "(0010,0010)"=%s -ma "(0010,0020)"=%s -ma "(0008,103e)"=%s' % \
-                    (new_subjectID, new_sessionName, new_scanType)
-                for curr_dcm_hdr_index in lut_dcm_hdrs:
-                    curr_dcm_hdr_value = lut_dcm_hdrs[curr_dcm_hdr_index].strip('\n')
-                    dcmodify_string = '%s -ma "(%s)"=%s' % \
-                        (dcmodify_string, curr_dcm_hdr_index, curr_dcm_hdr_value)
-                cmd_dcmodify = 'dcmodify %s %s/%s' % \
-                    (dcmodify_string, dir_out_full, fname_scan)
-                run_cmd(cmd_dcmodify, options.debug, options.verbose)
-                
-                cmd_rmbak = 'rm -f %s/%s.bak' % (dir_out_full, fname_scan)
-                run_cmd(cmd_rmbak, options.debug, options.verbose)
+            # entries of the common list win over the per series fields, as they did on the dcmodify command line
+            lut_dcm_series = {'0010,0010': new_subjectID, '0010,0020': new_sessionName, '0008,103e': new_scanType}
+            lut_dcm_series.update(lut_dcm_hdrs)
+            
+            list_dcm_files = sorted([fname_scan for fname_scan in os.listdir(dir_input) \
+                if os.path.isfile('%s/%s' % (dir_input, fname_scan))])
+            lut_state = {}
+            lut_manifest = {}
+            if options.incremental:
+                lut_state = load_fix_state(dir_out_base, dir_out_rel)
+                lut_manifest = dcm_manifest.load_manifest(dir_out_full)
             
+            for fname_scan in list_dcm_files:
+                list_series_tasks.append(('%s/%s' % (dir_input, fname_scan), '%s/%s' % (dir_out_full, fname_scan), \
+                    lut_dcm_series, options.debug, options.verbose, lut_state.get(fname_scan), \
+                    options.manifest, lut_manifest.get(fname_scan)))
+        if not options.archive and len(list_tasks) > task_start:
+            list_series.append((dir_session, dir_target, task_start, len(list_tasks)))
+    
+    make_dirs(list_dirs_out, options.debug, options.verbose)
+    
+    if options.archive:
+        list_errors = run_archive_sessions([(fname_archive, lut_archive_tasks[fname_archive], dir_out_base, options.debug) \
+            for fname_archive in list_archives], options.num_proc)
+        if list_errors:
+            raise SystemExit, '* ERROR - %d of %d session archives could not be written' % (len(list_errors), len(list_archives))
+        return
+    
+    if options.resume:
+        print 'Resumed : %d series already in %s' % (num_resumed, options.fname_journal)
+    list_errors, num_skipped = run_fix_tasks(list_tasks, list_series, dir_out_base, options, journal)
+    if journal is not None:
+        journal.close()
+    if options.incremental:
+        print 'Up to date : %d of %d files' % (num_skipped, len(list_tasks))
+    
+    if list_errors:
+        raise SystemExit, '* ERROR - %d of %d files could not be written' % (len(list_errors), len(list_tasks))
+        
 if __name__ == '__main__' :
     main()
 
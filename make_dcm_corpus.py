@@ -0,0 +1,257 @@
+#!/usr/bin/python
+
+# Generates a synthetic DICOM corpus matching the protocols in scan_params.cfg
+#   No scanner or network needed, used by bench_dcm.py
+#       T1_SAG_MPRAGE     - single-frame, 192 sagittal slices
+#       fMRI Stop_Signal  - Siemens MOSAIC, 30 slices per file (0019,100a), 448 volumes
+#       DTI 20dir         - single-frame multi-volume, 70 slices x 23 volumes
+#   All series pass DCM_QA.py with the default scan_params.cfg
+
+#    File Name:  make_dcm_corpus.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+
+
+# NOTES
+#     1) Layout is corpus_dir/MR160/MR160-088-NNNN-01/<series_num>-<series_name>/IM-NNNN.dcm
+#     2) --scale reduces the number of fMRI / DTI volumes for quick runs, NUM_VOL checks then FAIL
+#     3) Pixel data is a noisy ellipsoid phantom with a little drift, so pixel-level QA has signal
+#        and background to work with
+
+
+from optparse import OptionParser, Option, OptionValueError
+import os
+import struct
+import numpy
+
+program_name = 'make_dcm_corpus.py'
+
+TS_EXPLICIT_LE = '1.2.840.10008.1.2.1'
+SOP_CLASS_MR = '1.2.840.10008.5.1.4.1.1.4'
+UID_ROOT = '1.2.826.0.1.3680043.9.7133'
+
+# Explicit VRs with 2 reserved bytes and a 4 byte length
+list_long_vr = set(['OB', 'OD', 'OF', 'OL', 'OV', 'OW', 'SQ', 'SV', 'UC', 'UN', 'UR', 'UT', 'UV'])
+
+#*************************************************************************************
+# PROTOCOLS
+
+lut_protocols = {
+    'T1_SAG_MPRAGE': {'series_num': 2, 'mosaic': 0, 'num_vol': 1, 'num_slices': 192,
+        'rows': 256, 'cols': 240, 'acq_matrix': [0, 240, 256, 0], 'pixel_spacing': [1.0, 1.0], 'slice_thick': 1.0,
+        'orient': [0, 1, 0, 0, 0, -1], 'TR': '2300', 'TE': '2.96', 'TI': '900', 'FA': '9',
+        'image_type': 'ORIGINAL\\PRIMARY\\M\\ND\\NORM'},
+    'fMRI_Stop_Signal': {'series_num': 5, 'mosaic': 1, 'num_vol': 448, 'num_slices': 30,
+        'rows': 64, 'cols': 64, 'acq_matrix': [64, 0, 0, 64], 'pixel_spacing': [3.0, 3.0], 'slice_thick': 5.0,
+        'orient': [1, 0, 0, 0, 1, 0], 'TR': '2000', 'TE': '30', 'TI': None, 'FA': '70',
+        'image_type': 'ORIGINAL\\PRIMARY\\M\\ND\\MOSAIC'},
+    'DTI_20dir': {'series_num': 9, 'mosaic': 0, 'num_vol': 23, 'num_slices': 70,
+        'rows': 122, 'cols': 122, 'acq_matrix': [122, 0, 0, 122], 'pixel_spacing': [2.0, 2.0], 'slice_thick': 2.0,
+        'orient': [1, 0, 0, 0, 1, 0], 'TR': '8800', 'TE': '87', 'TI': None, 'FA': '90',
+        'image_type': 'ORIGINAL\\PRIMARY\\DIFFUSION\\NONE\\ND'},
+}
+
+#*************************************************************************************
+# FUNCTIONS
+
+def encode_value(vr, value):
+# Value bytes for a VR, padded to even length
+    if vr in ['US', 'SS', 'UL', 'SL', 'FL', 'FD']:
+        fmt = {'US': 'H', 'SS': 'h', 'UL': 'I', 'SL': 'i', 'FL': 'f', 'FD': 'd'}[vr]
+        if type(value) is not list:
+            value = [value]
+        return struct.pack('<' + fmt * len(value), *value)
+    if type(value) is list:
+        value = '\\'.join([str(curr_value) for curr_value in value])
+    raw = str(value)
+    if len(raw) % 2:
+        if vr in ['UI', 'OB']:
+            raw = raw + '\0'
+        else:
+            raw = raw + ' '
+    return raw
+
+
+def encode_element(dcm_tag, vr, value):
+# Explicit VR little endian element
+    group, element = [int(part, 16) for part in dcm_tag.split(',')]
+    raw = encode_value(vr, value)
+    if vr in list_long_vr:
+        return struct.pack('<HH', group, element) + vr + '\0\0' + struct.pack('<I', len(raw)) + raw
+    return struct.pack('<HH', group, element) + vr + struct.pack('<H', len(raw)) + raw
+
+
+def encode_dataset(list_elements):
+# list of (tag, vr, value), written in tag order
+    return ''.join([encode_element(dcm_tag, vr, value) for dcm_tag, vr, value in sorted(list_elements)])
+
+
+def encode_file_meta(sop_instance_uid):
+    meta = encode_dataset([
+        ('0002,0001', 'OB', '\0\1'),
+        ('0002,0002', 'UI', SOP_CLASS_MR),
+        ('0002,0003', 'UI', sop_instance_uid),
+        ('0002,0010', 'UI', TS_EXPLICIT_LE),
+        ('0002,0012', 'UI', UID_ROOT + '.1'),
+    ])
+    return '\0' * 128 + 'DICM' + encode_element('0002,0000', 'UL', len(meta)) + meta
+
+
+def make_phantom(num_slices, rows, cols, count_vol, rand):
+# Noisy ellipsoid with slow signal drift, uint16 [slices, rows, cols]
+    z, y, x = numpy.ogrid[-1:1:num_slices*1j, -1:1:rows*1j, -1:1:cols*1j]
+    inside = (x / 0.7) ** 2 + (y / 0.8) ** 2 + (z / 0.9) ** 2 <= 1
+    signal = numpy.where(inside, 800.0 * (1 + 0.0005 * count_vol), 10.0)
+    signal = signal + rand.normal(0, 8, size=signal.shape)
+    return numpy.clip(signal, 0, 4095).astype('<u2')
+
+
+def tile_mosaic(volume):
+# [slices, rows, cols] -> one MOSAIC image, ceil(sqrt(slices)) tiles across
+    num_slices, rows, cols = volume.shape
+    num_tiles = int(numpy.ceil(numpy.sqrt(num_slices)))
+    mosaic = numpy.zeros((num_tiles * rows, num_tiles * cols), dtype=volume.dtype)
+    for count_slice in range(num_slices):
+        tile_row, tile_col = divmod(count_slice, num_tiles)
+        mosaic[tile_row*rows:(tile_row+1)*rows, tile_col*cols:(tile_col+1)*cols] = volume[count_slice]
+    return mosaic
+
+
+def write_dcm(fname_dcm, list_elements, pixels, sop_instance_uid):
+    f = open(fname_dcm, 'wb')
+    f.write(encode_file_meta(sop_instance_uid))
+    f.write(encode_dataset(list_elements))
+    f.write(encode_element('7fe0,0010', 'OW', pixels.tostring()))
+    f.close()
+
+
+def write_series(dir_series, protocol, subj_name, subj_id, count_subj, scale, rand):
+# One series of a protocol, returns number of files written
+    os.makedirs(dir_series)
+    num_vol = protocol['num_vol']
+    if num_vol > 1:
+        num_vol = max(2, int(round(num_vol * scale)))
+    num_slices = protocol['num_slices']
+    orient = numpy.array(protocol['orient'], dtype=float)
+    normal = numpy.cross(orient[0:3], orient[3:6])
+    study_uid = '%s.%d' % (UID_ROOT, count_subj + 1)
+    series_uid = '%s.%d' % (study_uid, protocol['series_num'])
+
+    list_common = [
+        ('0008,0008', 'CS', protocol['image_type']),
+        ('0008,0016', 'UI', SOP_CLASS_MR),
+        ('0008,0020', 'DA', '20150722'),
+        ('0008,0030', 'TM', '101500'),
+        ('0008,0060', 'CS', 'MR'),
+        ('0008,0070', 'LO', 'SIEMENS'),
+        ('0008,1030', 'LO', 'POND^MR160'),
+        ('0008,103e', 'LO', os.path.basename(dir_series).split('-', 1)[1]),
+        ('0010,0010', 'PN', subj_name),
+        ('0010,0020', 'LO', subj_name + '-' + subj_id),
+        ('0010,0030', 'DA', '19900101'),
+        ('0010,0040', 'CS', '0'),
+        ('0010,1010', 'AS', '0'),
+        ('0010,1020', 'DS', '0'),
+        ('0010,1030', 'DS', '0'),
+        ('0010,2154', 'SH', '0'),
+        ('0018,0050', 'DS', protocol['slice_thick']),
+        ('0018,0080', 'DS', protocol['TR']),
+        ('0018,0081', 'DS', protocol['TE']),
+        ('0018,1310', 'US', protocol['acq_matrix']),
+        ('0018,1312', 'CS', 'ROW'),
+        ('0018,1314', 'DS', protocol['FA']),
+        ('0020,000d', 'UI', study_uid),
+        ('0020,000e', 'UI', series_uid),
+        ('0020,0011', 'IS', protocol['series_num']),
+        ('0020,0037', 'DS', protocol['orient']),
+        ('0028,0002', 'US', 1),
+        ('0028,0004', 'CS', 'MONOCHROME2'),
+        ('0028,0030', 'DS', protocol['pixel_spacing']),
+        ('0028,0100', 'US', 16),
+        ('0028,0101', 'US', 12),
+        ('0028,0102', 'US', 11),
+        ('0028,0103', 'US', 0),
+    ]
+    if protocol['TI'] is not None:
+        list_common.append(('0018,0082', 'DS', protocol['TI']))
+    if protocol['mosaic']:
+        list_common.append(('0019,0010', 'LO', 'SIEMENS MR HEADER'))
+        list_common.append(('0019,100a', 'US', num_slices))
+
+    count_instance = 0
+    for count_vol in range(num_vol):
+        volume = make_phantom(num_slices, protocol['rows'], protocol['cols'], count_vol, rand)
+        if protocol['mosaic']:
+            list_images = [(tile_mosaic(volume), 0)]
+        else:
+            list_images = [(volume[count_slice], count_slice) for count_slice in range(num_slices)]
+        for image, count_slice in list_images:
+            count_instance = count_instance + 1
+            slice_dist = (count_slice - num_slices / 2.0) * protocol['slice_thick']
+            position = normal * slice_dist - orient[0:3] * protocol['cols'] * protocol['pixel_spacing'][1] / 2 \
+                - orient[3:6] * protocol['rows'] * protocol['pixel_spacing'][0] / 2
+            sop_instance_uid = '%s.%d' % (series_uid, count_instance)
+            list_elements = list_common + [
+                ('0008,0018', 'UI', sop_instance_uid),
+                ('0020,0012', 'IS', count_vol + 1),
+                ('0020,0013', 'IS', count_instance),
+                ('0020,0032', 'DS', ['%.4f' % (value,) for value in position]),
+                ('0020,1041', 'DS', '%.4f' % (slice_dist,)),
+                ('0028,0010', 'US', image.shape[0]),
+                ('0028,0011', 'US', image.shape[1]),
+            ]
+            write_dcm('%s/IM-%04d.dcm' % (dir_series, count_instance), list_elements, image, sop_instance_uid)
+    return count_instance
+
+
+def make_corpus(dir_corpus, num_subj, scale, seed=0, verbose=0):
+# Returns list of (series dir, number of files)
+    rand = numpy.random.RandomState(seed)
+    list_series = []
+    for count_subj in range(num_subj):
+        subj_name = 'MR160-088-%04d' % (count_subj + 2,)
+        subj_id = '01'
+        dir_subj = '%s/MR160/%s-%s' % (dir_corpus, subj_name, subj_id)
+        for series_name in sorted(lut_protocols):
+            protocol = lut_protocols[series_name]
+            dir_series = '%s/%d-%s' % (dir_subj, protocol['series_num'], series_name)
+            num_dcm = write_series(dir_series, protocol, subj_name, subj_id, count_subj, scale, rand)
+            list_series.append((dir_series, num_dcm))
+            if verbose:
+                print '%s : %d files' % (dir_series, num_dcm)
+    return list_series
+
+#**********************************************************************
+
+def main():
+    usage = "Usage: "+program_name+" <options> dir_corpus \n" + \
+            "   or  "+program_name+" --help";
+    parser = OptionParser(usage)
+    parser.add_option("--num_subj", type="int", dest="num_subj",
+                        default=2, help="Number of subjects (sessions) [default = 2]")
+    parser.add_option("--scale", type="float", dest="scale",
+                        default=1.0, help="Fraction of fMRI / DTI volumes to write [default = 1.0]")
+    parser.add_option("--seed", type="int", dest="seed",
+                        default=0, help="Random seed for pixel noise [default = 0]")
+    parser.add_option("-c","--clobber", action="store_true", dest="clobber",
+                        default=0, help="overwrite output directory")
+    parser.add_option("-v","--verbose", action="store_true", dest="verbose",
+                        default=0, help="Verbose output")
+
+    options, args = parser.parse_args()
+    if len(args) == 1:
+        dir_corpus = args[0]
+    else:
+        parser.error("incorrect number of arguments")
+
+    if os.path.exists(dir_corpus + '/MR160'):
+        if not options.clobber:
+            raise SystemExit, '* ERROR - Corpus already exists, turn on CLOBBER to overwrite: %s' % (dir_corpus,)
+        import shutil
+        shutil.rmtree(dir_corpus + '/MR160')
+
+    make_corpus(dir_corpus, options.num_subj, options.scale, options.seed, options.verbose)
+
+if __name__ == '__main__' :
+    main()
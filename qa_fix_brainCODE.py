@@ -0,0 +1,364 @@
+#!/usr/bin/python
+
+# Fused QA + anonymise pipeline for brainCODE uploads
+#   DCM_QA.py checks and fix_dcm_brainCODE.py rewrites in one pass - every file of a series is
+#   mapped once, its header feeds the QA checks and, if the series passes, the anonymised copy
+#   is written from the same mapping
+
+#    File Name:  qa_fix_brainCODE.py
+#
+#   REVISIONS
+#       A - 2026-10-18 - Original Creation
+#       B - 2026-10-18 - Job journal, resumable runs (--journal, --resume)
+#       C - 2026-10-18 - With --journal, outputs / manifests / sinks fsync'd before the entry
+#       D - 2026-10-18 - File rewrite / dcmodify fallback and the -j pool from dcm_fix
+
+
+# NOTES
+#     1) CALL
+#   ./qa_fix_brainCODE.py -j 8 /data8/mrdata/MR160/MR160-088-0002-01 ../data >> QA_log.txt
+#   ./qa_fix_brainCODE.py -j 8 --full --quarantine ../quarantine /data8/mrdata/MR160/MR160-*-* ../data
+#        - Inputs are series or session directories, as fix_dcm_brainCODE.py. Subject name / ID of
+#          the patient checks come from the session directory name, as DCM_QA.py --batch
+#     2) QA is DCM_QA.py's - first / last headers, get_FOV_RES, patient info, --full consistency and
+#        the scan_params.cfg parameter rules. Output lines are the same, followed by a [WRITE] line
+#     3) A series is written when it matches a scan type of lut_scan_type.cfg and PASSes every
+#        scan_params.cfg scan type it matches. Series no QA scan type matches (ie. localizer) are
+#        NOT CHECKED and written, as running the two scripts one after the other did
+#     4) Failing series are skipped, or with --quarantine dir_quarantine written (anonymised, same
+#        layout) there instead, for review. Nothing of a failing series goes into dir_out_base
+#     5) Each series is one task of the -j pool. Its files stay mapped (dcm_read.DcmFile) from the
+#        QA to the rewrite (dcm_write.write_dcm), header pages read by the QA are the ones the
+#        rewrite copies, and the pixel data is only touched by the copy
+#     6) Files the native reader can't map are QA'd through dcmdump and rewritten through dcmodify,
+#        as in the two scripts
+#     7) No --pixel, --index, --prefetch or --fp_store here, run DCM_QA.py for those
+#     8) --journal qa_fix_journal.jsonl records each series once it is written (or quarantined /
+#        skipped) and its QA results are in the -o sinks, --resume then only redoes the series that
+#        are not in the journal (dcm_journal.py, stage qa_fix)
+
+
+from optparse import OptionParser, Option, OptionValueError
+import os, sys
+import struct
+import DCM_QA
+import fix_dcm_brainCODE
+import dcm_fix
+import dcm_read
+import dcm_write
+import dcm_series
+import dcm_scan_type
+import dcm_manifest
+import dcm_sink
+import dcm_profile
+import dcm_journal
+
+program_name = 'qa_fix_brainCODE.py'
+
+#*************************************************************************************
+# FUNCTIONS
+
+def get_tag_values(lut_dcm_files, full_name_dcm, lut_tags):
+# {field: value} of a file, from its mapping when it has one, as DCM_QA.get_dcm_value
+    list_tags = lut_tags.values()
+    dcm_file = lut_dcm_files.get(full_name_dcm)
+    with dcm_profile.timer('read_hdr'):
+        dcm_values = None
+        if dcm_file is not None:
+            try:
+                dcm_values = dcm_file.get_values(list_tags)
+            except (dcm_read.DcmReadError, struct.error, ValueError):
+                dcm_values = None
+        if dcm_values is None:
+            dcm_values = DCM_QA.read_dcm_hdr(full_name_dcm, list_tags, 0)
+    tag_values = {}
+    for curr_tag in lut_tags:
+        tag_values[curr_tag] = dcm_values[lut_tags[curr_tag]]
+    return tag_values
+
+def open_series(dir_series):
+# {file: DcmFile} of every file in a series directory, None for files that can't be mapped
+    lut_dcm_files = {}
+    for fname_scan in os.listdir(dir_series):
+        full_name_dcm = '%s/%s' % (dir_series, fname_scan)
+        if not os.path.isfile(full_name_dcm):
+            continue
+        try:
+            lut_dcm_files[full_name_dcm] = dcm_read.DcmFile(full_name_dcm)
+        except (dcm_read.DcmReadError, struct.error, ValueError, EnvironmentError):
+            lut_dcm_files[full_name_dcm] = None
+    return lut_dcm_files
+
+def qa_series(dir_subj_in, dir_curr_scan, lut_dcm_files, scan_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, options):
+# DCM_QA.qa_scan on the mapped files of a series, one record per matching scan type
+    list_records = []
+    for scan_type in dcm_scan_type.classify_scan(scan_classifier, dir_curr_scan):
+        SCAN_PASS = 1
+        SCAN_LOG = []
+        tag_values = {}
+        params_out = {}
+
+        with dcm_profile.timer('list'):
+            list_files_curr_scan = dcm_series.list_series_files('%s/%s' % (dir_subj_in, dir_curr_scan), \
+                options.ext_type.split(','), options.sniff)
+        num_dcm = len(list_files_curr_scan)
+        if num_dcm == 0:
+            SCAN_PASS = 0
+            SCAN_LOG = SCAN_LOG + ['        [NUM_DCM] : no dicoms found : FAIL']
+        else:
+            tag_values['first'] = get_tag_values(lut_dcm_files, list_files_curr_scan[0], lut_dcm_hdr)
+            tag_values['last']  = get_tag_values(lut_dcm_files, list_files_curr_scan[-1], lut_dcm_hdr)
+            with dcm_profile.timer('get_FOV_RES'):
+                params_out = DCM_QA.get_FOV_RES(tag_values, num_dcm, params_out)
+            SCAN_PASS, SCAN_LOG = DCM_QA.check_patient_info(tag_values['first'], lut_ID_fields, SCAN_PASS, SCAN_LOG)
+
+            if options.full:
+                with dcm_profile.timer('full'):
+                    lut_full_hdr = {}
+                    for field in dcm_series.lut_full_fields:
+                        lut_full_hdr[field] = lut_dcm_hdr[field]
+                    hdr_series = dcm_series.load_series_hdr(list_files_curr_scan, \
+                        lambda fname_dcm: get_tag_values(lut_dcm_files, fname_dcm, lut_full_hdr))
+                    SCAN_PASS, SCAN_LOG = dcm_series.check_series_full(hdr_series, \
+                        'MOSAIC' in tag_values['first']['ImageType'], options.TOL, SCAN_PASS, SCAN_LOG)
+
+        list_records.append({'dir_subj': dir_subj_in, 'dir_scan': dir_curr_scan, 'scan_type': scan_type, \
+            'num_dcm': num_dcm, 'params_out': params_out, 'SCAN_PASS': SCAN_PASS, 'SCAN_LOG': SCAN_LOG, \
+            'pixel_metrics': {}, 'fingerprint': None})
+    return list_records
+
+def make_series_dir(dir_out_full):
+# Output directory of a series, parents may be made by another worker at the same time
+    try:
+        os.makedirs(dir_out_full)
+    except OSError:
+        if not os.path.isdir(dir_out_full):
+            raise
+
+def write_series_file(dcm_file, full_name_in, full_name_out, lut_dcm_series, verbose, algorithm):
+# Anonymised copy of a file from its mapping, the files without one are read again (dcm_fix)
+    return dcm_fix.fix_dcm_file(full_name_in, full_name_out, lut_dcm_series, 0, verbose, algorithm, dcm_file)
+
+def write_series(lut_dcm_files, dir_base, list_fix, algorithm, verbose):
+# Write a series under dir_base, once per fix scan type it matches
+#   Returns the messages and the {dir_out_rel: checksum} of its manifests
+    list_msgs = []
+    lut_outputs = {}
+    for dir_out_rel, lut_dcm_series in list_fix:
+        dir_out_full = '%s/%s' % (dir_base, dir_out_rel)
+        make_series_dir(dir_out_full)
+        list_rows = []
+        for full_name_in in sorted(lut_dcm_files):
+            fname_scan = full_name_in.rsplit('/', 1)[1]
+            list_msgs_file, lut_hashes = write_series_file(lut_dcm_files[full_name_in], full_name_in, \
+                '%s/%s' % (dir_out_full, fname_scan), lut_dcm_series, verbose, algorithm)
+            list_msgs = list_msgs + list_msgs_file
+            if lut_hashes is not None:
+                list_rows.append(dcm_manifest.get_row(fname_scan, algorithm, lut_hashes))
+        if algorithm:
+            dcm_manifest.write_manifest(dir_out_full, list_rows, dcm_write.sync_writes)
+            lut_outputs[dir_out_rel] = dcm_journal.get_checksum(algorithm, list_rows)
+        else:
+            dcm_manifest.remove_manifest(dir_out_full)
+        if dcm_write.sync_writes:
+            dcm_write.sync_dirs(dir_base, dir_out_rel)
+    return list_msgs, lut_outputs
+
+def qa_fix_worker(task):
+#   One series, QA then (if it passes) the anonymised copy, from one mapping of each file
+#   Returns the checked QA records, the [WRITE] lines and messages, the outcome of the series
+#   and its output checksums (dcm_journal), and the error if any
+    dir_subj_in, dir_curr_scan, scan_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, list_fix, \
+        dir_out_base, options = task
+    list_records = []
+    list_lines = []
+    list_msgs = []
+    outcome = 'not written'
+    lut_outputs = {}
+    error = None
+    lut_dcm_files = {}
+    try:
+        lut_dcm_files = open_series('%s/%s' % (dir_subj_in, dir_curr_scan))
+        with dcm_profile.timer('qa_scan'):
+            list_records = qa_series(dir_subj_in, dir_curr_scan, lut_dcm_files, scan_classifier, lut_scans, \
+                lut_dcm_hdr, lut_ID_fields, options)
+        with dcm_profile.timer('rules'):
+            list_records = DCM_QA.check_scan_records(list_records, lut_scans, options.TOL, options.verbose)
+        SERIES_PASS = min([1] + [record['SCAN_PASS'] for record in list_records])
+
+        if len(list_fix) > 0:
+            if SERIES_PASS:
+                dir_base = dir_out_base
+                tag_write = 'WRITE'
+                outcome = 'written'
+            else:
+                dir_base = options.dir_quarantine
+                tag_write = 'QUARANTINE'
+                outcome = 'quarantined'
+            if not dir_base:
+                list_lines.append('        [WRITE] : series failed QA : SKIPPED')
+                outcome = 'skipped'
+            else:
+                if not options.debug:
+                    list_msgs, lut_outputs = write_series(lut_dcm_files, dir_base, list_fix, options.manifest, \
+                        options.verbose)
+                for dir_out_rel, lut_dcm_series in list_fix:
+                    list_lines.append('        [%s] : %s/%s (%d files)' % (tag_write, dir_base, dir_out_rel, len(lut_dcm_files)))
+    except Exception, e:
+        error = '%s/%s : %s' % (dir_subj_in, dir_curr_scan, e)
+    finally:
+        for dcm_file in lut_dcm_files.values():
+            if dcm_file is not None:
+                dcm_file.close()
+    return list_records, list_lines, list_msgs, outcome, lut_outputs, error, dcm_profile.drain()    # stage timings travel back with the result
+
+#**********************************************************************
+
+def main():
+    usage = "Usage: "+program_name+" <options> dir_input [dir_input ...] dir_out_base \n" + \
+            "   dir_input is a series directory or a session directory (all of its series)\n" + \
+            "   or  "+program_name+" --help";
+    parser = OptionParser(usage)
+    parser.add_option("--sp", type="string", dest="fname_scan_params",
+                        default="scan_params.cfg", help="Acceptable scan parameters[default = scan_params.cfg]")
+    parser.add_option("--lut_ST", type="string", dest="fname_lut_scan_type",
+                        default="lut_scan_type.cfg", help="Lut to convert default Scan Description into defined ScanType [default = lut_scan_type.cfg]")
+    parser.add_option("--lut_dcm_list", type="string", dest="fname_dcm_list",
+                        default="dcm_mod_basic.txt", help="Common dicom elements to wipe [default = dcm_mod_basic.txt]")
+    parser.add_option("--TOL", type="float", dest="TOL",
+                        default = 0.01,help="Allow tolerance on numerical values (Default = 1%)")
+    parser.add_option("-e", "--ext",type="string", dest="ext_type",
+                        default="dcm,DCM,ima,IMA", help="Allowable dicom file extension [default = dcm,DCM,ima,IMA]")
+    parser.add_option("--sniff", action="store_true", dest="sniff",
+                        default=0, help="Find dicoms by DICM magic instead of file extension (ie. files with no extension)")
+    parser.add_option("--full", action="store_true", dest="full",
+                        default=0, help="Check consistency of every file in a series, not just first and last")
+    parser.add_option("--quarantine", type="string", dest="dir_quarantine",
+                        default="", help="Write series that fail QA (anonymised) here instead of skipping them")
+    parser.add_option("--manifest", type="choice", dest="manifest", choices=[''] + dcm_manifest.list_algorithms,
+                        default="", help="Hash the output files while writing them, into %s of each output series (%s)" % \
+                        (dcm_manifest.FNAME_MANIFEST, '|'.join(dcm_manifest.list_algorithms)))
+    parser.add_option("-c","--clobber", action="store_true", dest="clobber",
+                        default=0, help="overwrite output file")
+    parser.add_option("-v","--verbose", action="store_true", dest="verbose",
+                        default=0, help="Verbose output")
+    parser.add_option("-d","--debug", action="store_true", dest="debug",
+                        default=0, help="Run in debug mode, QA only, nothing is written")
+    parser.add_option("-j","--num_proc", type="int", dest="num_proc",
+                        default=1, help="Number of worker processes [default = 1]")
+    parser.add_option("-o","--out", type="string", dest="list_out", action="append",
+                        default=[], help="Structured QA results, .jsonl / .csv / .db (SQLite), appended to, can be repeated")
+    parser.add_option("--journal", type="string", dest="fname_journal",
+                        default="", help="Append each finished series to this job journal (.jsonl), implies --manifest %s [default = off]" % \
+                        (dcm_journal.JOURNAL_ALGORITHM,))
+    parser.add_option("--resume", action="store_true", dest="resume",
+                        default=0, help="Skip series already in --journal and redo the rest, ie. after a crashed run")
+    parser.add_option("--profile", action="store_true", dest="profile",
+                        default=0, help="Time each stage, summary printed to stderr at exit")
+    parser.add_option("--profile_out", type="string", dest="fname_profile",
+                        default="", help="Also write the stage timings to a .json or .csv file (implies --profile)")
+
+    options, args = parser.parse_args()
+    dcm_profile.setup(options.profile, options.fname_profile)
+
+    if len(args) >= 2:
+        list_dir_input, dir_out_base = args[:-1], args[-1]
+    else:
+        parser.error("incorrect number of arguments")
+    if options.resume and not options.fname_journal:
+        parser.error("--resume needs --journal")
+    journal = None
+    if options.fname_journal:
+        journal = dcm_journal.DcmJournal(options.fname_journal)
+        if not options.manifest:
+            options.manifest = dcm_journal.JOURNAL_ALGORITHM      # output checksums of the journal entries
+        dcm_write.sync_writes = 1       # journalled outputs are on disk, set before the pool forks
+
+    # Configs are loaded and the classifiers built once
+    lut_dcm_hdrs = fix_dcm_brainCODE.load_dcm_list(options.fname_dcm_list)
+    lut_scan_type = fix_dcm_brainCODE.load_lut_scan_type(options.fname_lut_scan_type)
+    fix_classifier = dcm_scan_type.build_classifier(sorted(lut_scan_type))
+    qa_classifier = None
+    lut_sessions = {}
+
+    # One task per series, every output directory is checked before anything is written
+    list_tasks = []
+    num_resumed = 0
+    for dir_subj_in, dir_curr_scan in fix_dcm_brainCODE.list_input_series(list_dir_input):
+        if options.resume and journal.is_done(dir_subj_in, dir_curr_scan, dcm_journal.STAGE_QA_FIX):
+            num_resumed = num_resumed + 1
+            continue
+        if dir_subj_in not in lut_sessions:
+            subj_name, subj_id = DCM_QA.parse_subject_dir(os.path.abspath(dir_subj_in))
+            lut_sessions[dir_subj_in] = DCM_QA.load_MR_params(options.fname_scan_params, subj_name, subj_id) + \
+                fix_dcm_brainCODE.parse_session_dir(dir_subj_in)
+        lut_scans, lut_dcm_hdr, lut_ID_fields, subjectID, new_sessionName = lut_sessions[dir_subj_in]
+        if qa_classifier is None:
+            qa_classifier = dcm_scan_type.build_classifier(sorted(lut_scans))
+        dir_target_series_num = dcm_scan_type.clean_name(dir_curr_scan).split('_')[0]
+
+        list_fix = []
+        for scan_type in dcm_scan_type.classify_scan(fix_classifier, dir_curr_scan):
+            new_scanType = lut_scan_type[scan_type]
+            dir_out_rel = '%s/%s/%s-%s' % (subjectID, new_sessionName, dir_target_series_num, new_scanType)
+            for dir_base in [dir_out_base, options.dir_quarantine]:
+                if dir_base and os.path.exists('%s/%s' % (dir_base, dir_out_rel)) and not options.clobber and \
+                        not options.resume:
+                    raise SystemExit, '* ERROR - Output directory already exists, turn on CLOBBER to overwrite: %s/%s' % \
+                        (dir_base, dir_out_rel)
+                if dir_base and options.resume:
+                    fix_dcm_brainCODE.remove_tmp_files('%s/%s' % (dir_base, dir_out_rel), options.debug, options.verbose)
+            # entries of the common list win over the per series fields, as in fix_dcm_brainCODE.py
+            lut_dcm_series = {'0010,0010': subjectID, '0010,0020': new_sessionName, '0008,103e': new_scanType}
+            lut_dcm_series.update(lut_dcm_hdrs)
+            list_fix.append((dir_out_rel, lut_dcm_series))
+
+        list_tasks.append((dir_subj_in, dir_curr_scan, qa_classifier, lut_scans, lut_dcm_hdr, lut_ID_fields, list_fix, \
+            dir_out_base, options))
+
+    if options.resume:
+        print 'Resumed : %d series already in %s' % (num_resumed, options.fname_journal)
+    list_sinks = [dcm_sink.open_sink(fname_out) for fname_out in options.list_out]
+    run_time = dcm_sink.get_run_time()
+
+    # Output in series order, as DCM_QA.py --batch
+    list_errors = []
+    dir_subj_prev = None
+    count_task = 0
+    for list_records, list_lines, list_msgs, outcome, lut_outputs, error in dcm_fix.imap_tasks(qa_fix_worker, \
+            list_tasks, options.num_proc):
+        dir_subj_in, dir_curr_scan = list_tasks[count_task][0:2]
+        if dir_subj_in != dir_subj_prev:
+            print dir_subj_in
+            dir_subj_prev = dir_subj_in
+        DCM_QA.write_scan_records(list_sinks, list_records, run_time)
+        for msg in list_msgs:
+            print msg
+        for record in list_records:
+            for line in DCM_QA.format_scan_record(record):
+                print line
+        if len(list_records) == 0 and len(list_lines) > 0:
+            print '    %s - NOT CHECKED' % (dir_curr_scan,)
+        for line in list_lines:
+            print line
+        if error is not None:
+            print '* ERROR - %s' % (error,)
+            list_errors.append(error)
+        elif journal is not None and not options.debug:
+            # the QA results are in the sinks, on disk, before the series is journalled
+            for sink in list_sinks:
+                sink.sync()
+            journal.write([journal.make_entry(dir_subj_in, dir_curr_scan, dcm_journal.STAGE_QA_FIX, outcome, \
+                lut_outputs, options.manifest)])
+        sys.stdout.flush()
+        count_task = count_task + 1
+
+    for sink in list_sinks:
+        sink.close()
+    if journal is not None:
+        journal.close()
+    if list_errors:
+        raise SystemExit, '* ERROR - %d of %d series could not be processed' % (len(list_errors), len(list_tasks))
+
+if __name__ == '__main__' :
+    main()